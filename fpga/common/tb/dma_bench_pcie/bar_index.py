@@ -0,0 +1 @@
+../../lib/pcie/tb/bar_index.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../lib/pcie/tb/model_trace.py
\ No newline at end of file
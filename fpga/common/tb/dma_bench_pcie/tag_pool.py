@@ -0,0 +1 @@
+../../lib/pcie/tb/tag_pool.py
\ No newline at end of file
@@ -25,6 +25,10 @@ THE SOFTWARE.
 from myhdl import *
 import math
 import mmap
+from collections import defaultdict
+
+from byte_enable import write_masked
+from frame_queue import FrameQueue
 
 BURST_FIXED = 0b00
 BURST_INCR = 0b01
@@ -82,35 +86,53 @@ RESP_EXOKAY = 0b01
 RESP_SLVERR = 0b10
 RESP_DECERR = 0b11
 
+
+def burst_addresses(addr, length, size, burst):
+    """Return the address of each beat of a burst of length beats"""
+    num_bytes = 2**size
+    aligned_addr = addr - addr % num_bytes
+
+    if burst == BURST_FIXED:
+        return [aligned_addr]*length
+
+    if burst == BURST_WRAP:
+        transfer_size = num_bytes*length
+        lower_wrap_boundary = addr - addr % transfer_size
+        offset = aligned_addr - lower_wrap_boundary
+        return [lower_wrap_boundary + (offset + k*num_bytes) % transfer_size for k in range(length)]
+
+    return list(range(aligned_addr, aligned_addr+num_bytes*length, num_bytes))
+
+
 class AXIMaster(object):
     def __init__(self):
-        self.write_command_queue = []
+        self.write_command_queue = FrameQueue()
         self.write_command_sync = Signal(False)
-        self.write_resp_queue = []
+        self.write_resp_queue = FrameQueue()
         self.write_resp_sync = Signal(False)
 
-        self.read_command_queue = []
+        self.read_command_queue = FrameQueue()
         self.read_command_sync = Signal(False)
-        self.read_data_queue = []
+        self.read_data_queue = FrameQueue()
         self.read_data_sync = Signal(False)
 
         self.cur_write_id = 0
         self.cur_read_id = 0
 
-        self.int_write_addr_queue = []
+        self.int_write_addr_queue = FrameQueue()
         self.int_write_addr_sync = Signal(False)
-        self.int_write_data_queue = []
+        self.int_write_data_queue = FrameQueue()
         self.int_write_data_sync = Signal(False)
-        self.int_write_resp_command_queue = []
+        self.int_write_resp_command_queue = FrameQueue()
         self.int_write_resp_command_sync = Signal(False)
-        self.int_write_resp_queue = []
+        self.int_write_resp_queue = FrameQueue()
         self.int_write_resp_sync = Signal(False)
 
-        self.int_read_addr_queue = []
+        self.int_read_addr_queue = FrameQueue()
         self.int_read_addr_sync = Signal(False)
-        self.int_read_resp_command_queue = []
+        self.int_read_resp_command_queue = FrameQueue()
         self.int_read_resp_command_sync = Signal(False)
-        self.int_read_resp_queue_list = {}
+        self.int_read_resp_queue_list = defaultdict(FrameQueue)
         self.int_read_resp_sync = Signal(False)
 
         self.in_flight_operations = 0
@@ -140,7 +162,7 @@ class AXIMaster(object):
 
     def get_read_data(self):
         if self.read_data_queue:
-            return self.read_data_queue.pop(0)
+            return self.read_data_queue.popleft()
         return None
 
     def create_logic(self,
@@ -252,7 +274,7 @@ class AXIMaster(object):
                     print("Error: attempted write on read-only interface")
                     raise StopSimulation
 
-                addr, data, burst, size, lock, cache, prot, qos, region, user = self.write_command_queue.pop(0)
+                addr, data, burst, size, lock, cache, prot, qos, region, user = self.write_command_queue.popleft()
                 self.in_flight_operations += 1
 
                 num_bytes = bw
@@ -328,7 +350,7 @@ class AXIMaster(object):
                 if not self.int_write_resp_command_queue:
                     yield self.int_write_resp_command_sync
 
-                addr, length, transfer_count, prot = self.int_write_resp_command_queue.pop(0)
+                addr, length, transfer_count, prot = self.int_write_resp_command_queue.popleft()
 
                 resp = 0
 
@@ -336,7 +358,7 @@ class AXIMaster(object):
                     while not self.int_write_resp_queue:
                         yield clk.posedge
 
-                    cycle_id, cycle_resp, cycle_user = self.int_write_resp_queue.pop(0)
+                    cycle_id, cycle_resp, cycle_user = self.int_write_resp_queue.popleft()
 
                     if cycle_resp != 0:
                         resp = cycle_resp
@@ -351,7 +373,7 @@ class AXIMaster(object):
                 while not self.int_write_addr_queue:
                     yield clk.posedge
 
-                addr, awid, length, size, burst, lock, cache, prot, qos, region, user = self.int_write_addr_queue.pop(0)
+                addr, awid, length, size, burst, lock, cache, prot, qos, region, user = self.int_write_addr_queue.popleft()
                 if m_axi_awaddr is not None:
                     m_axi_awaddr.next = addr
                 m_axi_awid.next = awid
@@ -381,7 +403,7 @@ class AXIMaster(object):
                 while not self.int_write_data_queue:
                     yield clk.posedge
 
-                m_axi_wdata.next, m_axi_wstrb.next, m_axi_wlast.next = self.int_write_data_queue.pop(0)
+                m_axi_wdata.next, m_axi_wstrb.next, m_axi_wlast.next = self.int_write_data_queue.popleft()
                 m_axi_wvalid.next = not (pause or wpause)
 
                 yield clk.posedge
@@ -422,7 +444,7 @@ class AXIMaster(object):
                     print("Error: attempted read on write-only interface")
                     raise StopSimulation
 
-                addr, length, burst, size, lock, cache, prot, qos, region, user = self.read_command_queue.pop(0)
+                addr, length, burst, size, lock, cache, prot, qos, region, user = self.read_command_queue.popleft()
                 self.in_flight_operations += 1
 
                 num_bytes = bw
@@ -476,7 +498,7 @@ class AXIMaster(object):
                 if not self.int_read_resp_command_queue:
                     yield self.int_read_resp_command_sync
 
-                addr, length, size, cycles, prot, burst_list = self.int_read_resp_command_queue.pop(0)
+                addr, length, size, cycles, prot, burst_list = self.int_read_resp_command_queue.popleft()
 
                 num_bytes = 2**size
                 assert 0 <= size <= int(math.log(bw, 2))
@@ -507,11 +529,10 @@ class AXIMaster(object):
                     burst_length = cur_burst[1]
 
                     for k in range(burst_length):
-                        self.int_read_resp_queue_list.setdefault(rid, [])
                         while not self.int_read_resp_queue_list[rid]:
                             yield self.int_read_resp_sync
 
-                        cycle_id, cycle_data, cycle_resp, cycle_last, cycle_user = self.int_read_resp_queue_list[rid].pop(0)
+                        cycle_id, cycle_data, cycle_resp, cycle_last, cycle_user = self.int_read_resp_queue_list[rid].popleft()
 
                         if cycle_resp != 0:
                             resp = cycle_resp
@@ -546,7 +567,7 @@ class AXIMaster(object):
                 while not self.int_read_addr_queue:
                     yield clk.posedge
 
-                addr, arid, length, size, burst, lock, cache, prot, qos, region, user = self.int_read_addr_queue.pop(0)
+                addr, arid, length, size, burst, lock, cache, prot, qos, region, user = self.int_read_addr_queue.popleft()
                 m_axi_araddr.next = addr
                 if m_axi_arid is not None:
                     m_axi_arid.next = arid
@@ -589,7 +610,6 @@ class AXIMaster(object):
                         ruser = int(m_axi_ruser)
                     else:
                         ruser = 0
-                    self.int_read_resp_queue_list.setdefault(rid, [])
                     self.int_read_resp_queue_list[rid].append((rid, rdata, rresp, rlast, ruser))
                     self.int_read_resp_sync.next = not self.int_read_resp_sync
 
@@ -601,16 +621,16 @@ class AXIRam(object):
         self.size = size
         self.mem = mmap.mmap(-1, size)
 
-        self.int_write_addr_queue = []
+        self.int_write_addr_queue = FrameQueue()
         self.int_write_addr_sync = Signal(False)
-        self.int_write_data_queue = []
+        self.int_write_data_queue = FrameQueue()
         self.int_write_data_sync = Signal(False)
-        self.int_write_resp_queue = []
+        self.int_write_resp_queue = FrameQueue()
         self.int_write_resp_sync = Signal(False)
 
-        self.int_read_addr_queue = []
+        self.int_read_addr_queue = FrameQueue()
         self.int_read_addr_sync = Signal(False)
-        self.int_read_resp_queue = []
+        self.int_read_resp_queue = FrameQueue()
         self.int_read_resp_sync = Signal(False)
 
     def read_mem(self, address, length):
@@ -621,6 +641,10 @@ class AXIRam(object):
         self.mem.seek(address % self.size)
         self.mem.write(bytes(data))
 
+    def write_word(self, address, data, strb, width):
+        """Write width bytes of integer data at address, masked by write strobe"""
+        return write_masked(self.mem, address, data, strb, width)
+
     def create_port(self,
                 clk,
                 s_axi_awid=None,
@@ -714,7 +738,7 @@ class AXIRam(object):
                 if not self.int_write_addr_queue:
                     yield self.int_write_addr_sync
 
-                addr, awid, length, size, burst, lock, cache, prot = self.int_write_addr_queue.pop(0)
+                addr, awid, length, size, burst, lock, cache, prot = self.int_write_addr_queue.popleft()
 
                 if name is not None:
                     print("[%s] Write burst awid: 0x%x awaddr: 0x%08x awlen: %d awsize: %d" % (name, awid, addr, length, size))
@@ -722,40 +746,24 @@ class AXIRam(object):
                 num_bytes = 2**size
                 assert 0 < num_bytes <= bw
 
-                aligned_addr = int(addr/num_bytes)*num_bytes
                 length = length+1
 
-                transfer_size = num_bytes*length
-
-                if burst == BURST_WRAP:
-                    lower_wrap_boundary = int(addr/transfer_size)*transfer_size
-                    upper_wrap_boundary = lower_wrap_boundary+transfer_size
+                addr_list = burst_addresses(addr, length, size, burst)
 
                 if burst == BURST_INCR:
                     # check for 4k boundary crossing
-                    assert 0x1000-(aligned_addr&0xfff) >= transfer_size
-
-                cur_addr = aligned_addr
+                    assert 0x1000-(addr_list[0]&0xfff) >= num_bytes*length
 
-                for n in range(length):
-                    cur_word_addr = int(cur_addr/bw)*bw
+                for n, cur_addr in enumerate(addr_list):
+                    cur_word_addr = cur_addr - cur_addr % bw
 
                     if not self.int_write_data_queue:
                         yield self.int_write_data_sync
 
-                    wdata, strb, last = self.int_write_data_queue.pop(0)
+                    wdata, strb, last = self.int_write_data_queue.popleft()
 
-                    self.mem.seek(cur_word_addr % self.size)
+                    data = self.write_word(cur_word_addr % self.size, wdata, strb, bw)
 
-                    data = bytearray()
-                    for i in range(bw):
-                        data.extend(bytearray([wdata & 0xff]))
-                        wdata >>= 8
-                    for i in range(bw):
-                        if strb & (1 << i):
-                            self.mem.write(bytes(data[i:i+1]))
-                        else:
-                            self.mem.seek(1, 1)
                     if n == length-1:
                         self.int_write_resp_queue.append((awid, 0b00))
                         self.int_write_resp_sync.next = not self.int_write_resp_sync
@@ -764,14 +772,7 @@ class AXIRam(object):
                         raise StopSimulation
                     assert last == (n == length-1)
                     if name is not None:
-                        print("[%s] Write word id: %d addr: 0x%08x prot: 0x%x wstrb: 0x%02x data: %s" % (name, awid, cur_addr, prot, s_axi_wstrb, " ".join(("{:02x}".format(c) for c in bytearray(data)))))
-
-                    if burst != BURST_FIXED:
-                        cur_addr += num_bytes
-
-                        if burst == BURST_WRAP:
-                            if cur_addr == upper_wrap_boundary:
-                                cur_addr = lower_wrap_boundary
+                        print("[%s] Write word id: %d addr: 0x%08x prot: 0x%x wstrb: 0x%02x data: %s" % (name, awid, cur_addr, prot, strb, " ".join(("{:02x}".format(c) for c in data))))
 
         @instance
         def write_addr_interface_logic():
@@ -815,7 +816,7 @@ class AXIRam(object):
                 while not self.int_write_resp_queue:
                     yield clk.posedge
 
-                bid, bresp = self.int_write_resp_queue.pop(0)
+                bid, bresp = self.int_write_resp_queue.popleft()
                 if s_axi_bid is not None:
                     s_axi_bid.next = bid
                 s_axi_bresp.next = bresp
@@ -835,7 +836,7 @@ class AXIRam(object):
                 if not self.int_read_addr_queue:
                     yield self.int_read_addr_sync
 
-                addr, arid, length, size, burst, lock, cache, prot = self.int_read_addr_queue.pop(0)
+                addr, arid, length, size, burst, lock, cache, prot = self.int_read_addr_queue.popleft()
 
                 if name is not None:
                     print("[%s] Read burst arid: 0x%x araddr: 0x%08x arlen: %d arsize: %d" % (name, arid, addr, length, size))
@@ -843,42 +844,23 @@ class AXIRam(object):
                 num_bytes = 2**size
                 assert 0 < num_bytes <= bw
 
-                aligned_addr = int(addr/num_bytes)*num_bytes
                 length = length+1
 
-                transfer_size = num_bytes*length
-
-                if burst == BURST_WRAP:
-                    lower_wrap_boundary = int(addr/transfer_size)*transfer_size
-                    upper_wrap_boundary = lower_wrap_boundary+transfer_size
+                addr_list = burst_addresses(addr, length, size, burst)
 
                 if burst == BURST_INCR:
                     # check for 4k boundary crossing
-                    assert 0x1000-(aligned_addr&0xfff) >= transfer_size
+                    assert 0x1000-(addr_list[0]&0xfff) >= num_bytes*length
 
-                cur_addr = aligned_addr
+                for n, cur_addr in enumerate(addr_list):
+                    cur_word_addr = (cur_addr - cur_addr % bw) % self.size
 
-                for n in range(length):
-                    cur_word_addr = int(cur_addr/bw)*bw
-
-                    self.mem.seek(cur_word_addr % self.size)
-
-                    data = bytearray(self.mem.read(bw))
-                    val = 0
-                    for i in range(bw-1,-1,-1):
-                        val <<= 8
-                        val += data[i]
-                    self.int_read_resp_queue.append((arid, val, 0x00, n == length-1))
-                    self.int_read_resp_sync.next = not self.int_read_resp_sync
+                    data = self.mem[cur_word_addr:cur_word_addr+bw]
+                    self.int_read_resp_queue.append((arid, int.from_bytes(data, 'little'), 0x00, n == length-1))
                     if name is not None:
-                        print("[%s] Read word id: %d addr: 0x%08x prot: 0x%x data: %s" % (name, arid, cur_addr, prot, " ".join(("{:02x}".format(c) for c in bytearray(data)))))
-
-                    if burst != BURST_FIXED:
-                        cur_addr += num_bytes
+                        print("[%s] Read word id: %d addr: 0x%08x prot: 0x%x data: %s" % (name, arid, cur_addr, prot, " ".join(("{:02x}".format(c) for c in data))))
 
-                        if burst == BURST_WRAP:
-                            if cur_addr == upper_wrap_boundary:
-                                cur_addr = lower_wrap_boundary
+                self.int_read_resp_sync.next = not self.int_read_resp_sync
 
         @instance
         def read_addr_interface_logic():
@@ -908,7 +890,7 @@ class AXIRam(object):
                 while not self.int_read_resp_queue:
                     yield clk.posedge
 
-                rid, rdata, rresp, rlast = self.int_read_resp_queue.pop(0)
+                rid, rdata, rresp, rlast = self.int_read_resp_queue.popleft()
                 if s_axi_rid is not None:
                     s_axi_rid.next = rid
                 s_axi_rdata.next = rdata
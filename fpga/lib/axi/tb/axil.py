@@ -25,6 +25,9 @@ THE SOFTWARE.
 from myhdl import *
 import mmap
 
+from byte_enable import write_masked
+from frame_queue import FrameQueue
+
 PROT_PRIVILEGED = 0b001
 PROT_NONSECURE = 0b010
 PROT_INSTRUCTION = 0b100
@@ -36,30 +39,30 @@ RESP_DECERR = 0b11
 
 class AXILiteMaster(object):
     def __init__(self):
-        self.write_command_queue = []
+        self.write_command_queue = FrameQueue()
         self.write_command_sync = Signal(False)
-        self.write_resp_queue = []
+        self.write_resp_queue = FrameQueue()
         self.write_resp_sync = Signal(False)
 
-        self.read_command_queue = []
+        self.read_command_queue = FrameQueue()
         self.read_command_sync = Signal(False)
-        self.read_data_queue = []
+        self.read_data_queue = FrameQueue()
         self.read_data_sync = Signal(False)
 
-        self.int_write_addr_queue = []
+        self.int_write_addr_queue = FrameQueue()
         self.int_write_addr_sync = Signal(False)
-        self.int_write_data_queue = []
+        self.int_write_data_queue = FrameQueue()
         self.int_write_data_sync = Signal(False)
-        self.int_write_resp_command_queue = []
+        self.int_write_resp_command_queue = FrameQueue()
         self.int_write_resp_command_sync = Signal(False)
-        self.int_write_resp_queue = []
+        self.int_write_resp_queue = FrameQueue()
         self.int_write_resp_sync = Signal(False)
 
-        self.int_read_addr_queue = []
+        self.int_read_addr_queue = FrameQueue()
         self.int_read_addr_sync = Signal(False)
-        self.int_read_resp_command_queue = []
+        self.int_read_resp_command_queue = FrameQueue()
         self.int_read_resp_command_sync = Signal(False)
-        self.int_read_resp_queue = []
+        self.int_read_resp_queue = FrameQueue()
         self.int_read_resp_sync = Signal(False)
 
         self.in_flight_operations = 0
@@ -87,7 +90,7 @@ class AXILiteMaster(object):
 
     def get_read_data(self):
         if self.read_data_queue:
-            return self.read_data_queue.pop(0)
+            return self.read_data_queue.popleft()
         return None
 
     def create_logic(self,
@@ -164,7 +167,7 @@ class AXILiteMaster(object):
                 if not self.write_command_queue:
                     yield self.write_command_sync
 
-                addr, data, prot = self.write_command_queue.pop(0)
+                addr, data, prot = self.write_command_queue.popleft()
                 self.in_flight_operations += 1
 
                 word_addr = int(addr/bw)*bw
@@ -213,7 +216,7 @@ class AXILiteMaster(object):
                 if not self.int_write_resp_command_queue:
                     yield self.int_write_resp_command_sync
 
-                addr, length, cycles, prot = self.int_write_resp_command_queue.pop(0)
+                addr, length, cycles, prot = self.int_write_resp_command_queue.popleft()
 
                 resp = 0
 
@@ -221,7 +224,7 @@ class AXILiteMaster(object):
                     while not self.int_write_resp_queue:
                         yield clk.posedge
 
-                    cycle_resp = self.int_write_resp_queue.pop(0)
+                    cycle_resp = self.int_write_resp_queue.popleft()
 
                     if cycle_resp != 0:
                         resp = cycle_resp
@@ -236,7 +239,7 @@ class AXILiteMaster(object):
                 while not self.int_write_addr_queue:
                     yield clk.posedge
 
-                m_axil_awaddr.next, m_axil_awprot.next = self.int_write_addr_queue.pop(0)
+                m_axil_awaddr.next, m_axil_awprot.next = self.int_write_addr_queue.popleft()
                 m_axil_awvalid.next = not (pause or awpause)
 
                 yield clk.posedge
@@ -253,7 +256,7 @@ class AXILiteMaster(object):
                 while not self.int_write_data_queue:
                     yield clk.posedge
 
-                m_axil_wdata.next, m_axil_wstrb.next = self.int_write_data_queue.pop(0)
+                m_axil_wdata.next, m_axil_wstrb.next = self.int_write_data_queue.popleft()
                 m_axil_wvalid.next = not (pause or wpause)
 
                 yield clk.posedge
@@ -281,7 +284,7 @@ class AXILiteMaster(object):
                 if not self.read_command_queue:
                     yield self.read_command_sync
 
-                addr, length, prot = self.read_command_queue.pop(0)
+                addr, length, prot = self.read_command_queue.popleft()
                 self.in_flight_operations += 1
 
                 word_addr = int(addr/bw)*bw
@@ -308,7 +311,7 @@ class AXILiteMaster(object):
                 if not self.int_read_resp_command_queue:
                     yield self.int_read_resp_command_sync
 
-                addr, length, cycles, prot = self.int_read_resp_command_queue.pop(0)
+                addr, length, cycles, prot = self.int_read_resp_command_queue.popleft()
 
                 word_addr = int(addr/bw)*bw
 
@@ -323,7 +326,7 @@ class AXILiteMaster(object):
                     while not self.int_read_resp_queue:
                         yield clk.posedge
 
-                    cycle_data, cycle_resp = self.int_read_resp_queue.pop(0)
+                    cycle_data, cycle_resp = self.int_read_resp_queue.popleft()
 
                     if cycle_resp != 0:
                         resp = cycle_resp
@@ -352,7 +355,7 @@ class AXILiteMaster(object):
                 while not self.int_read_addr_queue:
                     yield clk.posedge
 
-                m_axil_araddr.next, m_axil_arprot.next = self.int_read_addr_queue.pop(0)
+                m_axil_araddr.next, m_axil_arprot.next = self.int_read_addr_queue.popleft()
                 m_axil_arvalid.next = not (pause or arpause)
 
                 yield clk.posedge
@@ -390,6 +393,10 @@ class AXILiteRam(object):
         self.mem.seek(address)
         self.mem.write(bytes(data))
 
+    def write_word(self, address, data, strb, width):
+        """Write width bytes of integer data at address, masked by write strobe"""
+        return write_masked(self.mem, address, data, strb, width)
+
     def create_port(self,
                 clk,
                 s_axil_awaddr=None,
@@ -472,8 +479,6 @@ class AXILiteRam(object):
                     for i in range(latency):
                         yield clk.posedge
 
-                    self.mem.seek(addr % self.size)
-
                     s_axil_wready_int.next = True
 
                     yield clk.posedge
@@ -483,16 +488,7 @@ class AXILiteRam(object):
 
                     s_axil_wready_int.next = False
 
-                    data = bytearray()
-                    val = int(s_axil_wdata)
-                    for i in range(bw):
-                        data.extend(bytearray([val & 0xff]))
-                        val >>= 8
-                    for i in range(bw):
-                        if s_axil_wstrb & (1 << i):
-                            self.mem.write(bytes(data[i:i+1]))
-                        else:
-                            self.mem.seek(1, 1)
+                    data = self.write_word(addr % self.size, int(s_axil_wdata), int(s_axil_wstrb), bw)
                     s_axil_bresp.next = 0b00
                     s_axil_bvalid.next = not (pause or bpause)
                     if name is not None:
@@ -522,14 +518,8 @@ class AXILiteRam(object):
                     for i in range(latency):
                         yield clk.posedge
 
-                    self.mem.seek(addr % self.size)
-
-                    data = bytearray(self.mem.read(bw))
-                    val = 0
-                    for i in range(bw-1,-1,-1):
-                        val <<= 8
-                        val += data[i]
-                    s_axil_rdata.next = val
+                    data = self.mem[addr % self.size:addr % self.size+bw]
+                    s_axil_rdata.next = int.from_bytes(data, 'little')
                     s_axil_rresp.next = 0b00
                     s_axil_rvalid.next = not (pause or rpause)
                     if name is not None:
@@ -0,0 +1,58 @@
+"""
+
+Copyright (c) 2021 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+import functools
+
+
+@functools.lru_cache(maxsize=4096)
+def byte_enable_runs(be):
+    """Return tuple of (start, end) byte lane ranges of contiguous set bits in byte enable mask be"""
+    runs = []
+    offset = 0
+    while be:
+        # skip disabled lanes
+        n = (be & -be).bit_length() - 1
+        be >>= n
+        offset += n
+        # count enabled lanes
+        n = (~be & (be+1)).bit_length() - 1
+        runs.append((offset, offset+n))
+        be >>= n
+        offset += n
+    return tuple(runs)
+
+
+def write_masked(mem, address, data, be, width):
+    """Write width bytes of integer data to mem at address, masked by byte enable be
+
+    Returns the data as bytes"""
+    data = data.to_bytes(width, 'little')
+
+    if be == (1 << width) - 1:
+        mem[address:address+width] = data
+    else:
+        for start, end in byte_enable_runs(be):
+            mem[address+start:address+end] = data[start:end]
+
+    return data
@@ -0,0 +1,121 @@
+"""
+
+Copyright (c) 2021 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+from collections import deque
+
+
+def data_size(item):
+    return len(item.data)
+
+
+def payload_size(item):
+    return len(item.payload.data)
+
+
+class FrameQueue(object):
+    """FIFO for endpoint models with occupancy accounting
+
+    size is an optional function returning the size of an item, such as
+    data_size or payload_size; byte_count and high_water_bytes sum it.
+    max_count and max_bytes bound the queue; append raises OverflowError
+    when the queue is full.
+
+    Items and their sizes are held in a private deque, and only the
+    mutators below are provided so that every change goes through the
+    bounds check and byte accounting."""
+    def __init__(self, size=None, max_count=None, max_bytes=None):
+        self.size = size
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+
+        self.byte_count = 0
+        self._queue = deque()
+        self._sizes = deque()
+
+        # statistics
+        self.high_water = 0
+        self.high_water_bytes = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def __iter__(self):
+        return iter(self._queue)
+
+    def __getitem__(self, index):
+        return self._queue[index]
+
+    def __repr__(self):
+        return "FrameQueue(%s)" % list(self._queue)
+
+    def full(self):
+        if self.max_count is not None and len(self._queue) >= self.max_count:
+            return True
+        if self.max_bytes is not None and self.byte_count >= self.max_bytes:
+            return True
+        return False
+
+    def append(self, item):
+        if self.full():
+            raise OverflowError("Queue full")
+
+        n = self.size(item) if self.size else 0
+        self._queue.append(item)
+        self._sizes.append(n)
+        self.byte_count += n
+
+        if len(self._queue) > self.high_water:
+            self.high_water = len(self._queue)
+        if self.byte_count > self.high_water_bytes:
+            self.high_water_bytes = self.byte_count
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def appendleft(self, item):
+        # return an item to the head of the queue, ignoring limits
+        n = self.size(item) if self.size else 0
+        self._queue.appendleft(item)
+        self._sizes.appendleft(n)
+        self.byte_count += n
+
+    def popleft(self):
+        item = self._queue.popleft()
+        self.byte_count -= self._sizes.popleft()
+        return item
+
+    def pop(self):
+        item = self._queue.pop()
+        self.byte_count -= self._sizes.pop()
+        return item
+
+    def clear(self):
+        self._queue.clear()
+        self._sizes.clear()
+        self.byte_count = 0
+
+    def reset_stats(self):
+        self.high_water = len(self._queue)
+        self.high_water_bytes = self.byte_count
@@ -27,6 +27,7 @@ from myhdl import *
 import os
 
 import axi
+from frame_queue import FrameQueue
 
 def bench():
 
@@ -335,7 +336,86 @@ def test_bench():
     sim = Simulation(bench())
     sim.run()
 
+def test_frame_queue():
+    # count bound
+    q = FrameQueue(len, max_count=3)
+    q.append(b'ab')
+    q.extend([b'cde', b'f'])
+    assert q.full()
+    try:
+        q.append(b'g')
+        assert False
+    except OverflowError:
+        pass
+    assert len(q) == 3
+    assert q.byte_count == 6
+    assert list(q) == [b'ab', b'cde', b'f']
+    assert q[0] == b'ab'
+
+    assert q.popleft() == b'ab'
+    assert q.pop() == b'f'
+    assert q.byte_count == 3
+    assert q.high_water == 3
+    assert q.high_water_bytes == 6
+
+    # returned items bypass the bound but are counted
+    q.appendleft(b'xyzw')
+    q.append(b'h')
+    assert q.byte_count == 8
+    assert q.high_water == 3
+    assert q.high_water_bytes == 8
+
+    q.reset_stats()
+    assert q.high_water == 3
+    assert q.high_water_bytes == 8
+    q.clear()
+    assert not q
+    assert q.byte_count == 0
+    q.reset_stats()
+    assert q.high_water == 0
+    assert q.high_water_bytes == 0
+
+    # byte bound
+    q = FrameQueue(len, max_bytes=4)
+    q.append(b'abc')
+    assert not q.full()
+    q.append(b'de')
+    assert q.full()
+    try:
+        q.append(b'f')
+        assert False
+    except OverflowError:
+        pass
+    assert q.byte_count == 5
+    assert q.high_water_bytes == 5
+
+    # deque mutators that would skip the accounting are not provided
+    for op in [lambda: q.insert(0, b'g'), lambda: q.remove(b'abc')]:
+        try:
+            op()
+            assert False
+        except AttributeError:
+            pass
+    try:
+        q += [b'g']
+        assert False
+    except TypeError:
+        pass
+    try:
+        del q[0]
+        assert False
+    except TypeError:
+        pass
+    try:
+        q[0] = b'g'
+        assert False
+    except TypeError:
+        pass
+    assert len(q) == 2
+    assert q.byte_count == 5
+
 if __name__ == '__main__':
     print("Running test...")
     test_bench()
+    test_frame_queue()
 
@@ -23,11 +23,12 @@ THE SOFTWARE.
 """
 
 from myhdl import *
+from frame_queue import FrameQueue
 
 class LocalLinkSource(object):
     def __init__(self):
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue(len)
 
     def send(self, frame):
         self.queue.append(bytearray(frame))
@@ -85,7 +86,7 @@ class LocalLinkSource(object):
                             eof_out_n.next = True
                     if (not eof_out_n and not dst_rdy_in_n_int and not src_rdy_out_n) or src_rdy_out_n_int:
                         if self.queue:
-                            frame = self.queue.pop(0)
+                            frame = self.queue.popleft()
                             if name is not None:
                                 print("[%s] Sending frame %s" % (name, repr(frame)))
                             data_out.next = frame.pop(0)
@@ -99,12 +100,12 @@ class LocalLinkSource(object):
 class LocalLinkSink(object):
     def __init__(self):
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue(len)
         self.sync = Signal(intbv(0))
 
     def recv(self):
         if self.queue:
-            return self.queue.pop(0)
+            return self.queue.popleft()
         return None
 
     def count(self):
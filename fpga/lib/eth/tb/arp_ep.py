@@ -23,6 +23,7 @@ THE SOFTWARE.
 """
 
 from myhdl import *
+from frame_queue import FrameQueue
 import axis_ep
 import eth_ep
 import struct
@@ -160,7 +161,7 @@ class ARPFrameSource():
     def __init__(self):
         self.active = False
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue()
         self.clk = Signal(bool(0))
 
     def send(self, frame):
@@ -222,7 +223,7 @@ class ARPFrameSource():
                         frame_valid.next = False
                         self.active = False
                     if not self.active and self.queue:
-                        frame = self.queue.pop(0)
+                        frame = self.queue.popleft()
                         eth_dest_mac.next = frame.eth_dest_mac
                         eth_src_mac.next = frame.eth_src_mac
                         eth_type.next = frame.eth_type
@@ -248,12 +249,12 @@ class ARPFrameSource():
 class ARPFrameSink():
     def __init__(self):
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue()
         self.sync = Signal(intbv(0))
 
     def recv(self):
         if self.queue:
-            return self.queue.pop(0)
+            return self.queue.popleft()
         return None
 
     def count(self):
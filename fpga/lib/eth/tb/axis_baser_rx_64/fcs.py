@@ -0,0 +1 @@
+../fcs.py
\ No newline at end of file
@@ -33,6 +33,8 @@ from cocotbext.eth.constants import (EthPre, XgmiiCtrl, BaseRCtrl, BaseRO,
     BaseRSync, BaseRBlockType)
 from cocotbext.eth import XgmiiFrame
 
+from fcs import FcsCheck
+
 
 xgmii_ctrl_to_baser_mapping = {
     XgmiiCtrl.IDLE:   BaseRCtrl.IDLE,
@@ -60,6 +62,175 @@ block_type_term_lane_mapping = {
 }
 
 
+term_lane_block_type = [
+    BaseRBlockType.TERM_0,
+    BaseRBlockType.TERM_1,
+    BaseRBlockType.TERM_2,
+    BaseRBlockType.TERM_3,
+    BaseRBlockType.TERM_4,
+    BaseRBlockType.TERM_5,
+    BaseRBlockType.TERM_6,
+    BaseRBlockType.TERM_7,
+]
+
+
+# XGMII character to BASE-R control code, for bytes.translate
+xgmii_to_baser_ctrl_table = bytes(xgmii_ctrl_to_baser_mapping.get(k, BaseRCtrl.ERROR) for k in range(256))
+
+# lane classes used to select the block type
+LANE_OTHER, LANE_START, LANE_TERM, LANE_SEQ_OS, LANE_SIG_OS = range(5)
+
+xgmii_lane_class = [LANE_OTHER]*256
+xgmii_lane_class[XgmiiCtrl.START] = LANE_START
+xgmii_lane_class[XgmiiCtrl.TERM] = LANE_TERM
+xgmii_lane_class[XgmiiCtrl.SEQ_OS] = LANE_SEQ_OS
+xgmii_lane_class[XgmiiCtrl.SIG_OS] = LANE_SIG_OS
+
+
+def _block_recipe(cm, c0, c4, term):
+    # block layout for control mask cm, classes c0 and c4 of lanes 0 and 4,
+    # and whether the first control lane is a terminate.  The block is
+    # base | (lanes & lane_mask) << lane_shift | (ctrl & ctrl_mask) << 8
+    # with lanes the 8 XGMII lanes and ctrl the packed 7-bit control codes
+    os0 = c0 in (LANE_SEQ_OS, LANE_SIG_OS) and not cm & 0x0e
+    os4 = c4 in (LANE_SEQ_OS, LANE_SIG_OS) and not cm & 0xe0
+    sig0 = BaseRO.SIG_OS << 32 if c0 == LANE_SIG_OS else 0
+    sig4 = BaseRO.SIG_OS << 36 if c4 == LANE_SIG_OS else 0
+
+    if c0 == LANE_START and cm == 0x01:
+        # start in lane 0
+        return BaseRBlockType.START_0, 0xffffffffffffff00, 0, 0
+    elif c4 == LANE_START and not cm & 0xe0:
+        # start in lane 4
+        if os0:
+            # ordered set in lane 0
+            return BaseRBlockType.OS_START | sig0, 0xffffff00ffffff00, 0, 0
+        # other control
+        return BaseRBlockType.START_4, 0xffffff0000000000, 0, 0xfffffff
+    elif os0:
+        if os4:
+            # ordered sets in lanes 0 and 4
+            return BaseRBlockType.OS_04 | sig0 | sig4, 0xffffff00ffffff00, 0, 0
+        # ordered set in lane 0
+        return BaseRBlockType.OS_0 | sig0, 0xffffff00, 0, 0xfffffff << 28
+    elif os4:
+        # ordered set in lane 4
+        return BaseRBlockType.OS_4 | sig4, 0xffffff0000000000, 0, 0xfffffff
+    elif term:
+        # terminate, data in lanes before it
+        k = (cm & -cm).bit_length()-1
+        return term_lane_block_type[k], (1 << k*8)-1, 8, 0xffffffffffffff & -(1 << (k+1)*7)
+    # all control
+    return BaseRBlockType.CTRL, 0, 0, 0xffffffffffffff
+
+
+# block recipes keyed on control mask | lane 0 class << 8 | lane 4 class << 11 | terminate << 14
+baser_block_encoding = {}
+
+for cm in range(1, 256):
+    for c0 in range(5) if cm & 0x01 else [LANE_OTHER]:
+        for c4 in range(5) if cm & 0x10 else [LANE_OTHER]:
+            for term in range(2):
+                baser_block_encoding[cm | c0 << 8 | c4 << 11 | term << 14] = _block_recipe(cm, c0, c4, term)
+
+del cm, c0, c4, term
+
+
+def encode_block(dl, cl):
+    """Encode 8 XGMII lanes into a 64b/66b block, returns header and data"""
+    lanes = int.from_bytes(dl, 'little')
+
+    # gather per-lane control flags (one 0/1 per byte) into a bit mask
+    cm = (int.from_bytes(bytes(cl), 'little') * 0x0102040810204080 >> 56) & 0xff
+
+    if not cm:
+        return BaseRSync.DATA, lanes
+
+    key = cm
+    if cm & 0x01:
+        key |= xgmii_lane_class[dl[0]] << 8
+    if cm & 0x10:
+        key |= xgmii_lane_class[dl[4]] << 11
+    if dl[(cm & -cm).bit_length()-1] == XgmiiCtrl.TERM:
+        key |= 1 << 14
+
+    data, lane_mask, lane_shift, ctrl_mask = baser_block_encoding[key]
+
+    if lane_mask:
+        data |= (lanes & lane_mask) << lane_shift
+
+    if ctrl_mask:
+        c = dl.translate(xgmii_to_baser_ctrl_table)
+        ctrl = (c[0] | c[1] << 7 | c[2] << 14 | c[3] << 21 |
+            c[4] << 28 | c[5] << 35 | c[6] << 42 | c[7] << 49)
+        data |= (ctrl & ctrl_mask) << 8
+
+    return BaseRSync.CTRL, data
+
+
+def encode_frame(data, ctrl):
+    """Encode XGMII lanes into a list of 64b/66b blocks, padding the last block with idles"""
+    data = bytes(data)
+    ctrl = bytes(ctrl)
+
+    pad = -len(data) % 8
+    if pad:
+        data += bytes([XgmiiCtrl.IDLE])*pad
+        ctrl += b'\x01'*pad
+
+    return [encode_block(data[k:k+8], ctrl[k:k+8]) for k in range(0, len(data), 8)]
+
+
+# byte with bits reversed, for bytes.translate
+bit_reverse_table = bytes(int(f'{k:08b}'[::-1], 2) for k in range(256))
+
+
+def bit_reverse_64(data):
+    return int.from_bytes(data.to_bytes(8, 'little').translate(bit_reverse_table), 'big')
+
+
+def bit_reverse_2(header):
+    return (header & 1) << 1 | header >> 1
+
+
+# x^58 + x^39 + 1 scrambler, 64 bits per step.  The state holds the last
+# 58 scrambled bits in transmit order (oldest bit in bit 0), so bit i of a
+# block depends on bits i and i+19 of the state concatenated with the block.
+# Taps are 39 bits back, so the low 39 bits of a block depend only on the
+# state and the remaining 25 bits only on the state and the low 39 bits.
+
+def scramble_block(data, state=0):
+    """Scramble one 64-bit block, returns scrambled block and new state"""
+    lo = (data ^ state ^ (state >> 19)) & 0x7fffffffff
+    x = state | lo << 58
+    out = lo | (data ^ x ^ (x >> 19)) & 0xffffff8000000000
+    return out, (state | out << 58) >> 64
+
+
+def descramble_block(data, state=0):
+    """Descramble one 64-bit block, returns descrambled block and new state"""
+    x = state | data << 58
+    return (data ^ x ^ (x >> 19)) & 0xffffffffffffffff, x >> 64
+
+
+def scramble(blocks, state=0):
+    """Scramble a sequence of 64-bit blocks, returns list of blocks and final state"""
+    out = []
+    for data in blocks:
+        data, state = scramble_block(data, state)
+        out.append(data)
+    return out, state
+
+
+def descramble(blocks, state=0):
+    """Descramble a sequence of 64-bit blocks, returns list of blocks and final state"""
+    out = []
+    for data in blocks:
+        data, state = descramble_block(data, state)
+        out.append(data)
+    return out, state
+
+
 class BaseRSerdesSource():
 
     def __init__(self, data, header, clock, enable=None, slip=None, scramble=True, reverse=False, *args, **kwargs):
@@ -165,7 +336,10 @@ class BaseRSerdesSource():
 
     async def _run(self):
         frame = None
+        frame_blocks = []
         frame_offset = 0
+        sfd_block = -1
+        end_lane = 0
         ifg_cnt = 0
         deficit_idle_cnt = 0
         scrambler_state = 0
@@ -222,130 +396,31 @@ class BaseRSerdesSource():
                             deficit_idle_cnt = max(deficit_idle_cnt+ifg_cnt, 0)
                         ifg_cnt = 0
                         self.active = True
+
+                        # encode the whole frame up front
+                        frame_blocks = encode_frame(frame.data, frame.ctrl)
                         frame_offset = 0
+                        sfd_block = frame.data.find(EthPre.SFD) // self.byte_lanes
+                        end_lane = (len(frame.data)-1) % self.byte_lanes
                     else:
                         # clear counters
                         deficit_idle_cnt = 0
                         ifg_cnt = 0
 
                 if frame is not None:
-                    dl = bytearray()
-                    cl = []
+                    header, data = frame_blocks[frame_offset]
 
-                    for k in range(self.byte_lanes):
-                        if frame is not None:
-                            d = frame.data[frame_offset]
-                            if frame.sim_time_sfd is None and d == EthPre.SFD:
-                                frame.sim_time_sfd = get_sim_time()
-                            dl.append(d)
-                            cl.append(frame.ctrl[frame_offset])
-                            frame_offset += 1
-
-                            if frame_offset >= len(frame.data):
-                                ifg_cnt = max(self.ifg - (self.byte_lanes-k), 0)
-                                frame.sim_time_end = get_sim_time()
-                                frame.handle_tx_complete()
-                                frame = None
-                                self.current_frame = None
-                        else:
-                            dl.append(XgmiiCtrl.IDLE)
-                            cl.append(1)
+                    if frame_offset == sfd_block:
+                        frame.sim_time_sfd = get_sim_time()
 
-                    # remap control characters
-                    ctrl = sum(xgmii_ctrl_to_baser_mapping.get(d, BaseRCtrl.ERROR) << i*7 for i, d in enumerate(dl))
+                    frame_offset += 1
 
-                    if not any(cl):
-                        # data
-                        header = BaseRSync.DATA
-                        data = int.from_bytes(dl, 'little')
-                    else:
-                        # control
-                        header = BaseRSync.CTRL
-                        if cl[0] and dl[0] == XgmiiCtrl.START and not any(cl[1:]):
-                            # start in lane 0
-                            data = BaseRBlockType.START_0
-                            for i in range(1, 8):
-                                data |= dl[i] << i*8
-                        elif cl[4] and dl[4] == XgmiiCtrl.START and not any(cl[5:]):
-                            # start in lane 4
-                            if cl[0] and (dl[0] == XgmiiCtrl.SEQ_OS or dl[0] == XgmiiCtrl.SIG_OS) and not any(cl[1:4]):
-                                # ordered set in lane 0
-                                data = BaseRBlockType.OS_START
-                                for i in range(1,4):
-                                    data |= dl[i] << i*8
-                                if dl[0] == XgmiiCtrl.SIG_OS:
-                                    # signal ordered set
-                                    data |= BaseRO.SIG_OS << 32
-                            else:
-                                # other control
-                                data = BaseRBlockType.START_4 | (ctrl & 0xfffffff) << 8
-
-                            for i in range(5, 8):
-                                data |= dl[i] << i*8
-                        elif cl[0] and (dl[0] == XgmiiCtrl.SEQ_OS or dl[0] == XgmiiCtrl.SIG_OS) and not any(cl[1:4]):
-                            # ordered set in lane 0
-                            if cl[4] and (dl[4] == XgmiiCtrl.SEQ_OS or dl[4] == XgmiiCtrl.SIG_OS) and not any(cl[5:8]):
-                                # ordered set in lane 4
-                                data = BaseRBlockType.OS_04
-                                for i in range(5,8):
-                                    data |= dl[i] << i*8
-                                if dl[4] == XgmiiCtrl.SIG_OS:
-                                    # signal ordered set
-                                    data |= BaseRO.SIG_OS << 36
-                            else:
-                                data = BaseRBlockType.OS_0 | (ctrl & 0xfffffff) << 40
-                            for i in range(1, 4):
-                                data |= dl[i] << i*8
-                            if dl[0] == XgmiiCtrl.SIG_OS:
-                                # signal ordered set
-                                data |= BaseRO.SIG_OS << 32
-                        elif cl[4] and (dl[4] == XgmiiCtrl.SEQ_OS or dl[4] == XgmiiCtrl.SIG_OS) and not any(cl[5:8]):
-                            # ordered set in lane 4
-                            data = BaseRBlockType.OS_4 | (ctrl & 0xfffffff) << 8
-                            for i in range(5, 8):
-                                data |= dl[i] << i*8
-                            if dl[4] == XgmiiCtrl.SIG_OS:
-                                # signal ordered set
-                                data |= BaseRO.SIG_OS << 36
-                        elif cl[0] and dl[0] == XgmiiCtrl.TERM:
-                            # terminate in lane 0
-                            data = BaseRBlockType.TERM_0 | (ctrl & 0xffffffffffff80) << 8
-                        elif cl[1] and dl[1] == XgmiiCtrl.TERM and not cl[0]:
-                            # terminate in lane 1
-                            data = BaseRBlockType.TERM_1 | (ctrl & 0xffffffffffc000) << 8 | dl[0] << 8
-                        elif cl[2] and dl[2] == XgmiiCtrl.TERM and not any(cl[0:2]):
-                            # terminate in lane 2
-                            data = BaseRBlockType.TERM_2 | (ctrl & 0xffffffffe00000) << 8
-                            for i in range(2):
-                                data |= dl[i] << ((i+1)*8)
-                        elif cl[3] and dl[3] == XgmiiCtrl.TERM and not any(cl[0:3]):
-                            # terminate in lane 3
-                            data = BaseRBlockType.TERM_3 | (ctrl & 0xfffffff0000000) << 8
-                            for i in range(3):
-                                data |= dl[i] << ((i+1)*8)
-                        elif cl[4] and dl[4] == XgmiiCtrl.TERM and not any(cl[0:4]):
-                            # terminate in lane 4
-                            data = BaseRBlockType.TERM_4 | (ctrl & 0xfffff800000000) << 8
-                            for i in range(4):
-                                data |= dl[i] << ((i+1)*8)
-                        elif cl[5] and dl[5] == XgmiiCtrl.TERM and not any(cl[0:5]):
-                            # terminate in lane 5
-                            data = BaseRBlockType.TERM_5 | (ctrl & 0xfffc0000000000) << 8
-                            for i in range(5):
-                                data |= dl[i] << ((i+1)*8)
-                        elif cl[6] and dl[6] == XgmiiCtrl.TERM and not any(cl[0:6]):
-                            # terminate in lane 6
-                            data = BaseRBlockType.TERM_6 | (ctrl & 0xfe000000000000) << 8
-                            for i in range(6):
-                                data |= dl[i] << ((i+1)*8)
-                        elif cl[7] and dl[7] == XgmiiCtrl.TERM and not any(cl[0:7]):
-                            # terminate in lane 7
-                            data = BaseRBlockType.TERM_7
-                            for i in range(7):
-                                data |= dl[i] << ((i+1)*8)
-                        else:
-                            # all control
-                            data = BaseRBlockType.CTRL | ctrl << 8
+                    if frame_offset >= len(frame_blocks):
+                        ifg_cnt = max(self.ifg - (self.byte_lanes-end_lane), 0)
+                        frame.sim_time_end = get_sim_time()
+                        frame.handle_tx_complete()
+                        frame = None
+                        self.current_frame = None
                 else:
                     data = BaseRBlockType.CTRL
                     header = BaseRSync.CTRL
@@ -354,14 +429,7 @@ class BaseRSerdesSource():
 
                 if self.scramble:
                     # 64b/66b scrambler
-                    b = 0
-                    for i in range(len(self.data)):
-                        if bool(scrambler_state & (1 << 38)) ^ bool(scrambler_state & (1 << 57)) ^ bool(data & (1 << i)):
-                            scrambler_state = ((scrambler_state & 0x1ffffffffffffff) << 1) | 1
-                            b = b | (1 << i)
-                        else:
-                            scrambler_state = (scrambler_state & 0x1ffffffffffffff) << 1
-                    data = b
+                    data, scrambler_state = scramble_block(data, scrambler_state)
 
                 if self.slip is not None and self.slip.value:
                     self.bit_offset += 1
@@ -380,8 +448,8 @@ class BaseRSerdesSource():
 
                 if self.reverse:
                     # bit reverse
-                    data = sum(1 << (63-i) for i in range(64) if (data >> i) & 1)
-                    header = sum(1 << (1-i) for i in range(2) if (header >> i) & 1)
+                    data = bit_reverse_64(data)
+                    header = bit_reverse_2(header)
 
                 self.data <= data
                 self.header <= header
@@ -411,6 +479,8 @@ class BaseRSerdesSink:
         self.queue_occupancy_bytes = 0
         self.queue_occupancy_frames = 0
 
+        self.fcs_errors = 0
+
         self.width = len(self.data)
         self.byte_size = 8
         self.byte_lanes = 8
@@ -468,6 +538,8 @@ class BaseRSerdesSink:
 
     async def _run(self):
         frame = None
+        fcs = None
+        fcs_offset = 0
         scrambler_state = 0
         self.active = False
 
@@ -480,17 +552,12 @@ class BaseRSerdesSink:
 
                 if self.reverse:
                     # bit reverse
-                    data = sum(1 << (63-i) for i in range(64) if (data >> i) & 1)
-                    header = sum(1 << (1-i) for i in range(2) if (header >> i) & 1)
+                    data = bit_reverse_64(data)
+                    header = bit_reverse_2(header)
 
                 if self.scramble:
                     # 64b/66b descrambler
-                    b = 0
-                    for i in range(len(self.data)):
-                        if bool(scrambler_state & (1 << 38)) ^ bool(scrambler_state & (1 << 57)) ^ bool(data & (1 << i)):
-                            b = b | (1 << i)
-                        scrambler_state = (scrambler_state & 0x1ffffffffffffff) << 1 | bool(data & (1 << i))
-                    data = b
+                    data, scrambler_state = descramble_block(data, scrambler_state)
 
                 # 10GBASE-R decoding
 
@@ -624,9 +691,18 @@ class BaseRSerdesSink:
                             frame = XgmiiFrame(bytearray([EthPre.PRE]), [0])
                             frame.sim_time_start = get_sim_time()
                             frame.start_lane = offset
+                            fcs = FcsCheck()
+                            fcs_offset = 0
                     else:
                         if c_val:
                             # got a control character; terminate frame reception
+                            fcs.update(frame.data[fcs_offset:])
+                            if d_val != XgmiiCtrl.TERM:
+                                fcs.error = True
+                            frame.fcs_ok = fcs.ok()
+                            if not frame.fcs_ok:
+                                self.fcs_errors += 1
+
                             if d_val != XgmiiCtrl.TERM:
                                 # store control character if it's not a termination
                                 frame.data.append(d_val)
@@ -649,3 +725,8 @@ class BaseRSerdesSink:
 
                             frame.data.append(d_val)
                             frame.ctrl.append(c_val)
+
+                if frame is not None:
+                    # check FCS as data arrives
+                    fcs.update(frame.data[fcs_offset:])
+                    fcs_offset = len(frame.data)
@@ -23,6 +23,8 @@ THE SOFTWARE.
 """
 
 from myhdl import *
+from fcs import FcsCheck
+from frame_queue import FrameQueue, data_size
 
 import xgmii_ep
 
@@ -98,7 +100,7 @@ def block_type_term_lane(bt):
 class BaseRSerdesSource(object):
     def __init__(self, ifg=12, enable_dic=True):
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue(data_size)
         self.ifg = ifg
         self.enable_dic = enable_dic
         self.force_offset_start = False
@@ -157,7 +159,7 @@ class BaseRSerdesSource(object):
                             else:
                                 ifg_cnt = self.ifg + deficit_idle_cnt
                     elif self.queue:
-                        frame = self.queue.pop(0)
+                        frame = self.queue.popleft()
                         dl, cl = frame.build()
                         if name is not None:
                             print("[%s] Sending frame %s" % (name, repr(frame)))
@@ -360,12 +362,13 @@ class BaseRSerdesSource(object):
 class BaseRSerdesSink(object):
     def __init__(self):
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue(data_size)
         self.sync = Signal(intbv(0))
+        self.fcs_errors = 0
 
     def recv(self):
         if self.queue:
-            return self.queue.pop(0)
+            return self.queue.popleft()
         return None
 
     def count(self):
@@ -407,6 +410,7 @@ class BaseRSerdesSink(object):
             frame = None
             d = []
             c = []
+            fcs = None
             scrambler_state = 0
 
             while True:
@@ -645,6 +649,8 @@ class BaseRSerdesSink(object):
                             for i in range(1,bw):
                                 d.append(dl[i])
                                 c.append(cl[i])
+                            fcs = FcsCheck()
+                            fcs.update(d)
                         elif bw == 8 and cl[4] and dl[4] == XGMII_START:
                             # start in lane 4
                             frame = xgmii_ep.XGMIIFrame()
@@ -653,15 +659,24 @@ class BaseRSerdesSink(object):
                             for i in range(5,bw):
                                 d.append(dl[i])
                                 c.append(cl[i])
+                            fcs = FcsCheck()
+                            fcs.update(d)
                     else:
+                        # check FCS as data arrives
+                        n = len(d)
                         for i in range(bw):
                             if cl[i]:
                                 # got a control character; terminate frame reception
+                                fcs.update(d[n:])
                                 if dl[i] != XGMII_TERM:
                                     # store control character if it's not a termination
+                                    fcs.error = True
                                     d.append(dl[i])
                                     c.append(cl[i])
                                 frame.parse(d, c)
+                                frame.fcs_ok = fcs.ok()
+                                if not frame.fcs_ok:
+                                    self.fcs_errors += 1
                                 self.queue.append(frame)
                                 self.sync.next = not self.sync
                                 if name is not None:
@@ -673,6 +688,8 @@ class BaseRSerdesSink(object):
                             else:
                                 d.append(dl[i])
                                 c.append(cl[i])
+                        else:
+                            fcs.update(d[n:])
 
         return instances()
 
@@ -0,0 +1,67 @@
+"""
+
+Copyright (c) 2021 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+
+# One's complement sums over big-endian 16-bit words.  Since 2**16 == 1
+# mod 0xffff, the end-around-carry sum of a buffer is the buffer read as
+# one big integer reduced mod 0xffff, with 0xffff in place of 0 when the
+# buffer is not all zeros.
+
+
+def fold(value):
+    """Fold an integer into a 16-bit one's complement sum"""
+    if not value:
+        return 0
+    return value % 0xffff or 0xffff
+
+
+def ones_sum(data, cksum=0):
+    """One's complement sum of data as big-endian 16-bit words, added to cksum"""
+    if len(data) & 1:
+        data = bytes(data) + b'\x00'
+    return fold(int.from_bytes(data, 'big') + cksum)
+
+
+def checksum(data, cksum=0):
+    """Internet checksum of data, cksum is a partial sum (e.g. pseudo header)"""
+    return ~ones_sum(data, cksum) & 0xffff
+
+
+
+def checksum_many(buffers, cksum=0):
+    """Internet checksums of a sequence of buffers, sharing partial sum cksum"""
+    return [~ones_sum(data, cksum) & 0xffff for data in buffers]
+
+
+def checksum_adjust(cksum, old, new):
+    """Adjust checksum cksum for a change of an even-length field from old to new
+
+    old and new are bytes or 16-bit words, and the field must start on an
+    even offset; the rest of the covered data is not summed again
+    (RFC 1624, eqn. 3)."""
+    if isinstance(old, int):
+        old = old.to_bytes(2, 'big')
+    if isinstance(new, int):
+        new = new.to_bytes(2, 'big')
+    return ~fold((~cksum & 0xffff) + (~ones_sum(old) & 0xffff) + ones_sum(new)) & 0xffff
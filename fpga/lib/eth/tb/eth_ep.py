@@ -23,10 +23,26 @@ THE SOFTWARE.
 """
 
 from myhdl import *
+from frame_queue import FrameQueue, payload_size
 import axis_ep
 import struct
 import zlib
 
+# dest MAC, src MAC (as 16 + 32 bit halves), ethertype
+eth_hdr = struct.Struct('>HLHLH')
+
+def pack_eth_header(buf, offset, frame):
+    eth_hdr.pack_into(buf, offset,
+        (frame.eth_dest_mac >> 32) & 0xffff, frame.eth_dest_mac & 0xffffffff,
+        (frame.eth_src_mac >> 32) & 0xffff, frame.eth_src_mac & 0xffffffff,
+        frame.eth_type)
+
+def wrap_axis_frame(data):
+    # AXIStreamFrame taking ownership of data without copying it
+    frame = axis_ep.AXIStreamFrame(b'')
+    frame.data = data
+    return frame
+
 class EthFrame(object):
     def __init__(self, payload=b'', eth_dest_mac=0, eth_src_mac=0, eth_type=0, eth_fcs=None):
         self._payload = axis_ep.AXIStreamFrame()
@@ -61,33 +77,40 @@ class EthFrame(object):
         self._payload = axis_ep.AXIStreamFrame(value)
 
     def calc_fcs(self):
-        frame = self.build_axis().data
+        hdr = bytearray(eth_hdr.size)
+        pack_eth_header(hdr, 0, self)
+        data = self.payload.data
 
-        return zlib.crc32(bytes(frame)) & 0xffffffff
+        # CRC header and payload in place, without building the frame
+        if type(data) is not bytearray:
+            data = bytes(data)
+
+        return zlib.crc32(data, zlib.crc32(hdr)) & 0xffffffff
 
     def update_fcs(self):
         self.eth_fcs = self.calc_fcs()
 
     def build_axis(self):
-        data = b''
-
-        data += struct.pack('>Q', self.eth_dest_mac)[2:]
-        data += struct.pack('>Q', self.eth_src_mac)[2:]
-        data += struct.pack('>H', self.eth_type)
+        data = self.payload.data
+        buf = bytearray(14+len(data))
 
-        data += self.payload.data
+        pack_eth_header(buf, 0, self)
+        buf[14:] = data
 
-        return axis_ep.AXIStreamFrame(data)
+        return wrap_axis_frame(buf)
 
     def build_axis_fcs(self):
         if self.eth_fcs is None:
             self.update_fcs()
 
-        data = self.build_axis().data
+        data = self.payload.data
+        buf = bytearray(14+len(data)+4)
 
-        data += struct.pack('<L', self.eth_fcs)
+        pack_eth_header(buf, 0, self)
+        buf[14:-4] = data
+        struct.pack_into('<L', buf, len(buf)-4, self.eth_fcs)
 
-        return axis_ep.AXIStreamFrame(data)
+        return wrap_axis_frame(buf)
 
     def parse_axis(self, data):
         data = axis_ep.AXIStreamFrame(data).data
@@ -124,9 +147,9 @@ class EthFrameSource():
     def __init__(self):
         self.active = False
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue(payload_size)
         self.payload_source = axis_ep.AXIStreamSource()
-        self.header_queue = []
+        self.header_queue = FrameQueue()
         self.clk = Signal(bool(0))
 
     def send(self, frame):
@@ -202,7 +225,7 @@ class EthFrameSource():
                         eth_hdr_valid.next = False
                         self.active = False
                     if not self.active and self.header_queue:
-                        frame = self.header_queue.pop(0)
+                        frame = self.header_queue.popleft()
                         eth_dest_mac.next = frame.eth_dest_mac
                         eth_src_mac.next = frame.eth_src_mac
                         eth_type.next = frame.eth_type
@@ -214,7 +237,7 @@ class EthFrameSource():
                         self.active = True
 
                     if self.queue and not self.header_queue:
-                        frame = self.queue.pop(0)
+                        frame = self.queue.popleft()
                         self.header_queue.append(frame)
                         self.payload_source.send(frame.payload)
 
@@ -224,14 +247,14 @@ class EthFrameSource():
 class EthFrameSink():
     def __init__(self):
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue(payload_size)
         self.payload_sink = axis_ep.AXIStreamSink()
-        self.header_queue = []
+        self.header_queue = FrameQueue()
         self.sync = Signal(intbv(0))
 
     def recv(self):
         if self.queue:
-            return self.queue.pop(0)
+            return self.queue.popleft()
         return None
 
     def count(self):
@@ -311,7 +334,7 @@ class EthFrameSink():
                         self.header_queue.append(frame)
 
                     if not self.payload_sink.empty() and self.header_queue:
-                        frame = self.header_queue.pop(0)
+                        frame = self.header_queue.popleft()
                         frame.payload = self.payload_sink.recv()
                         self.queue.append(frame)
                         self.sync.next = not self.sync
@@ -0,0 +1 @@
+../eth_traffic.py
\ No newline at end of file
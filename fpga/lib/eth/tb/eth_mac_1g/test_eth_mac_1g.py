@@ -26,6 +26,7 @@ THE SOFTWARE.
 import itertools
 import logging
 import os
+import sys
 
 import cocotb_test.simulator
 
@@ -37,6 +38,16 @@ from cocotb.regression import TestFactory
 from cocotbext.eth import GmiiFrame, GmiiSource, GmiiSink
 from cocotbext.axi import AxiStreamBus, AxiStreamSource, AxiStreamSink
 
+try:
+    from eth_traffic import EthTrafficGen, IMIX
+except ImportError:
+    # attempt import from current directory
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__)))
+    try:
+        from eth_traffic import EthTrafficGen, IMIX
+    finally:
+        del sys.path[0]
+
 
 class TB:
     def __init__(self, dut):
@@ -153,6 +164,47 @@ async def run_test_rx(dut, payload_lengths=None, payload_data=None, ifg=12, enab
     await RisingEdge(dut.rx_clk)
 
 
+async def run_test_rx_load(dut, sizes=None, rate=1.0, ifg=12, enable_gen=None, mii_sel=False):
+
+    tb = TB(dut)
+
+    tb.gmii_source.ifg = ifg
+    tb.dut.ifg_delay <= ifg
+    tb.dut.rx_mii_select <= mii_sel
+    tb.dut.tx_mii_select <= mii_sel
+
+    if enable_gen is not None:
+        tb.set_enable_generator_rx(enable_gen())
+        tb.set_enable_generator_tx(enable_gen())
+
+    await tb.reset()
+
+    count = 50
+
+    gen = EthTrafficGen(tb.gmii_source, dut.rx_clk, GmiiFrame, sizes=sizes, rate=rate, seed=1)
+    gen.start(count)
+
+    for k in range(count):
+        rx_frame = await tb.axis_sink.recv()
+
+        assert rx_frame.tdata == gen.tx_payloads.popleft()
+        assert rx_frame.tuser == 0
+
+    await gen.wait()
+
+    assert tb.axis_sink.empty()
+
+    stats = gen.log_stats()
+
+    # preamble and FCS count towards utilization, the IFG does not, so
+    # full rate is frame_bytes over frame_bytes plus one minimum IFG per frame
+    full = gen.frame_bytes / (gen.frame_bytes + gen.frames*gen.ifg_bytes())
+    assert abs(stats['utilization']/full - rate) < 0.05
+
+    await RisingEdge(dut.rx_clk)
+    await RisingEdge(dut.rx_clk)
+
+
 async def run_test_tx(dut, payload_lengths=None, payload_data=None, ifg=12, enable_gen=None, mii_sel=False):
 
     tb = TB(dut)
@@ -210,6 +262,14 @@ if cocotb.SIM_NAME:
         factory.add_option("mii_sel", [False, True])
         factory.generate_tests()
 
+    factory = TestFactory(run_test_rx_load)
+    factory.add_option("sizes", [IMIX])
+    factory.add_option("rate", [1.0, 0.5])
+    factory.add_option("ifg", [12])
+    factory.add_option("enable_gen", [None, cycle_en])
+    factory.add_option("mii_sel", [False, True])
+    factory.generate_tests()
+
 
 # cocotb-test
 
@@ -49,6 +49,16 @@ except ImportError:
     finally:
         del sys.path[0]
 
+try:
+    from eth_traffic import EthTrafficGen, IMIX
+except ImportError:
+    # attempt import from current directory
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__)))
+    try:
+        from eth_traffic import EthTrafficGen, IMIX
+    finally:
+        del sys.path[0]
+
 
 class TB:
     def __init__(self, dut):
@@ -125,6 +135,48 @@ async def run_test_rx(dut, payload_lengths=None, payload_data=None, ifg=12):
     await RisingEdge(dut.rx_clk)
 
 
+async def run_test_rx_load(dut, sizes=None, rate=1.0, ifg=12):
+
+    tb = TB(dut)
+
+    tb.serdes_source.ifg = ifg
+    tb.dut.ifg_delay <= ifg
+
+    await tb.reset()
+
+    tb.log.info("Wait for block lock")
+    while not dut.rx_block_lock.value.integer:
+        await RisingEdge(dut.rx_clk)
+
+    # clear out sink buffer
+    tb.axis_sink.clear()
+
+    count = 200
+
+    gen = EthTrafficGen(tb.serdes_source, dut.rx_clk, XgmiiFrame, sizes=sizes, rate=rate, seed=1)
+    gen.start(count)
+
+    for k in range(count):
+        rx_frame = await tb.axis_sink.recv()
+
+        assert rx_frame.tdata == gen.tx_payloads.popleft()
+        assert rx_frame.tuser == 0
+
+    await gen.wait()
+
+    assert tb.axis_sink.empty()
+
+    stats = gen.log_stats()
+
+    # preamble and FCS count towards utilization, the IFG does not, so
+    # full rate is frame_bytes over frame_bytes plus one minimum IFG per frame
+    full = gen.frame_bytes / (gen.frame_bytes + gen.frames*gen.ifg_bytes())
+    assert abs(stats['utilization']/full - rate) < 0.05
+
+    await RisingEdge(dut.rx_clk)
+    await RisingEdge(dut.rx_clk)
+
+
 async def run_test_tx(dut, payload_lengths=None, payload_data=None, ifg=12):
 
     tb = TB(dut)
@@ -281,6 +333,12 @@ if cocotb.SIM_NAME:
         factory.add_option("ifg", [12, 0])
         factory.generate_tests()
 
+    factory = TestFactory(run_test_rx_load)
+    factory.add_option("sizes", [IMIX])
+    factory.add_option("rate", [1.0, 0.5])
+    factory.add_option("ifg", [12])
+    factory.generate_tests()
+
     factory = TestFactory(run_test_tx_alignment)
     factory.add_option("payload_data", [incrementing_payload])
     factory.add_option("ifg", [12])
@@ -136,6 +136,21 @@ async def run_test_tx(dut, payload_lengths=None, payload_data=None, ifg=12):
 
         assert rx_frame.get_payload() == test_data
         assert rx_frame.check_fcs()
+        assert rx_frame.fcs_ok
+
+    assert tb.serdes_sink.fcs_errors == 0
+
+    # corrupted FCS
+    test_frame = XgmiiFrame.from_payload(test_frames[0])
+    test_frame.data[-1] ^= 0xff
+    await tb.xgmii_source.send(test_frame)
+
+    rx_frame = await tb.serdes_sink.recv()
+
+    assert rx_frame.get_payload() == test_frames[0]
+    assert not rx_frame.check_fcs()
+    assert not rx_frame.fcs_ok
+    assert tb.serdes_sink.fcs_errors == 1
 
     assert tb.serdes_sink.empty()
 
@@ -0,0 +1,264 @@
+"""
+
+Copyright (c) 2021 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+import bisect
+import itertools
+import logging
+import random
+from collections import deque
+
+import cocotb
+from cocotb.triggers import RisingEdge, Event
+from cocotb.utils import get_sim_time, get_time_from_sim_steps
+
+
+# simple IMIX, 7:4:1 mix of 64, 576 and 1518 byte frames (payload lengths, FCS not included)
+IMIX = [(60, 7), (572, 4), (1514, 1)]
+
+
+def prbs31(length, state=0x7fffffff):
+    """PRBS31 (x^31 + x^28 + 1) byte sequence, returns bytes and new state"""
+    data = bytearray(length)
+    for k in range(length):
+        b = 0
+        for i in range(8):
+            bit = ((state >> 30) ^ (state >> 27)) & 1
+            state = ((state << 1) | bit) & 0x7fffffff
+            b = b << 1 | bit
+        data[k] = b
+    return bytes(data), state
+
+
+def incrementing_payload(length):
+    return bytes(itertools.islice(itertools.cycle(range(256)), length))
+
+
+class EthTrafficGen:
+    """Sustained Ethernet traffic for a frame source (XgmiiSource, GmiiSource, BaseRSerdesSource)
+
+    sizes is a fixed payload length, a (min, max) tuple for a uniform
+    distribution, or a list of (length, weight) pairs such as IMIX.  payload
+    is 'prbs' (PRBS31), 'incrementing', or a function of the length.  rate is
+    the target fraction of line rate, counting preamble and IFG.  One frame
+    (with FCS) is built per length and reused; the sources copy frames on
+    send.
+
+    Pacing and statistics only count cycles where the source's clock enable
+    (if any) is high, and a GmiiSource in MII mode moves half a byte per
+    cycle."""
+
+    def __init__(self, source, clock, frame_type, sizes=IMIX, payload='prbs', rate=1.0, seed=None):
+        self.log = logging.getLogger(f"{source.log.name}.traffic")
+        self.source = source
+        self.clock = clock
+        self.frame_type = frame_type
+        self.payload = payload
+        self.rate = rate
+        self.rng = random.Random(seed)
+
+        if isinstance(sizes, int):
+            self._lengths = [sizes]
+            self._cum_weights = None
+            self._uniform = None
+            self.max_length = sizes
+        elif isinstance(sizes, tuple):
+            self._lengths = None
+            self._cum_weights = None
+            self._uniform = sizes
+            self.max_length = sizes[1]
+        else:
+            self._lengths = [s for s, w in sizes]
+            self._cum_weights = list(itertools.accumulate(w for s, w in sizes))
+            self._uniform = None
+            self.max_length = max(self._lengths)
+
+        self.bytes_per_cycle = getattr(source, 'byte_lanes', getattr(source, 'byte_width', 1))
+        self.enable = getattr(source, 'enable', None)
+        self.mii_select = getattr(source, 'mii_select', None)
+
+        self.templates = {}
+        self._prbs = b''
+        self._prbs_state = 0x7fffffff
+
+        # payloads of frames sent but not yet consumed by the testbench
+        self.tx_payloads = deque()
+
+        self.done_event = Event()
+        self._run_cr = None
+
+        self.clear_stats()
+
+    def clear_stats(self):
+        # frames completed, and bytes (with and without preamble) of frames sent
+        self.frames = 0
+        self.frame_bytes = 0
+        self.payload_bytes = 0
+        self.first_start = None
+        self.last_end = None
+        self.cycles = 0
+        self.period = None
+        # line capacity in bytes over enabled cycles since the first frame was queued
+        self.line_bytes = 0
+        self._line_bytes_end = 0
+
+    def mii_mode(self):
+        if self.mii_select is not None:
+            return bool(self.mii_select.value.integer)
+        return getattr(self.source, 'mii_mode', False)
+
+    def line_bytes_per_cycle(self):
+        return 0.5 if self.mii_mode() else self.bytes_per_cycle
+
+    def ifg_bytes(self):
+        # GmiiSource counts the IFG in cycles, which are nibbles in MII mode
+        return self.source.ifg*0.5 if self.mii_mode() else self.source.ifg
+
+    def next_length(self):
+        if self._uniform is not None:
+            return self.rng.randint(*self._uniform)
+        if self._cum_weights is None:
+            return self._lengths[0]
+        k = bisect.bisect(self._cum_weights, self.rng.random()*self._cum_weights[-1])
+        return self._lengths[k]
+
+    def payload_data(self, length):
+        if callable(self.payload):
+            return bytes(self.payload(length))
+        elif self.payload == 'incrementing':
+            return incrementing_payload(length)
+        elif self.payload == 'prbs':
+            if len(self._prbs) < length:
+                data, self._prbs_state = prbs31(length-len(self._prbs), self._prbs_state)
+                self._prbs += data
+            return self._prbs[:length]
+        raise ValueError(f"Unknown payload type: {self.payload!r}")
+
+    def template(self, length):
+        t = self.templates.get(length)
+        if t is None:
+            frame = self.frame_type.from_payload(self.payload_data(length), tx_complete=self._handle_tx_complete)
+            t = (frame, frame.get_payload())
+            self.templates[length] = t
+        return t
+
+    def start(self, count=None):
+        self.stop()
+        self.done_event.clear()
+        self._run_cr = cocotb.fork(self._run(count))
+
+    def stop(self):
+        if self._run_cr is not None:
+            self._run_cr.kill()
+            self._run_cr = None
+
+    async def wait(self):
+        await self.done_event.wait()
+
+    def _handle_tx_complete(self, frame):
+        if self.first_start is None:
+            self.first_start = frame.sim_time_start
+        self.last_end = frame.sim_time_end
+        self._line_bytes_end = self.line_bytes
+        self.frames += 1
+
+    async def _run(self, count):
+        # byte credit for pacing, capped at two max size frames on the wire
+        credit = 0
+        max_credit = 2*(self.max_length + 12 + self.source.ifg)
+        frame = None
+        last_time = None
+        n = 0
+        frames_start = self.frames
+
+        while count is None or n < count:
+            await RisingEdge(self.clock)
+
+            t = get_sim_time()
+            if last_time is not None and self.period is None:
+                self.period = t - last_time
+            last_time = t
+
+            if self.enable is not None and not self.enable.value:
+                continue
+
+            self.cycles += 1
+            line_bytes = self.line_bytes_per_cycle()
+            if n:
+                self.line_bytes += line_bytes
+
+            if frame is None:
+                frame, payload = self.template(self.next_length())
+
+            if self.rate < 1.0:
+                wire_len = len(frame.data) + self.ifg_bytes()
+                credit = min(credit + self.rate*line_bytes, max_credit)
+                if credit < wire_len:
+                    continue
+
+            # keep the source fed, but with at most two frames queued so the pacing holds
+            if self.source.count() >= 2:
+                continue
+
+            if self.rate < 1.0:
+                credit -= wire_len
+
+            self.source.send_nowait(frame)
+            self.tx_payloads.append(payload)
+            self.frame_bytes += len(frame.data)
+            self.payload_bytes += len(payload)+4
+            frame = None
+            n += 1
+
+        while self.frames - frames_start < n:
+            await RisingEdge(self.clock)
+
+            if self.enable is None or self.enable.value:
+                self.cycles += 1
+                self.line_bytes += self.line_bytes_per_cycle()
+
+        self.done_event.set()
+
+    def stats(self):
+        """Achieved throughput (payload + FCS, bits per second), line utilization and average IFG in bytes"""
+        if not self.frames or self.period is None or not self._line_bytes_end:
+            return {'frames': self.frames}
+
+        elapsed = self.last_end - self.first_start + self.period
+        line_bytes = self._line_bytes_end
+
+        return {
+            'frames': self.frames,
+            'throughput': self.payload_bytes*8 / get_time_from_sim_steps(elapsed, 'sec'),
+            'utilization': self.frame_bytes / line_bytes,
+            'ifg': (line_bytes - self.frame_bytes) / self.frames,
+        }
+
+    def log_stats(self):
+        stats = self.stats()
+        if len(stats) == 1:
+            self.log.info("Traffic: %d frames", stats['frames'])
+        else:
+            self.log.info("Traffic: %d frames, %.3f Gbps, %.1f%% line utilization, average IFG %.1f bytes",
+                stats['frames'], stats['throughput']*1e-9, stats['utilization']*100, stats['ifg'])
+        return stats
@@ -0,0 +1,73 @@
+"""
+
+Copyright (c) 2021 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+import zlib
+
+ETH_SFD = 0xD5
+
+# CRC32 of any frame followed by its own FCS
+FCS_RESIDUE = 0x2144df1c
+
+
+def calc_fcs(data, crc=0):
+    """Ethernet FCS (CRC32) of data, continuing from a previous calc_fcs result"""
+    return zlib.crc32(bytes(data), crc) & 0xffffffff
+
+
+def append_fcs(data):
+    """Copy of data with its FCS appended"""
+    data = bytearray(data)
+    data += calc_fcs(data).to_bytes(4, 'little')
+    return data
+
+
+class FcsCheck:
+    """Running FCS check over a received frame fed in pieces
+
+    With preamble set, bytes up to and including the SFD are skipped.  ok()
+    is true when the data fed so far ends in a valid FCS, so the frame does
+    not need a second pass after it completes.  Set error for a frame that
+    was not ended cleanly (e.g. by an error control character); ok() is
+    then false."""
+    def __init__(self, preamble=True):
+        self.in_preamble = preamble
+        self.crc = 0
+        self.count = 0
+        self.error = False
+
+    def update(self, data):
+        data = bytes(data)
+
+        if self.in_preamble:
+            k = data.find(ETH_SFD)
+            if k < 0:
+                return
+            self.in_preamble = False
+            data = data[k+1:]
+
+        self.crc = zlib.crc32(data, self.crc)
+        self.count += len(data)
+
+    def ok(self):
+        return not self.error and self.count >= 4 and self.crc == FCS_RESIDUE
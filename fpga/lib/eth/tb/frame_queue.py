@@ -0,0 +1 @@
+../lib/axis/tb/frame_queue.py
\ No newline at end of file
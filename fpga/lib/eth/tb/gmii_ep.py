@@ -23,15 +23,19 @@ THE SOFTWARE.
 """
 
 from myhdl import *
+from fcs import FcsCheck
+from frame_queue import FrameQueue, data_size
 
 class GMIIFrame(object):
     def __init__(self, data=b'', error=None):
         self.data = b''
         self.error = None
+        self.fcs_ok = None
 
         if type(data) is GMIIFrame:
             self.data = data.data
             self.error = data.error
+            self.fcs_ok = data.fcs_ok
         else:
             self.data = bytearray(data)
 
@@ -85,7 +89,7 @@ class GMIIFrame(object):
 class GMIISource(object):
     def __init__(self):
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue(data_size)
 
     def send(self, frame):
         self.queue.append(GMIIFrame(frame))
@@ -149,7 +153,7 @@ class GMIISource(object):
                             else:
                                 ifg_cnt = 12
                     elif self.queue:
-                        frame = GMIIFrame(self.queue.pop(0))
+                        frame = GMIIFrame(self.queue.popleft())
                         d, er = frame.build()
                         if name is not None:
                             print("[%s] Sending frame %s" % (name, repr(frame)))
@@ -178,12 +182,13 @@ class GMIISource(object):
 class GMIISink(object):
     def __init__(self):
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue(data_size)
         self.sync = Signal(intbv(0))
+        self.fcs_errors = 0
 
     def recv(self):
         if self.queue:
-            return self.queue.pop(0)
+            return self.queue.popleft()
         return None
 
     def count(self):
@@ -264,6 +269,11 @@ class GMIISink(object):
                                 d = d2
                                 er = er2
                             frame.parse(d, er)
+                            fcs = FcsCheck()
+                            fcs.update(d)
+                            frame.fcs_ok = fcs.ok()
+                            if not frame.fcs_ok:
+                                self.fcs_errors += 1
                             self.queue.append(frame)
                             self.sync.next = not self.sync
                             if name is not None:
@@ -23,10 +23,29 @@ THE SOFTWARE.
 """
 
 from myhdl import *
+from checksum import checksum
+from frame_queue import FrameQueue, payload_size
 import axis_ep
 import eth_ep
 import struct
 
+# version/IHL, DSCP/ECN, length, identification, flags/fragment offset,
+# TTL, protocol, header checksum, source IP, dest IP
+ip_hdr = struct.Struct('>BBHHHBBHLL')
+
+def pack_ip_header(buf, offset, frame):
+    ip_hdr.pack_into(buf, offset,
+        frame.ip_version << 4 | frame.ip_ihl,
+        frame.ip_dscp << 2 | frame.ip_ecn,
+        frame.ip_length,
+        frame.ip_identification,
+        frame.ip_flags << 13 | frame.ip_fragment_offset,
+        frame.ip_ttl,
+        frame.ip_protocol,
+        frame.ip_header_checksum,
+        frame.ip_source_ip,
+        frame.ip_dest_ip)
+
 class IPFrame(object):
     def __init__(self,
                 payload=b'',
@@ -119,18 +138,15 @@ class IPFrame(object):
         self.ip_length = len(self.payload.data) + 20
 
     def calc_checksum(self):
-        cksum = self.ip_version << 12 | self.ip_ihl << 8 | self.ip_dscp << 2 | self.ip_ecn
-        cksum += self.ip_length
-        cksum += self.ip_identification
-        cksum += self.ip_flags << 13 | self.ip_fragment_offset
-        cksum += self.ip_ttl << 8 | self.ip_protocol
-        cksum += self.ip_source_ip & 0xffff
-        cksum += (self.ip_source_ip >> 16) & 0xffff
-        cksum += self.ip_dest_ip & 0xffff
-        cksum += (self.ip_dest_ip >> 16) & 0xffff
-        cksum = (cksum & 0xffff) + (cksum >> 16)
-        cksum = (cksum & 0xffff) + (cksum >> 16)
-        return ~cksum & 0xffff
+        return checksum(struct.pack('>HHHHHxxLL',
+                self.ip_version << 12 | self.ip_ihl << 8 | self.ip_dscp << 2 | self.ip_ecn,
+                self.ip_length,
+                self.ip_identification,
+                self.ip_flags << 13 | self.ip_fragment_offset,
+                self.ip_ttl << 8 | self.ip_protocol,
+                self.ip_source_ip,
+                self.ip_dest_ip
+            ))
 
     def update_checksum(self):
         self.ip_header_checksum = self.calc_checksum()
@@ -145,26 +161,25 @@ class IPFrame(object):
             self.update_checksum()
 
     def build_axis(self):
-        return self.build_eth().build_axis()
+        self.build()
+        data = self.payload.data
+        buf = bytearray(34+len(data))
+
+        eth_ep.pack_eth_header(buf, 0, self)
+        pack_ip_header(buf, 14, self)
+        buf[34:] = data
+
+        return eth_ep.wrap_axis_frame(buf)
 
     def build_eth(self):
         self.build()
-        data = b''
-
-        data += struct.pack('B', self.ip_version << 4 | self.ip_ihl)
-        data += struct.pack('B', self.ip_dscp << 2 | self.ip_ecn)
-        data += struct.pack('>H', self.ip_length)
-        data += struct.pack('>H', self.ip_identification)
-        data += struct.pack('>H', self.ip_flags << 13 | self.ip_fragment_offset)
-        data += struct.pack('B', self.ip_ttl)
-        data += struct.pack('B', self.ip_protocol)
-        data += struct.pack('>H', self.ip_header_checksum)
-        data += struct.pack('>L', self.ip_source_ip)
-        data += struct.pack('>L', self.ip_dest_ip)
+        data = self.payload.data
+        buf = bytearray(20+len(data))
 
-        data += self.payload.data
+        pack_ip_header(buf, 0, self)
+        buf[20:] = data
 
-        return eth_ep.EthFrame(data, self.eth_dest_mac, self.eth_src_mac, self.eth_type)
+        return eth_ep.EthFrame(buf, self.eth_dest_mac, self.eth_src_mac, self.eth_type)
 
     def parse_axis(self, data):
         frame = eth_ep.EthFrame()
@@ -244,9 +259,9 @@ class IPFrameSource():
     def __init__(self):
         self.active = False
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue(payload_size)
         self.payload_source = axis_ep.AXIStreamSource()
-        self.header_queue = []
+        self.header_queue = FrameQueue()
         self.clk = Signal(bool(0))
 
     def send(self, frame):
@@ -333,7 +348,7 @@ class IPFrameSource():
                         ip_hdr_valid.next = False
                         self.active = False
                     if not self.active and self.header_queue:
-                        frame = self.header_queue.pop(0)
+                        frame = self.header_queue.popleft()
                         frame.build()
                         eth_dest_mac.next = frame.eth_dest_mac
                         eth_src_mac.next = frame.eth_src_mac
@@ -359,7 +374,7 @@ class IPFrameSource():
                         self.active = True
 
                     if self.queue and not self.header_queue:
-                        frame = self.queue.pop(0)
+                        frame = self.queue.popleft()
                         self.header_queue.append(frame)
                         self.payload_source.send(frame.payload)
 
@@ -369,14 +384,14 @@ class IPFrameSource():
 class IPFrameSink():
     def __init__(self):
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue(payload_size)
         self.payload_sink = axis_ep.AXIStreamSink()
-        self.header_queue = []
+        self.header_queue = FrameQueue()
         self.sync = Signal(intbv(0))
 
     def recv(self):
         if self.queue:
-            return self.queue.pop(0)
+            return self.queue.popleft()
         return None
 
     def count(self):
@@ -482,7 +497,7 @@ class IPFrameSink():
                         self.header_queue.append(frame)
 
                     if not self.payload_sink.empty() and self.header_queue:
-                        frame = self.header_queue.pop(0)
+                        frame = self.header_queue.popleft()
                         frame.payload = self.payload_sink.recv()
                         self.queue.append(frame)
                         self.sync.next = not self.sync
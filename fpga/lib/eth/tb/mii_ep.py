@@ -23,6 +23,7 @@ THE SOFTWARE.
 """
 
 from myhdl import *
+from frame_queue import FrameQueue, data_size
 
 class MIIFrame(object):
     def __init__(self, data=b'', error=None):
@@ -108,7 +109,7 @@ class MIIFrame(object):
 class MIISource(object):
     def __init__(self):
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue(data_size)
 
     def send(self, frame):
         self.queue.append(MIIFrame(frame))
@@ -168,7 +169,7 @@ class MIISource(object):
                         if len(d) == 0:
                             ifg_cnt = 12*2
                     elif self.queue:
-                        frame = MIIFrame(self.queue.pop(0))
+                        frame = MIIFrame(self.queue.popleft())
                         d, er = frame.build()
                         if name is not None:
                             print("[%s] Sending frame %s" % (name, repr(frame)))
@@ -186,12 +187,12 @@ class MIISource(object):
 class MIISink(object):
     def __init__(self):
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue(data_size)
         self.sync = Signal(intbv(0))
 
     def recv(self):
         if self.queue:
-            return self.queue.pop(0)
+            return self.queue.popleft()
         return None
 
     def count(self):
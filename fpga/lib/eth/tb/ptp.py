@@ -23,6 +23,7 @@ THE SOFTWARE.
 """
 
 from myhdl import *
+from frame_queue import FrameQueue
 
 class PtpClock(object):
     def __init__(self, period_ns=0x6, period_fns=0x6666, drift_ns=0x0, drift_fns=0x0002, drift_rate=5):
@@ -32,8 +33,8 @@ class PtpClock(object):
         self.drift_fns = drift_fns
         self.drift_rate = drift_rate
 
-        self.set_96_l = []
-        self.set_64_l = []
+        self.set_96_l = FrameQueue()
+        self.set_64_l = FrameQueue()
 
     def set_96(self, ts):
         self.set_96_l.append(ts)
@@ -90,7 +91,7 @@ class PtpClock(object):
                     ts_96_ns = t >> 16
 
                     if self.set_96_l:
-                        ts = self.set_96_l.pop(0)
+                        ts = self.set_96_l.popleft()
 
                         ts_96_s = ts >> 48
                         ts_96_ns = (ts >> 16) & 0x3fffffff
@@ -110,7 +111,7 @@ class PtpClock(object):
                     ts_64_ns = t >> 16
 
                     if self.set_64_l:
-                        ts = self.set_64_l.pop(0)
+                        ts = self.set_64_l.popleft()
 
                         ts_64_ns = ts >> 16
                         ts_64_fns = ts & 0xffff
@@ -25,9 +25,13 @@ THE SOFTWARE.
 
 from myhdl import *
 import os
+import random
+import struct
+import zlib
 
 import axis_ep
 import eth_ep
+import fcs
 
 module = 'axis_eth_fcs'
 testbench = 'test_%s' % module
@@ -156,6 +160,58 @@ def test_bench():
     sim = Simulation(bench())
     sim.run()
 
+def test_fcs():
+    rng = random.Random(1)
+    preamble = b'\x55'*7 + b'\xd5'
+
+    for length in list(range(0, 16)) + [60, 61, 1514]:
+        payload = bytes(rng.getrandbits(8) for i in range(length))
+        data = fcs.append_fcs(payload)
+
+        assert data == payload + struct.pack('<L', zlib.crc32(payload))
+        k = rng.randint(0, length)
+        assert fcs.calc_fcs(payload[k:], fcs.calc_fcs(payload[:k])) == zlib.crc32(payload)
+
+        # split anywhere, including mid-preamble and on the SFD
+        frame = preamble + data
+        for k in [1, 4, 7, 8, rng.randrange(1, len(frame))]:
+            check = fcs.FcsCheck()
+            check.update(frame[:k])
+            check.update(frame[k:])
+            assert check.ok()
+            assert check.count == len(data)
+
+        check = fcs.FcsCheck(preamble=False)
+        for b in data:
+            check.update([b])
+        assert check.ok()
+
+        # corrupted FCS, and corrupted data
+        for k in [len(data)-1, rng.randrange(len(data))]:
+            bad = bytearray(data)
+            bad[k] ^= 1 << rng.randrange(8)
+            check = fcs.FcsCheck()
+            check.update(preamble + bad)
+            assert not check.ok()
+
+        # valid FCS, but ended by an error control character
+        check = fcs.FcsCheck()
+        check.update(preamble + data)
+        check.error = True
+        assert not check.ok()
+
+    # fewer than 4 bytes after the SFD, and no SFD at all
+    for data in [b'', b'\x00', b'\x00\x00\x00', b'\x1c\xdf\x44']:
+        check = fcs.FcsCheck()
+        check.update(preamble + data)
+        assert not check.ok()
+
+    check = fcs.FcsCheck()
+    check.update(b'\x55'*7 + fcs.append_fcs(b'\x00'*60))
+    assert not check.ok()
+    assert check.count == 0
+
 if __name__ == '__main__':
     print("Running test...")
     test_bench()
+    test_fcs()
@@ -25,7 +25,9 @@ THE SOFTWARE.
 
 from myhdl import *
 import os
+import random
 
+import checksum
 import eth_ep
 import arp_ep
 import ip_ep
@@ -492,6 +494,44 @@ def test_bench():
     sim = Simulation(bench())
     sim.run()
 
+def test_checksum():
+    rng = random.Random(1)
+
+    # batch checksums against one at a time
+    bufs = [bytearray(rng.getrandbits(8) for i in range(rng.randrange(1, 100))) for k in range(32)]
+    pseudo = checksum.ones_sum(b'\xc0\xa8\x01\x64\xc0\xa8\x01\x65')
+    assert checksum.checksum_many(bufs) == [checksum.checksum(b) for b in bufs]
+    assert checksum.checksum_many(bufs, pseudo) == [checksum.checksum(b, pseudo) for b in bufs]
+
+    # incremental adjust against a full recompute
+    test_frame = udp_ep.UDPFrame()
+    test_frame.payload = bytearray(rng.getrandbits(8) for i in range(1500))
+    test_frame.build()
+
+    for k in range(32):
+        # 16-bit field
+        cksum = test_frame.udp_checksum
+        old = test_frame.udp_dest_port
+        test_frame.udp_dest_port = rng.getrandbits(16)
+        test_frame.udp_checksum = checksum.checksum_adjust(cksum, old, test_frame.udp_dest_port)
+        assert test_frame.verify_udp_checksum()
+
+        # 32-bit field, covered by both the IP and UDP (pseudo header) checksums
+        old = test_frame.ip_source_ip.to_bytes(4, 'big')
+        test_frame.ip_source_ip = rng.getrandbits(32)
+        new = test_frame.ip_source_ip.to_bytes(4, 'big')
+        test_frame.udp_checksum = checksum.checksum_adjust(test_frame.udp_checksum, old, new)
+        test_frame.ip_header_checksum = checksum.checksum_adjust(test_frame.ip_header_checksum, old, new)
+        assert test_frame.verify_checksums()
+
+        # TTL shares a word with the protocol
+        old = test_frame.ip_ttl << 8 | test_frame.ip_protocol
+        test_frame.ip_ttl = (test_frame.ip_ttl - 1) & 0xff
+        new = test_frame.ip_ttl << 8 | test_frame.ip_protocol
+        test_frame.ip_header_checksum = checksum.checksum_adjust(test_frame.ip_header_checksum, old, new)
+        assert test_frame.verify_ip_checksum()
+
 if __name__ == '__main__':
     print("Running test...")
     test_bench()
+    test_checksum()
@@ -23,11 +23,23 @@ THE SOFTWARE.
 """
 
 from myhdl import *
+from checksum import checksum, ones_sum
+from frame_queue import FrameQueue, payload_size
 import axis_ep
 import eth_ep
 import ip_ep
 import struct
 
+# source port, dest port, length, checksum
+udp_hdr = struct.Struct('>HHHH')
+
+def pack_udp_header(buf, offset, frame):
+    udp_hdr.pack_into(buf, offset,
+        frame.udp_source_port,
+        frame.udp_dest_port,
+        frame.udp_length,
+        frame.udp_checksum)
+
 class UDPFrame(object):
     def __init__(self,
                 payload=b'',
@@ -143,18 +155,15 @@ class UDPFrame(object):
         self.update_ip_length()
 
     def calc_ip_checksum(self):
-        cksum = self.ip_version << 12 | self.ip_ihl << 8 | self.ip_dscp << 2 | self.ip_ecn
-        cksum += self.ip_length
-        cksum += self.ip_identification
-        cksum += self.ip_flags << 13 | self.ip_fragment_offset
-        cksum += self.ip_ttl << 8 | self.ip_protocol
-        cksum += self.ip_source_ip & 0xffff
-        cksum += (self.ip_source_ip >> 16) & 0xffff
-        cksum += self.ip_dest_ip & 0xffff
-        cksum += (self.ip_dest_ip >> 16) & 0xffff
-        cksum = (cksum & 0xffff) + (cksum >> 16)
-        cksum = (cksum & 0xffff) + (cksum >> 16)
-        return ~cksum & 0xffff
+        return checksum(struct.pack('>HHHHHxxLL',
+                self.ip_version << 12 | self.ip_ihl << 8 | self.ip_dscp << 2 | self.ip_ecn,
+                self.ip_length,
+                self.ip_identification,
+                self.ip_flags << 13 | self.ip_fragment_offset,
+                self.ip_ttl << 8 | self.ip_protocol,
+                self.ip_source_ip,
+                self.ip_dest_ip
+            ))
 
     def update_ip_checksum(self):
         self.ip_header_checksum = self.calc_ip_checksum()
@@ -163,15 +172,8 @@ class UDPFrame(object):
         return self.ip_header_checksum == self.calc_ip_checksum()
 
     def calc_udp_pseudo_header_checksum(self):
-        cksum = self.ip_source_ip & 0xffff
-        cksum += (self.ip_source_ip >> 16) & 0xffff
-        cksum += self.ip_dest_ip & 0xffff
-        cksum += (self.ip_dest_ip >> 16) & 0xffff
-        cksum += self.ip_protocol
-        cksum += self.udp_length
-        cksum = (cksum & 0xffff) + (cksum >> 16)
-        cksum = (cksum & 0xffff) + (cksum >> 16)
-        return cksum
+        return ones_sum(struct.pack('>LLHH', self.ip_source_ip, self.ip_dest_ip,
+                self.ip_protocol, self.udp_length))
 
     def set_udp_pseudo_header_checksum(self):
         if self.udp_length is None:
@@ -180,19 +182,8 @@ class UDPFrame(object):
 
     def calc_udp_checksum(self):
         cksum = self.calc_udp_pseudo_header_checksum()
-        cksum += self.udp_source_port
-        cksum += self.udp_dest_port
-        cksum += self.udp_length
-        odd = False
-        for d in self.payload.data:
-            if odd:
-                cksum += d
-            else:
-                cksum += d << 8
-            odd = not odd
-        cksum = (cksum & 0xffff) + (cksum >> 16)
-        cksum = (cksum & 0xffff) + (cksum >> 16)
-        return ~cksum & 0xffff
+        cksum = ones_sum(struct.pack('>HHH', self.udp_source_port, self.udp_dest_port, self.udp_length), cksum)
+        return checksum(self.payload.data, cksum)
 
     def update_udp_checksum(self):
         if self.udp_length is None:
@@ -220,24 +211,38 @@ class UDPFrame(object):
             self.update_ip_checksum()
 
     def build_axis(self):
-        return self.build_eth().build_axis()
+        self.build()
+        data = self.payload.data
+        buf = bytearray(42+len(data))
+
+        eth_ep.pack_eth_header(buf, 0, self)
+        ip_ep.pack_ip_header(buf, 14, self)
+        pack_udp_header(buf, 34, self)
+        buf[42:] = data
+
+        return eth_ep.wrap_axis_frame(buf)
 
     def build_eth(self):
-        return self.build_ip().build_eth()
+        self.build()
+        data = self.payload.data
+        buf = bytearray(28+len(data))
+
+        ip_ep.pack_ip_header(buf, 0, self)
+        pack_udp_header(buf, 20, self)
+        buf[28:] = data
+
+        return eth_ep.EthFrame(buf, self.eth_dest_mac, self.eth_src_mac, self.eth_type)
 
     def build_ip(self):
         self.build()
-        data = b''
-
-        data += struct.pack('>H', self.udp_source_port)
-        data += struct.pack('>H', self.udp_dest_port)
-        data += struct.pack('>H', self.udp_length)
-        data += struct.pack('>H', self.udp_checksum)
+        data = self.payload.data
+        buf = bytearray(8+len(data))
 
-        data += self.payload.data
+        pack_udp_header(buf, 0, self)
+        buf[8:] = data
 
         return ip_ep.IPFrame(
-                data,
+                buf,
                 self.eth_dest_mac,
                 self.eth_src_mac,
                 self.eth_type,
@@ -348,9 +353,9 @@ class UDPFrameSource():
     def __init__(self):
         self.active = False
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue(payload_size)
         self.payload_source = axis_ep.AXIStreamSource()
-        self.header_queue = []
+        self.header_queue = FrameQueue()
         self.clk = Signal(bool(0))
 
     def send(self, frame):
@@ -441,7 +446,7 @@ class UDPFrameSource():
                         udp_hdr_valid.next = False
                         self.active = False
                     if not self.active and self.header_queue:
-                        frame = self.header_queue.pop(0)
+                        frame = self.header_queue.popleft()
                         frame.build()
                         eth_dest_mac.next = frame.eth_dest_mac
                         eth_src_mac.next = frame.eth_src_mac
@@ -471,7 +476,7 @@ class UDPFrameSource():
                         self.active = True
 
                     if self.queue and not self.header_queue:
-                        frame = self.queue.pop(0)
+                        frame = self.queue.popleft()
                         self.header_queue.append(frame)
                         self.payload_source.send(frame.payload)
 
@@ -481,14 +486,14 @@ class UDPFrameSource():
 class UDPFrameSink():
     def __init__(self):
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue(payload_size)
         self.payload_sink = axis_ep.AXIStreamSink()
-        self.header_queue = []
+        self.header_queue = FrameQueue()
         self.sync = Signal(intbv(0))
 
     def recv(self):
         if self.queue:
-            return self.queue.pop(0)
+            return self.queue.popleft()
         return None
 
     def count(self):
@@ -603,7 +608,7 @@ class UDPFrameSink():
                         self.header_queue.append(frame)
 
                     if not self.payload_sink.empty() and self.header_queue:
-                        frame = self.header_queue.pop(0)
+                        frame = self.header_queue.popleft()
                         frame.payload = self.payload_sink.recv()
                         self.queue.append(frame)
                         self.sync.next = not self.sync
@@ -23,6 +23,8 @@ THE SOFTWARE.
 """
 
 from myhdl import *
+from fcs import FcsCheck
+from frame_queue import FrameQueue, data_size
 
 ETH_PRE = 0x55
 ETH_SFD = 0xD5
@@ -46,11 +48,13 @@ class XGMIIFrame(object):
         self.data = b''
         self.error = None
         self.ctrl = None
+        self.fcs_ok = None
 
         if type(data) is XGMIIFrame:
             self.data = data.data
             self.error = data.error
             self.ctrl = data.ctrl
+            self.fcs_ok = data.fcs_ok
         else:
             self.data = bytearray(data)
 
@@ -58,41 +62,25 @@ class XGMIIFrame(object):
         if self.data is None:
             return
 
-        f = list(self.data)
-        ctrl = []
-        error = []
-        d = []
-        c = []
-        i = 0
-
-        assert_error = False
-        if (type(self.error) is int or type(self.error) is bool) and self.error:
-            assert_error = True
-            error = [0]*len(self.data)
-            error[-1] = 1
-        elif self.error is None:
-            error = [0]*len(self.data)
-        else:
-            error = list(self.error)
+        d = list(self.data)
 
         if self.ctrl is None:
-            ctrl = [0]*len(self.data)
+            c = [0]*len(d)
         else:
-            ctrl = list(self.ctrl)
-
-        assert len(ctrl) == len(f)
-        assert len(ctrl) == len(f)
+            c = list(self.ctrl)
 
-        for i in range(len(f)):
-            if error[i]:
-                f[i] = XGMII_ERROR
-                ctrl[i] = 1
+        assert len(c) == len(d)
 
-        i = 0
-        while len(f) > 0:
-            d.append(f.pop(0))
-            c.append(ctrl[i])
-            i += 1
+        if type(self.error) is int or type(self.error) is bool:
+            if self.error:
+                # error on last byte
+                d[-1] = XGMII_ERROR
+                c[-1] = 1
+        elif self.error is not None:
+            for i, e in enumerate(self.error):
+                if e:
+                    d[i] = XGMII_ERROR
+                    c[i] = 1
 
         return d, c
 
@@ -120,10 +108,27 @@ class XGMIIFrame(object):
         return self.data.__iter__()
 
 
+def build_lane_words(d, c, bw):
+    """Pack XGMII bytes and control flags into bw-lane (data, ctrl) words, padding the last with idles"""
+    pad = -len(d) % bw
+    d = bytes(d) + bytes([XGMII_IDLE])*pad
+    c = bytes(c) + b'\x01'*pad
+
+    # multiplying by m gathers the 0/1 control byte of each lane into the
+    # top byte, one bit per lane, without carries between lanes
+    m = sum(1 << 8*(bw-1)-7*i for i in range(bw))
+    shift = 8*(bw-1)
+    mask = (1 << bw)-1
+
+    return [(int.from_bytes(d[k:k+bw], 'little'),
+        (int.from_bytes(c[k:k+bw], 'little')*m >> shift) & mask)
+        for k in range(0, len(d), bw)]
+
+
 class XGMIISource(object):
     def __init__(self, ifg=12, enable_dic=True):
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue(data_size)
         self.ifg = ifg
         self.enable_dic = enable_dic
         self.force_offset_start = False
@@ -155,11 +160,12 @@ class XGMIISource(object):
 
         bw = int(len(txd)/8)
 
+        idle_word = (0x0707070707070707 if bw == 8 else 0x07070707, 0xff if bw == 8 else 0xf)
+
         @instance
         def logic():
-            frame = None
-            dl = []
-            cl = []
+            words = []
+            k = 0
             ifg_cnt = 0
             deficit_idle_cnt = 0
 
@@ -167,36 +173,17 @@ class XGMIISource(object):
                 yield clk.posedge, rst.posedge
 
                 if rst:
-                    frame = None
-                    txd.next = 0x0707070707070707 if bw == 8 else 0x07070707
-                    txc.next = 0xff if bw == 8 else 0xf
-                    dl = []
-                    cl = []
+                    words = []
+                    k = 0
+                    txd.next, txc.next = idle_word
                     ifg_cnt = 0
                     deficit_idle_cnt = 0
                 elif enable:
-                    if ifg_cnt > bw-1 or (not self.enable_dic and ifg_cnt > 0):
-                        ifg_cnt = max(ifg_cnt - bw, 0)
-                        txd.next = 0x0707070707070707 if bw == 8 else 0x07070707
-                        txc.next = 0xff if bw == 8 else 0xf
-                    elif dl:
-                        d = 0
-                        c = 0
-
-                        for i in range(bw):
-                            if dl:
-                                d |= dl.pop(0) << (8*i)
-                                c |= cl.pop(0) << i
-                                if not dl:
-                                    ifg_cnt = self.ifg - (bw-i) + deficit_idle_cnt
-                            else:
-                                d |= XGMII_IDLE << (8*i)
-                                c |= 1 << i
-
-                        txd.next = d
-                        txc.next = c
+                    if k < len(words):
+                        txd.next, txc.next = words[k]
+                        k += 1
                     elif self.queue:
-                        frame = self.queue.pop(0)
+                        frame = self.queue.popleft()
                         dl, cl = frame.build()
                         if name is not None:
                             print("[%s] Sending frame %s" % (name, repr(frame)))
@@ -214,28 +201,21 @@ class XGMIISource(object):
                             cl = [1]*4+cl
 
                         deficit_idle_cnt = max(ifg_cnt, 0)
-                        ifg_cnt = 0
 
-                        d = 0
-                        c = 0
-
-                        for i in range(0,bw):
-                            if dl:
-                                d |= dl.pop(0) << (8*i)
-                                c |= cl.pop(0) << i
-                                if not dl:
-                                    ifg_cnt = self.ifg - (bw-i) + deficit_idle_cnt
-                            else:
-                                d |= XGMII_IDLE << (8*i)
-                                c |= 1 << i
+                        # compile the whole frame into lane words, followed
+                        # by the full idle words of the inter-frame gap
+                        words = build_lane_words(dl, cl, bw)
+                        ifg_cnt = self.ifg - (bw-(len(dl)-1) % bw) + deficit_idle_cnt
+                        while ifg_cnt > bw-1 or (not self.enable_dic and ifg_cnt > 0):
+                            ifg_cnt = max(ifg_cnt - bw, 0)
+                            words.append(idle_word)
 
-                        txd.next = d
-                        txc.next = c
+                        txd.next, txc.next = words[0]
+                        k = 1
                     else:
                         ifg_cnt = 0
                         deficit_idle_cnt = 0
-                        txd.next = 0x0707070707070707 if bw == 8 else 0x07070707
-                        txc.next = 0xff if bw == 8 else 0xf
+                        txd.next, txc.next = idle_word
 
         return instances()
 
@@ -243,12 +223,13 @@ class XGMIISource(object):
 class XGMIISink(object):
     def __init__(self):
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue(data_size)
         self.sync = Signal(intbv(0))
+        self.fcs_errors = 0
 
     def recv(self):
         if self.queue:
-            return self.queue.pop(0)
+            return self.queue.popleft()
         return None
 
     def count(self):
@@ -289,6 +270,7 @@ class XGMIISink(object):
             frame = None
             d = []
             c = []
+            fcs = None
 
             while True:
                 yield clk.posedge, rst.posedge
@@ -307,6 +289,8 @@ class XGMIISink(object):
                             for i in range(1,bw):
                                 d.append((int(rxd) >> (8*i)) & 0xff)
                                 c.append((int(rxc) >> i) & 1)
+                            fcs = FcsCheck()
+                            fcs.update(d)
                         elif bw == 8 and (rxc >> 4) & 1 and (rxd >> 32) & 0xff == XGMII_START:
                             # start in lane 4
                             frame = XGMIIFrame()
@@ -315,15 +299,24 @@ class XGMIISink(object):
                             for i in range(5,bw):
                                 d.append((int(rxd) >> (8*i)) & 0xff)
                                 c.append((int(rxc) >> i) & 1)
+                            fcs = FcsCheck()
+                            fcs.update(d)
                     else:
+                        # check FCS as data arrives
+                        n = len(d)
                         for i in range(bw):
                             if (rxc >> i) & 1:
                                 # got a control character; terminate frame reception
+                                fcs.update(d[n:])
                                 if (rxd >> (8*i)) & 0xff != XGMII_TERM:
                                     # store control character if it's not a termination
+                                    fcs.error = True
                                     d.append((int(rxd) >> (8*i)) & 0xff)
                                     c.append((int(rxc) >> i) & 1)
                                 frame.parse(d, c)
+                                frame.fcs_ok = fcs.ok()
+                                if not frame.fcs_ok:
+                                    self.fcs_errors += 1
                                 self.queue.append(frame)
                                 self.sync.next = not self.sync
                                 if name is not None:
@@ -335,6 +328,8 @@ class XGMIISink(object):
                             else:
                                 d.append((int(rxd) >> (8*i)) & 0xff)
                                 c.append((int(rxc) >> i) & 1)
+                        else:
+                            fcs.update(d[n:])
 
         return instances()
 
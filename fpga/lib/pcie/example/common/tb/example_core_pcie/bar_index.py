@@ -0,0 +1 @@
+../../../../tb/bar_index.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../../../tb/model_trace.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../../../tb/tag_pool.py
\ No newline at end of file
@@ -23,6 +23,7 @@ THE SOFTWARE.
 """
 
 from myhdl import *
+from frame_queue import FrameQueue, data_size
 
 skip_asserts = False
 
@@ -83,22 +84,29 @@ class AXIStreamFrame(object):
         if self.data is None:
             return
 
-        f = list(self.data)
+        f = self.data
         tdata = []
         tkeep = []
         tid = []
         tdest = []
         tuser = []
         i = 0
+        offset = 0
 
-        while len(f) > 0:
+        # pack bytes directly when possible
+        packed = type(f) in (bytes, bytearray) and self.WL == 8
+
+        while offset < len(f):
             if self.B == 0:
-                data = 0
-                keep = 0
-                for j in range(self.M):
-                    data = data | (f.pop(0) << (j*self.WL))
-                    keep = keep | (1 << j)
-                    if len(f) == 0: break
+                n = min(self.M, len(f)-offset)
+                if packed:
+                    data = int.from_bytes(f[offset:offset+n], 'little')
+                else:
+                    data = 0
+                    for j, w in enumerate(f[offset:offset+n]):
+                        data |= w << (j*self.WL)
+                keep = (1 << n)-1
+                offset += n
                 tdata.append(data)
 
                 if self.keep is None:
@@ -107,8 +115,8 @@ class AXIStreamFrame(object):
                     tkeep.append(self.keep[i])
             else:
                 # multiple tdata signals
-                data = 0
-                tdata.append(f.pop(0))
+                tdata.append(f[offset])
+                offset += 1
                 tkeep.append(0)
 
             if self.id is None:
@@ -249,7 +257,7 @@ class AXIStreamFrame(object):
 class AXIStreamSource(object):
     def __init__(self):
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue(data_size)
 
     def send(self, frame):
         self.queue.append(AXIStreamFrame(frame))
@@ -298,6 +306,7 @@ class AXIStreamSource(object):
             id = []
             dest = []
             user = []
+            k = 0
             B = 0
             N = len(tdata)
             M = len(tkeep)
@@ -327,25 +336,26 @@ class AXIStreamSource(object):
                     tlast.next = False
                 else:
                     if tready_int and tvalid:
-                        if len(data) > 0:
+                        if k < len(data):
                             if B > 0:
-                                l = data.pop(0)
+                                l = data[k]
                                 for i in range(B):
                                     tdata[i].next = l[i]
                             else:
-                                tdata.next = data.pop(0)
-                            tkeep.next = keep.pop(0)
-                            tid.next = id.pop(0)
-                            tdest.next = dest.pop(0)
-                            tuser.next = user.pop(0)
+                                tdata.next = data[k]
+                            tkeep.next = keep[k]
+                            tid.next = id[k]
+                            tdest.next = dest[k]
+                            tuser.next = user[k]
+                            k += 1
                             tvalid_int.next = True
-                            tlast.next = len(data) == 0
+                            tlast.next = k == len(data)
                         else:
                             tvalid_int.next = False
                             tlast.next = False
                     if (tlast and tready_int and tvalid) or not tvalid_int:
                         if self.queue:
-                            frame = self.queue.pop(0)
+                            frame = self.queue.popleft()
                             frame.B = B
                             frame.N = N
                             frame.M = M
@@ -354,17 +364,18 @@ class AXIStreamSource(object):
                             if name is not None:
                                 print("[%s] Sending frame %s" % (name, repr(frame)))
                             if B > 0:
-                                l = data.pop(0)
+                                l = data[0]
                                 for i in range(B):
                                     tdata[i].next = l[i]
                             else:
-                                tdata.next = data.pop(0)
-                            tkeep.next = keep.pop(0)
-                            tid.next = id.pop(0)
-                            tdest.next = dest.pop(0)
-                            tuser.next = user.pop(0)
+                                tdata.next = data[0]
+                            tkeep.next = keep[0]
+                            tid.next = id[0]
+                            tdest.next = dest[0]
+                            tuser.next = user[0]
+                            k = 1
                             tvalid_int.next = True
-                            tlast.next = len(data) == 0
+                            tlast.next = k == len(data)
 
         return instances()
 
@@ -372,18 +383,18 @@ class AXIStreamSource(object):
 class AXIStreamSink(object):
     def __init__(self):
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue(data_size)
         self.read_queue = []
         self.sync = Signal(intbv(0))
 
     def recv(self):
         if self.queue:
-            return self.queue.pop(0)
+            return self.queue.popleft()
         return None
 
     def read(self, count=-1):
         while self.queue:
-            self.read_queue.extend(self.queue.pop(0).data)
+            self.read_queue.extend(self.queue.popleft().data)
         if count < 0:
             count = len(self.read_queue)
         data = self.read_queue[:count]
@@ -0,0 +1,109 @@
+"""
+
+Copyright (c) 2021 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+
+from bisect import bisect_right
+
+
+class BarIndex:
+    """Sorted BAR address ranges for a set of functions, matches in the same
+    order as calling match_bar on each function in turn"""
+    def __init__(self, functions, io=False):
+        self.io = io
+        self.valid = True
+
+        # ranges grouped by the address bits the BAR decodes (32 or 64 bit)
+        ranges = {}
+
+        for order, f in enumerate(functions):
+            bar = 0
+            while bar < len(f.bar):
+                bar_val = f.bar[bar]
+                bar_mask = f.bar_mask[bar]
+
+                orig_bar = bar
+                bar += 1
+
+                if bar_mask == 0:
+                    # unimplemented BAR
+                    continue
+
+                if bar_val & 1:
+                    # IO BAR
+                    if not io:
+                        continue
+                else:
+                    # Memory BAR
+                    if bar_val & 4:
+                        # 64 bit BAR
+                        if bar >= len(f.bar):
+                            raise Exception("Final BAR marked as 64 bit, but no extension BAR available")
+
+                        bar_val |= f.bar[bar] << 32
+                        bar_mask |= f.bar_mask[bar] << 32
+
+                        bar += 1
+
+                    if io:
+                        continue
+
+                key_mask = (1 << bar_mask.bit_length())-1
+                size_mask = key_mask & ~bar_mask
+
+                if size_mask & (size_mask+1):
+                    # not a power of two sized window
+                    self.valid = False
+                    continue
+
+                base = bar_val & bar_mask
+                ranges.setdefault(key_mask, []).append((base, base | size_mask, (order, orig_bar), f))
+
+        self.tables = []
+
+        for key_mask, lst in ranges.items():
+            lst.sort(key=lambda x: x[0])
+
+            for a, b in zip(lst, lst[1:]):
+                if b[0] <= a[1]:
+                    # overlapping BARs (e.g. before enumeration), first match wins
+                    self.valid = False
+
+            self.tables.append((key_mask, [x[0] for x in lst], lst))
+
+    def match(self, addr):
+        # returns (function, bar index) or None
+        best = None
+
+        for key_mask, bases, lst in self.tables:
+            a = addr & key_mask
+            i = bisect_right(bases, a)-1
+            if i >= 0:
+                base, limit, order, f = lst[i]
+                if a <= limit and (best is None or order < best[0]):
+                    best = (order, f)
+
+        if best is None:
+            return None
+
+        return best[1], best[0][1]
@@ -0,0 +1 @@
+../byte_enable.py
\ No newline at end of file
@@ -0,0 +1 @@
+../model_trace.py
\ No newline at end of file
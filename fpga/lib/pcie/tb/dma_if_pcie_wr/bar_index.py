@@ -0,0 +1 @@
+../bar_index.py
\ No newline at end of file
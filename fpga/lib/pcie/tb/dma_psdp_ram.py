@@ -23,6 +23,8 @@ THE SOFTWARE.
 """
 
 import logging
+import random
+from collections import deque
 
 import cocotb
 from cocotb.triggers import RisingEdge
@@ -30,6 +32,9 @@ from cocotb_bus.bus import Bus
 
 from cocotbext.axi.memory import Memory
 
+from byte_enable import write_masked
+from model_trace import ModelTrace, HexBytes, TRACE_RAM_WRITE, TRACE_RAM_READ
+
 
 class BaseBus(Bus):
 
@@ -87,6 +92,8 @@ class PsdpRamWrite(Memory):
         self.clock = clock
         self.reset = reset
         self.log = logging.getLogger(f"cocotb.{bus._entity._name}.{bus._name}")
+        # per-word messages are logged at DEBUG; set trace.level to INFO to enable
+        self.trace = ModelTrace(self.log, logging.DEBUG)
 
         self.log.info("Parallel Simple Dual Port RAM model (write)")
         self.log.info("Copyright (c) 2020 Alex Forencich")
@@ -138,6 +145,10 @@ class PsdpRamWrite(Memory):
     def clear_pause_generator(self):
         self.set_pause_generator(None)
 
+    def write_word(self, address, data, be):
+        """Write one segment word at address, masked by byte enable be"""
+        return write_masked(self.mem, address, data, be, self.seg_byte_lanes)
+
     async def _run(self):
         cmd_ready = 0
 
@@ -167,20 +178,14 @@ class PsdpRamWrite(Memory):
 
                     addr = (seg_addr*self.seg_count+seg)*self.seg_byte_lanes
 
-                    self.mem.seek(addr % self.size)
-
-                    data = seg_data.to_bytes(self.seg_byte_lanes, 'little')
-
-                    for i in range(self.seg_byte_lanes):
-                        if seg_be & (1 << i):
-                            self.mem.write(data[i:i+1])
-                        else:
-                            self.mem.seek(1, 1)
+                    data = self.write_word(addr % self.size, seg_data, seg_be)
 
                     wr_done |= 1 << seg
 
-                    self.log.info("Write word seg: %d addr: 0x%08x be 0x%02x data %s",
-                        seg, addr, seg_be, ' '.join((f'{c:02x}' for c in data)))
+                    if self.trace.enabled:
+                        self.trace.msg("Write word seg: %d addr: 0x%08x be 0x%02x data %s",
+                            seg, addr, seg_be, HexBytes(data))
+                        self.trace.record(TRACE_RAM_WRITE, (seg, addr, seg_be), data)
 
             cmd_ready = 2**self.seg_count-1
 
@@ -198,11 +203,13 @@ class PsdpRamWrite(Memory):
 
 class PsdpRamRead(Memory):
 
-    def __init__(self, bus, clock, reset=None, size=1024, mem=None, *args, **kwargs):
+    def __init__(self, bus, clock, reset=None, size=1024, mem=None, latency=1, depth=None,
+            max_reads_per_cycle=None, stall_probability=0.0, seed=None, *args, **kwargs):
         self.bus = bus
         self.clock = clock
         self.reset = reset
         self.log = logging.getLogger(f"cocotb.{bus._entity._name}.{bus._name}")
+        self.trace = ModelTrace(self.log)
 
         self.log.info("Parallel Simple Dual Port RAM model (read)")
         self.log.info("Copyright (c) 2020 Alex Forencich")
@@ -225,12 +232,25 @@ class PsdpRamRead(Memory):
         self.seg_data_mask = 2**self.seg_data_width-1
         self.seg_addr_mask = 2**self.seg_addr_width-1
 
+        # cycles from command accept to response valid
+        self.latency = latency
+        # outstanding reads per segment; latency+1 sustains one read per cycle
+        self.depth = depth
+        # limit on commands accepted per cycle across all segments
+        self.max_reads_per_cycle = max_reads_per_cycle
+        # probability of deasserting ready on a segment in a given cycle
+        self.stall_probability = stall_probability
+        self._rng = random.Random(seed)
+
+        assert self.latency >= 1
+
         self.log.info("Parallel Simple Dual Port RAM model configuration:")
         self.log.info("  Memory size: %d bytes", len(self.mem))
         self.log.info("  Segment count: %d", self.seg_count)
         self.log.info("  Segment addr width: %d bits", self.seg_addr_width)
         self.log.info("  Segment data width: %d bits (%d bytes)", self.seg_data_width, self.seg_byte_lanes)
         self.log.info("  Total data width: %d bits (%d bytes)", self.width, self.width // self.byte_size)
+        self.log.info("  Read latency: %d cycles", self.latency)
 
         self.bus.rd_cmd_ready.setimmediatevalue(0)
         self.bus.rd_resp_valid.setimmediatevalue(0)
@@ -251,8 +271,11 @@ class PsdpRamRead(Memory):
         self.set_pause_generator(None)
 
     async def _run(self):
-        pipeline = [[None for x in range(1)] for seg in range(self.seg_count)]
+        # per-segment FIFO of (due cycle, data)
+        pipeline = [deque() for seg in range(self.seg_count)]
 
+        cycle = 0
+        rr_seg = 0
         cmd_ready = 0
         resp_valid = 0
         resp_data = 0
@@ -260,6 +283,8 @@ class PsdpRamRead(Memory):
         while True:
             await RisingEdge(self.clock)
 
+            cycle += 1
+
             cmd_valid_sample = self.bus.rd_cmd_valid.value
 
             if cmd_valid_sample:
@@ -272,26 +297,26 @@ class PsdpRamRead(Memory):
                 self.bus.rd_resp_valid.setimmediatevalue(0)
                 cmd_ready = 0
                 resp_valid = 0
+                for fifo in pipeline:
+                    fifo.clear()
                 continue
 
+            depth = self.depth or self.latency+1
+            next_cmd_ready = 0
+
             # process segments
             for seg in range(self.seg_count):
                 seg_mask = 1 << seg
+                fifo = pipeline[seg]
 
                 if (resp_ready_sample & seg_mask) or not (resp_valid & seg_mask):
-                    if pipeline[seg][-1] is not None:
+                    if fifo and fifo[0][0] <= cycle:
                         resp_data &= ~(self.seg_data_mask << self.seg_data_width*seg)
-                        resp_data |= ((pipeline[seg][-1] & self.seg_data_mask) << self.seg_data_width*seg)
+                        resp_data |= ((fifo.popleft()[1] & self.seg_data_mask) << self.seg_data_width*seg)
                         resp_valid |= seg_mask
-                        pipeline[seg][-1] = None
                     else:
                         resp_valid &= ~seg_mask
 
-                for i in range(len(pipeline[seg])-1, 0, -1):
-                    if pipeline[seg][i] is None:
-                        pipeline[i] = pipeline[i-1]
-                        pipeline[i-1] = None
-
                 if cmd_ready & cmd_valid_sample & seg_mask:
                     seg_addr = (cmd_addr_sample >> self.seg_addr_width*seg) & self.seg_addr_mask
 
@@ -300,15 +325,32 @@ class PsdpRamRead(Memory):
                     self.mem.seek(addr % self.size)
 
                     data = self.mem.read(self.seg_byte_lanes)
-                    pipeline[seg][0] = int.from_bytes(data, 'little')
-
-                    self.log.info("Read word seg: %d addr: 0x%08x data %s",
-                        seg, addr, ' '.join((f'{c:02x}' for c in data)))
-
-                if (not resp_valid & seg_mask) or None in pipeline[seg]:
-                    cmd_ready |= seg_mask
-                else:
-                    cmd_ready &= ~seg_mask
+                    fifo.append((cycle+self.latency, int.from_bytes(data, 'little')))
+
+                    if self.trace.enabled:
+                        self.trace.msg("Read word seg: %d addr: 0x%08x data %s",
+                            seg, addr, HexBytes(data))
+                        self.trace.record(TRACE_RAM_READ, (seg, addr), data)
+
+                if len(fifo) < depth:
+                    if not self.stall_probability or self._rng.random() >= self.stall_probability:
+                        next_cmd_ready |= seg_mask
+
+            if self.max_reads_per_cycle is not None:
+                # grant at most max_reads_per_cycle segments, round-robin
+                limit = self.max_reads_per_cycle
+                granted = 0
+                for k in range(self.seg_count):
+                    if limit <= 0:
+                        break
+                    seg_mask = 1 << ((rr_seg+k) % self.seg_count)
+                    if next_cmd_ready & seg_mask:
+                        limit -= 1
+                        granted |= seg_mask
+                next_cmd_ready = granted
+                rr_seg = (rr_seg+1) % self.seg_count
+
+            cmd_ready = next_cmd_ready
 
             if self.pause:
                 cmd_ready = 0
@@ -325,11 +367,11 @@ class PsdpRamRead(Memory):
 
 
 class PsdpRam(Memory):
-    def __init__(self, bus, clock, reset=None, size=1024, mem=None, *args, **kwargs):
+    def __init__(self, bus, clock, reset=None, size=1024, mem=None, read_latency=1, *args, **kwargs):
         self.write_if = None
         self.read_if = None
 
         super().__init__(size, mem, *args, **kwargs)
 
         self.write_if = PsdpRamWrite(bus.write, clock, reset, mem=self.mem)
-        self.read_if = PsdpRamRead(bus.read, clock, reset, mem=self.mem)
+        self.read_if = PsdpRamRead(bus.read, clock, reset, mem=self.mem, latency=read_latency)
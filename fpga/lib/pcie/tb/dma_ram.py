@@ -25,6 +25,8 @@ THE SOFTWARE.
 from myhdl import *
 import mmap
 
+from byte_enable import write_masked
+
 class PSDPRam(object):
     def __init__(self, size = 1024):
         self.size = size
@@ -38,6 +40,10 @@ class PSDPRam(object):
         self.mem.seek(address)
         self.mem.write(bytes(data))
 
+    def write_word(self, address, data, be, width):
+        """Write width bytes of integer data at address, masked by byte enable be"""
+        return write_masked(self.mem, address, data, be, width)
+
     def create_write_ports(self,
                 clk,
                 ram_wr_cmd_be=Signal(intbv(1)[1:]),
@@ -119,19 +125,8 @@ class PSDPRam(object):
                 addr = (ram_wr_cmd_addr*stride+offset)*bw
 
                 if ram_wr_cmd_ready and ram_wr_cmd_valid:
-                    self.mem.seek(addr % self.size)
+                    data = self.write_word(addr % self.size, int(ram_wr_cmd_data), int(ram_wr_cmd_be), bw)
 
-                    data = bytearray()
-                    val = int(ram_wr_cmd_data)
-
-                    for i in range(bw):
-                        data.extend(bytearray([val & 0xff]))
-                        val >>= 8
-                    for i in range(bw):
-                        if ram_wr_cmd_be & (1 << i):
-                            self.mem.write(bytes(data[i:i+1]))
-                        else:
-                            self.mem.seek(1, 1)
                     if name is not None:
                         print("[%s] Write word addr: 0x%08x be: 0x%02x data: %s" % (name, addr, ram_wr_cmd_be, " ".join(("{:02x}".format(c) for c in bytearray(data)))))
 
@@ -253,12 +248,8 @@ class PSDPRam(object):
                 if ram_rd_cmd_ready and ram_rd_cmd_valid:
                     self.mem.seek(addr % self.size)
 
-                    data = bytearray(self.mem.read(bw))
-                    val = 0
-                    for i in range(bw-1,-1,-1):
-                        val <<= 8
-                        val += data[i]
-                    pipeline[0] = val
+                    data = self.mem.read(bw)
+                    pipeline[0] = int.from_bytes(data, 'little')
                     if name is not None:
                         print("[%s] Read word addr: 0x%08x data: %s" % (name, addr, " ".join(("{:02x}".format(c) for c in bytearray(data)))))
 
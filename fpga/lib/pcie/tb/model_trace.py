@@ -0,0 +1,149 @@
+"""
+
+Copyright (c) 2021 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+import logging
+import struct
+from collections import namedtuple
+
+
+# record types
+TRACE_CHANNEL = 0
+TRACE_FRAME_TX = 1
+TRACE_FRAME_RX = 2
+TRACE_RAM_WRITE = 3
+TRACE_RAM_READ = 4
+
+# record header: sim time (ps), channel, record type, payload length
+_record_hdr = struct.Struct('<QHBxI')
+
+# fixed fields at the start of each record payload, remainder is data
+_record_fields = {
+    TRACE_CHANNEL: struct.Struct(''),
+    # hdr, tlp_prfx, func_num, bar_id, error, seq
+    TRACE_FRAME_TX: struct.Struct('<16sIBBBB'),
+    TRACE_FRAME_RX: struct.Struct('<16sIBBBB'),
+    # seg, addr, be
+    TRACE_RAM_WRITE: struct.Struct('<BQQ'),
+    # seg, addr
+    TRACE_RAM_READ: struct.Struct('<BQ'),
+}
+
+TraceRecord = namedtuple('TraceRecord', ['time', 'channel', 'type', 'fields', 'data'])
+
+
+class HexBytes:
+    # deferred hex dump for log arguments
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return ' '.join(f'{c:02x}' for c in self.data)
+
+
+class TraceSink:
+    def __init__(self, f):
+        if isinstance(f, str):
+            f = open(f, 'wb')
+        self.file = f
+        self.channels = {}
+
+    def add_channel(self, name):
+        if name in self.channels:
+            return self.channels[name]
+        channel = len(self.channels)
+        self.channels[name] = channel
+        self.write(channel, TRACE_CHANNEL, 0, (), name.encode())
+        return channel
+
+    def write(self, channel, rec_type, time, fields, data=b''):
+        fields = _record_fields[rec_type].pack(*fields)
+        self.file.write(_record_hdr.pack(time, channel, rec_type, len(fields)+len(data)))
+        self.file.write(fields)
+        self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def read_trace(f):
+    if isinstance(f, str):
+        with open(f, 'rb') as fh:
+            yield from read_trace(fh)
+        return
+
+    channels = {}
+
+    while True:
+        hdr = f.read(_record_hdr.size)
+        if len(hdr) < _record_hdr.size:
+            return
+
+        time, channel, rec_type, length = _record_hdr.unpack(hdr)
+        payload = f.read(length)
+
+        fmt = _record_fields[rec_type]
+        fields = fmt.unpack_from(payload)
+        data = payload[fmt.size:]
+
+        if rec_type == TRACE_CHANNEL:
+            channels[channel] = data.decode()
+            continue
+
+        yield TraceRecord(time, channels.get(channel, channel), rec_type, fields, data)
+
+
+class ModelTrace:
+    def __init__(self, log, level=logging.INFO):
+        self.log = log
+        # level for per-transfer messages; set to DEBUG to quiet a single model
+        self.level = level
+        self.sink = None
+        self.channel = None
+        self._get_sim_time = None
+
+    def set_sink(self, sink):
+        self.sink = sink
+        self.channel = None
+
+        if sink is not None:
+            from cocotb.utils import get_sim_time
+            self._get_sim_time = get_sim_time
+            self.channel = sink.add_channel(self.log.name)
+
+    @property
+    def enabled(self):
+        return self.sink is not None or self.log.isEnabledFor(self.level)
+
+    def msg(self, msg, *args):
+        if self.log.isEnabledFor(self.level):
+            self.log.log(self.level, msg, *args)
+
+    def record(self, rec_type, fields, data=b''):
+        if self.sink is not None:
+            self.sink.write(self.channel, rec_type, int(self._get_sim_time('ps')), fields, data)
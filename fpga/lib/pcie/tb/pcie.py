@@ -26,8 +26,15 @@ import inspect
 import math
 import mmap
 import struct
+import sys
+from bisect import bisect_right
+from collections import deque
 from myhdl import *
 
+from bar_index import BarIndex
+from byte_enable import byte_enable_runs
+from tag_pool import TagPool
+
 # TLP formats
 FMT_3DW        = 0x0
 FMT_4DW        = 0x1
@@ -76,6 +83,30 @@ TLP_PREFIX_EXT_TPH     = (FMT_TLP_PREFIX, 0x10)
 TLP_PREFIX_VENDOR_E0   = (FMT_TLP_PREFIX, 0x1E)
 TLP_PREFIX_VENDOR_E1   = (FMT_TLP_PREFIX, 0x1F)
 
+# TLP header layouts
+TLP_HDR_REQ = 0
+TLP_HDR_CFG = 1
+TLP_HDR_CPL = 2
+
+tlp_header_layout = {
+    TLP_MEM_READ:           TLP_HDR_REQ,
+    TLP_MEM_READ_64:        TLP_HDR_REQ,
+    TLP_MEM_READ_LOCKED:    TLP_HDR_REQ,
+    TLP_MEM_READ_LOCKED_64: TLP_HDR_REQ,
+    TLP_MEM_WRITE:          TLP_HDR_REQ,
+    TLP_MEM_WRITE_64:       TLP_HDR_REQ,
+    TLP_IO_READ:            TLP_HDR_REQ,
+    TLP_IO_WRITE:           TLP_HDR_REQ,
+    TLP_CFG_READ_0:         TLP_HDR_CFG,
+    TLP_CFG_WRITE_0:        TLP_HDR_CFG,
+    TLP_CFG_READ_1:         TLP_HDR_CFG,
+    TLP_CFG_WRITE_1:        TLP_HDR_CFG,
+    TLP_CPL:                TLP_HDR_CPL,
+    TLP_CPL_DATA:           TLP_HDR_CPL,
+    TLP_CPL_LOCKED:         TLP_HDR_CPL,
+    TLP_CPL_LOCKED_DATA:    TLP_HDR_CPL,
+}
+
 # Message types
 MSG_UNLOCK         = 0x00
 MSG_INVALIDATE_REQ = 0x01
@@ -112,6 +143,11 @@ CPL_STATUS_UR  = 0x1 # unsupported request
 CPL_STATUS_CRS = 0x2 # configuration request retry status
 CPL_STATUS_CA  = 0x4 # completer abort
 
+# flow control credit types
+FC_TYPE_P   = 0 # posted
+FC_TYPE_NP  = 1 # non-posted
+FC_TYPE_CPL = 2 # completion
+
 # PCIe capabilities
 MSI_CAP_ID = 0x05
 MSI_CAP_LEN = 6
@@ -139,6 +175,66 @@ PCIE_GEN_RATE = {
 # debugging
 trace_routing = False
 
+# trace levels
+TRACE_ERROR = 1
+TRACE_INFO = 2
+TRACE_TLP = 3
+
+# messages at or below this level are printed
+trace_level = TRACE_INFO
+
+# optional ring buffer of recent messages at all levels, see trace_buffer_enable
+trace_buffer = None
+
+
+def trace(level, source, msg, *args):
+    # formatting is deferred until the message is printed or dumped
+    if level <= trace_level:
+        print(trace_format(source, msg, args))
+    if trace_buffer is not None:
+        trace_buffer.append((source, msg, args))
+
+
+def trace_format(source, msg, args):
+    if args:
+        msg = msg % args
+    if source is None:
+        return msg
+    if hasattr(source, 'get_desc'):
+        source = highlight(source.get_desc())
+    return "[%s] %s" % (source, msg)
+
+
+def trace_buffer_enable(size=1000):
+    global trace_buffer
+    trace_buffer = deque(maxlen=size) if size else None
+
+
+def trace_dump(file=None):
+    if trace_buffer is None:
+        return
+    if file is None:
+        file = sys.stdout
+    print("Trace buffer (last %d messages):" % len(trace_buffer), file=file)
+    while trace_buffer:
+        print(trace_format(*trace_buffer.popleft()), file=file)
+
+
+class trace_on_failure(object):
+    """Context manager, dumps the trace buffer if the block raises"""
+    def __init__(self, size=1000):
+        self.size = size
+
+    def __enter__(self):
+        if self.size and trace_buffer is None:
+            trace_buffer_enable(self.size)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            trace_dump()
+        return False
+
 
 def align(val, mask):
     if val & mask:
@@ -159,10 +255,48 @@ def byte_mask_update(old, mask, new, bitmask=-1):
     return old
 
 
+def byte_enable_spans(length, first_be, last_be):
+    # contiguous (start, end) byte offsets enabled by a TLP's first and last BE
+    be = first_be & 0xf
+    if length > 2:
+        be |= ((1 << (length-2)*4)-1) << 4
+    if length > 1:
+        be |= (last_be & 0xf) << (length-1)*4
+
+    return byte_enable_runs(be)
+
+
 def highlight(s):
     return "\033[32m%s\033[0m" % s
 
 
+class RegionIndex(object):
+    """Address sorted view of a region list, with last hit cache"""
+    def __init__(self, regions):
+        self.regions = regions
+        self.sorted_regions = []
+        self.bases = []
+        self.last = None
+
+    def find(self, addr):
+        region = self.last
+        if region is not None and region[0] <= addr < region[0]+region[1]:
+            return region
+
+        if len(self.sorted_regions) != len(self.regions):
+            # regions added
+            self.sorted_regions = sorted(self.regions, key=lambda x: x[0])
+            self.bases = [r[0] for r in self.sorted_regions]
+
+        i = bisect_right(self.bases, addr)-1
+        if i >= 0:
+            region = self.sorted_regions[i]
+            if addr < region[0]+region[1]:
+                self.last = region
+                return region
+        return None
+
+
 class PcieId(object):
     def __init__(self, bus=0, device=0, function=0):
         self.bus = 0
@@ -411,27 +545,27 @@ class TLP(object):
         ret = True
         if self.fmt == FMT_3DW_DATA or self.fmt == FMT_4DW_DATA:
             if self.length != len(self.data):
-                print("TLP validation failed, length field does not match data: %s" % repr(self))
+                trace(TRACE_ERROR, None, "TLP validation failed, length field does not match data: %r", self)
                 ret = False
             if 0 > self.length > 1024:
-                print("TLP validation failed, length out of range: %s" % repr(self))
+                trace(TRACE_ERROR, None, "TLP validation failed, length out of range: %r", self)
                 ret = False
         if (self.fmt_type == TLP_MEM_READ or self.fmt_type == TLP_MEM_READ_64 or
                 self.fmt_type == TLP_MEM_READ_LOCKED or self.fmt_type == TLP_MEM_READ_LOCKED_64 or
                 self.fmt_type == TLP_MEM_WRITE or self.fmt_type == TLP_MEM_WRITE_64):
             if self.length*4 > 0x1000 - (self.address & 0xfff):
-                print("TLP validation failed, request crosses 4K boundary: %s" % repr(self))
+                trace(TRACE_ERROR, None, "TLP validation failed, request crosses 4K boundary: %r", self)
                 ret = False
         if (self.fmt_type == TLP_IO_READ or self.fmt_type == TLP_IO_WRITE):
             if self.length != 1:
-                print("TLP validation failed, invalid length for IO request: %s" % repr(self))
+                trace(TRACE_ERROR, None, "TLP validation failed, invalid length for IO request: %r", self)
                 ret = False
             if self.last_be != 0:
-                print("TLP validation failed, invalid last BE for IO request: %s" % repr(self))
+                trace(TRACE_ERROR, None, "TLP validation failed, invalid last BE for IO request: %r", self)
                 ret = False
         if (self.fmt_type == TLP_CPL_DATA):
             if (self.byte_count + (self.lower_address&3) + 3) < self.length*4:
-                print("TLP validation failed, completion byte count too small: %s" % repr(self))
+                trace(TRACE_ERROR, None, "TLP validation failed, completion byte count too small: %r", self)
                 ret = False
         return ret
 
@@ -550,9 +684,21 @@ class TLP(object):
         """Return size of TLP in data credits (1 credit per 4 DW)"""
         return int((len(self.data)+3)/4)
 
+    def get_fc_type(self):
+        """Return flow control credit type of TLP"""
+        if self.fmt_type in (TLP_CPL, TLP_CPL_DATA, TLP_CPL_LOCKED, TLP_CPL_LOCKED_DATA):
+            return FC_TYPE_CPL
+        elif self.fmt_type in (TLP_MEM_WRITE, TLP_MEM_WRITE_64) or self.fmt_type[1] & 0x18 == 0x10:
+            # memory writes and messages
+            return FC_TYPE_P
+        return FC_TYPE_NP
+
     def pack(self):
         """Pack TLP as DWORD array"""
-        pkt = []
+        layout = tlp_header_layout.get(self.fmt_type)
+
+        if layout is None:
+            raise Exception("Unknown TLP type")
 
         l = self.length & 0x3ff
         l |= (self.at & 0x3) << 10
@@ -564,89 +710,60 @@ class TLP(object):
         l |= (self.tc & 0x7) << 20
         l |= (self.type & 0x1f) << 24
         l |= (self.fmt & 0x7) << 29
-        pkt.append(l)
 
-        if (self.fmt_type == TLP_CFG_READ_0 or self.fmt_type == TLP_CFG_WRITE_0 or
-                self.fmt_type == TLP_CFG_READ_1 or self.fmt_type == TLP_CFG_WRITE_1 or
-                self.fmt_type == TLP_MEM_READ or self.fmt_type == TLP_MEM_READ_64 or
-                self.fmt_type == TLP_MEM_READ_LOCKED or self.fmt_type == TLP_MEM_READ_LOCKED_64 or
-                self.fmt_type == TLP_MEM_WRITE or self.fmt_type == TLP_MEM_WRITE_64 or
-                self.fmt_type == TLP_IO_READ or self.fmt_type == TLP_IO_WRITE):
-            l = self.first_be & 0xf
-            l |= (self.last_be & 0xf) << 4
-            l |= (self.tag & 0xff) << 8
-            l |= int(self.requester_id) << 16
-            pkt.append(l)
-
-            if (self.fmt_type == TLP_CFG_READ_0 or self.fmt_type == TLP_CFG_WRITE_0 or
-                    self.fmt_type == TLP_CFG_READ_1 or self.fmt_type == TLP_CFG_WRITE_1):
-                l = (self.register_number & 0x3ff) << 2
-                l |= int(self.dest_id) << 16
-                pkt.append(l)
-            else:
-                l = 0
-                if self.fmt == FMT_4DW or self.fmt == FMT_4DW_DATA:
-                    l |= (self.address >> 32) & 0xffffffff
-                    pkt.append(l)
-                l |= self.address & 0xfffffffc
-                pkt.append(l)
-        elif (self.fmt_type == TLP_CPL or self.fmt_type == TLP_CPL_DATA or
-                self.fmt_type == TLP_CPL_LOCKED or self.fmt_type == TLP_CPL_LOCKED_DATA):
-            l = self.byte_count & 0xfff
-            l |= (self.bcm & 1) << 12
-            l |= (self.status & 0x7) << 13
-            l |= int(self.completer_id) << 16
-            pkt.append(l)
-            l = self.lower_address & 0x7f
-            l |= (self.tag & 0xff) << 8
-            l |= int(self.requester_id) << 16
-            pkt.append(l)
+        if layout == TLP_HDR_CPL:
+            l1 = self.byte_count & 0xfff
+            l1 |= (self.bcm & 1) << 12
+            l1 |= (self.status & 0x7) << 13
+            l1 |= int(self.completer_id) << 16
+            l2 = self.lower_address & 0x7f
+            l2 |= (self.tag & 0xff) << 8
+            l2 |= int(self.requester_id) << 16
+            pkt = [l, l1, l2]
         else:
-            raise Exception("Unknown TLP type")
+            l1 = self.first_be & 0xf
+            l1 |= (self.last_be & 0xf) << 4
+            l1 |= (self.tag & 0xff) << 8
+            l1 |= int(self.requester_id) << 16
+
+            if layout == TLP_HDR_CFG:
+                l2 = (self.register_number & 0x3ff) << 2
+                l2 |= int(self.dest_id) << 16
+                pkt = [l, l1, l2]
+            elif self.fmt & FMT_4DW:
+                pkt = [l, l1, (self.address >> 32) & 0xffffffff, self.address & 0xfffffffc]
+            else:
+                pkt = [l, l1, self.address & 0xfffffffc]
 
-        if self.fmt == FMT_3DW_DATA or self.fmt == FMT_4DW_DATA:
+        if self.fmt & FMT_3DW_DATA:
             pkt.extend(self.data)
 
         return pkt
 
     def unpack(self, pkt):
         """Unpack TLP from DWORD array"""
-        self.length = pkt[0] & 0x3ff
-        self.at = (pkt[0] >> 10) & 0x3
-        self.attr = (pkt[0] >> 12) & 0x3
-        self.ep = (pkt[0] >> 14) & 1
-        self.td = (pkt[0] >> 15) & 1
-        self.th = (pkt[0] >> 16) & 1
-        self.attr |= (pkt[0] >> 16) & 0x4
-        self.tc = (pkt[0] >> 20) & 0x7
-        self.type = (pkt[0] >> 24) & 0x1f
-        self.fmt = (pkt[0] >> 29) & 0x7
+        l = pkt[0]
+        self.length = l & 0x3ff
+        self.at = (l >> 10) & 0x3
+        self.attr = (l >> 12) & 0x3
+        self.ep = (l >> 14) & 1
+        self.td = (l >> 15) & 1
+        self.th = (l >> 16) & 1
+        self.attr |= (l >> 16) & 0x4
+        self.tc = (l >> 20) & 0x7
+        self.type = (l >> 24) & 0x1f
+        self.fmt = (l >> 29) & 0x7
+
+        layout = tlp_header_layout.get((self.fmt, self.type))
+
+        if layout is None:
+            raise Exception("Unknown TLP type")
 
-        if self.fmt == FMT_3DW_DATA or self.fmt == FMT_4DW_DATA:
+        if self.fmt & FMT_3DW_DATA:
             if self.length == 0:
                 self.length = 1024
 
-        if (self.fmt_type == TLP_CFG_READ_0 or self.fmt_type == TLP_CFG_WRITE_0 or
-                self.fmt_type == TLP_CFG_READ_1 or self.fmt_type == TLP_CFG_WRITE_1 or
-                self.fmt_type == TLP_MEM_READ or self.fmt_type == TLP_MEM_READ_64 or
-                self.fmt_type == TLP_MEM_READ_LOCKED or self.fmt_type == TLP_MEM_READ_LOCKED_64 or
-                self.fmt_type == TLP_MEM_WRITE or self.fmt_type == TLP_MEM_WRITE_64 or
-                self.fmt_type == TLP_IO_READ or self.fmt_type == TLP_IO_WRITE):
-            self.first_be = pkt[1] & 0xf
-            self.last_be = (pkt[1] >> 4) & 0xf
-            self.tag = (pkt[1] >> 8) & 0xff
-            self.requester_id = PcieId.from_int(pkt[1] >> 16)
-
-            if (self.fmt_type == TLP_CFG_READ_0 or self.fmt_type == TLP_CFG_WRITE_0 or
-                    self.fmt_type == TLP_CFG_READ_1 or self.fmt_type == TLP_CFG_WRITE_1):
-                self.register_number = (pkt[2] >> 2) >> 0x3ff
-                self.dest_id = PcieId.from_int(pkt[2] >> 16)
-            elif self.fmt == FMT_3DW or self.fmt == FMT_3DW_DATA:
-                self.address = pkt[3] & 0xfffffffc
-            elif self.fmt == FMT_4DW or self.fmt == FMT_4DW_DATA:
-                self.address = (pkt[4] & 0xffffffff) << 32 | pkt[4] & 0xfffffffc
-        elif (self.fmt_type == TLP_CPL or self.fmt_type == TLP_CPL_DATA or
-                self.fmt_type == TLP_CPL_LOCKED or self.fmt_type == TLP_CPL_LOCKED_DATA):
+        if layout == TLP_HDR_CPL:
             self.byte_count = pkt[1] & 0xfff
             self.bcm = (pkt[1] >> 12) & 1
             self.status = (pkt[1] >> 13) & 0x7
@@ -658,7 +775,18 @@ class TLP(object):
             if self.byte_count == 0:
                 self.byte_count = 4096
         else:
-            raise Exception("Unknown TLP type")
+            self.first_be = pkt[1] & 0xf
+            self.last_be = (pkt[1] >> 4) & 0xf
+            self.tag = (pkt[1] >> 8) & 0xff
+            self.requester_id = PcieId.from_int(pkt[1] >> 16)
+
+            if layout == TLP_HDR_CFG:
+                self.register_number = (pkt[2] >> 2) & 0x3ff
+                self.dest_id = PcieId.from_int(pkt[2] >> 16)
+            elif self.fmt & FMT_4DW:
+                self.address = (pkt[2] & 0xffffffff) << 32 | pkt[3] & 0xfffffffc
+            else:
+                self.address = pkt[2] & 0xfffffffc
 
         if self.fmt == FMT_3DW_DATA:
             self.data = pkt[3:]
@@ -667,6 +795,16 @@ class TLP(object):
 
         return self
 
+    @staticmethod
+    def pack_many(tlps):
+        """Pack TLPs as a list of DWORD arrays"""
+        return [tlp.pack() for tlp in tlps]
+
+    @classmethod
+    def unpack_many(cls, pkts):
+        """Unpack TLPs from a list of DWORD arrays"""
+        return [cls().unpack(pkt) for pkt in pkts]
+
     def __eq__(self, other):
         if isinstance(other, TLP):
             return (
@@ -728,7 +866,7 @@ class Port(object):
         self.other = None
         self.rx_handler = rx_handler
 
-        self.tx_queue = []
+        self.tx_queue = deque()
         self.tx_scheduled = False
 
         self.max_speed = 3
@@ -739,6 +877,22 @@ class Port(object):
         self.cur_width = 1
         self.link_delay = 0
 
+        # flow control credits advertised by this port's receiver
+        # (None for infinite credits)
+        self.fc_ph = None
+        self.fc_pd = None
+        self.fc_nph = None
+        self.fc_npd = None
+        self.fc_cplh = None
+        self.fc_cpld = None
+        # delay from TLP delivery to credit return (ns)
+        self.fc_update_latency = 0
+
+        # transmit credits consumed, indexed by FC type
+        self.fc_hdr_consumed = [0]*3
+        self.fc_data_consumed = [0]*3
+        self.fc_stall_count = 0
+
     def connect(self, port):
         if isinstance(port, Port):
             self._connect(port)
@@ -766,18 +920,75 @@ class Port(object):
             yield self.transmit(), None
             self.tx_scheduled = True
 
+    def set_fc_limits(self, ph=None, pd=None, nph=None, npd=None, cplh=None, cpld=None, update_latency=0):
+        self.fc_ph = ph
+        self.fc_pd = pd
+        self.fc_nph = nph
+        self.fc_npd = npd
+        self.fc_cplh = cplh
+        self.fc_cpld = cpld
+        self.fc_update_latency = update_latency
+
     def transmit(self):
         if self.tx_queue:
+            fc = self._fc_consume(self.tx_queue[0])
+            if fc is False:
+                # out of credits, restarted when credits are returned
+                self.fc_stall_count += 1
+                self.tx_scheduled = False
+                return
+
             # schedule transmit
-            tlp = self.tx_queue.pop(0)
+            tlp = self.tx_queue.popleft()
             d = tlp.get_wire_size()*8/(PCIE_GEN_RATE[self.cur_speed]*self.cur_width)
             yield delay(int(d))
             yield self.transmit(), None
             yield delay(int(self.link_delay))
             yield self._transmit(tlp)
+
+            if fc is not None:
+                # return credits
+                if self.other.fc_update_latency:
+                    yield delay(int(self.other.fc_update_latency))
+                self.fc_hdr_consumed[fc[0]] -= 1
+                self.fc_data_consumed[fc[0]] -= fc[1]
+
+                if self.tx_queue and not self.tx_scheduled:
+                    self.tx_scheduled = True
+                    yield self.transmit(), None
         else:
             self.tx_scheduled = False
 
+    def _fc_consume(self, tlp):
+        # returns None when credits are not limited, False when credits are not available
+        if self.other is None:
+            return None
+
+        fc_type = tlp.get_fc_type()
+        if fc_type == FC_TYPE_P:
+            hdr_limit, data_limit = self.other.fc_ph, self.other.fc_pd
+        elif fc_type == FC_TYPE_NP:
+            hdr_limit, data_limit = self.other.fc_nph, self.other.fc_npd
+        else:
+            hdr_limit, data_limit = self.other.fc_cplh, self.other.fc_cpld
+
+        if hdr_limit is None and data_limit is None:
+            return None
+
+        data = tlp.get_data_credits()
+
+        if data_limit is not None and data > data_limit:
+            raise Exception("TLP exceeds data credit limit")
+
+        if hdr_limit is not None and self.fc_hdr_consumed[fc_type] >= hdr_limit:
+            return False
+        if data_limit is not None and self.fc_data_consumed[fc_type]+data > data_limit:
+            return False
+
+        self.fc_hdr_consumed[fc_type] += 1
+        self.fc_data_consumed[fc_type] += data
+        return fc_type, data
+
     def _transmit(self, tlp):
         if self.other is None:
             raise Exception("Port not connected")
@@ -810,6 +1021,10 @@ class BusPort(Port):
         self.cur_width = min(self.max_width, port.max_width)
         self.link_delay = self.port_delay + port.port_delay
 
+    def _fc_consume(self, tlp):
+        # no credit tracking on shared bus
+        return None
+
     def _transmit(self, tlp):
         if not self.other:
             raise Exception("Port not connected")
@@ -1463,10 +1678,10 @@ class MSICapability(object):
 
     def issue_msi_interrupt(self, number=0, attr=0, tc=0):
         if not self.msi_enable:
-            print("MSI disabled")
+            trace(TRACE_ERROR, None, "MSI disabled")
             return
         if number < 0 or number >= 2**self.msi_multiple_message_enable or number >= 2**self.msi_multiple_message_capable:
-            print("MSI message number out of range")
+            trace(TRACE_ERROR, None, "MSI message number out of range")
             return
 
         data = self.msi_message_data & ~(2**self.msi_multiple_message_enable-1) | number
@@ -1526,7 +1741,7 @@ class MSIXCapability(object):
 
     def issue_msix_interrupt(self, addr, data, attr=0, tc=0):
         if not self.msix_enable:
-            print("MSI-X disabled")
+            trace(TRACE_ERROR, None, "MSI-X disabled")
             return
 
         yield from self.mem_write(addr, struct.pack('<L', data), attr=attr, tc=tc)
@@ -1771,7 +1986,7 @@ class Function(PMCapability, PCIECapability):
 
     def upstream_send(self, tlp):
         # logging
-        print("[%s] Sending upstream TLP: %s" % (highlight(self.get_desc()), repr(tlp)))
+        trace(TRACE_TLP, self, "Sending upstream TLP: %r", tlp)
         assert tlp.check()
         if self.upstream_tx_handler is None:
             raise Exception("Transmit handler not set")
@@ -1782,7 +1997,7 @@ class Function(PMCapability, PCIECapability):
 
     def upstream_recv(self, tlp):
         # logging
-        print("[%s] Got downstream TLP: %s" % (highlight(self.get_desc()), repr(tlp)))
+        trace(TRACE_TLP, self, "Got downstream TLP: %r", tlp)
         assert tlp.check()
         yield from self.handle_tlp(tlp)
 
@@ -1826,7 +2041,7 @@ class Function(PMCapability, PCIECapability):
     def handle_config_0_tlp(self, tlp):
         if tlp.dest_id.device == self.device_num and tlp.dest_id.function == self.function_num:
             # logging
-            print("[%s] Config type 0 for me" % (highlight(self.get_desc())))
+            trace(TRACE_TLP, self, "Config type 0 for me")
 
             # capture address information
             self.bus_num = tlp.dest_id.bus
@@ -1845,7 +2060,7 @@ class Function(PMCapability, PCIECapability):
                 self.write_config_register(tlp.register_number, tlp.data[0], tlp.first_be)
 
             # logging
-            print("[%s] Completion: %s" % (highlight(self.get_desc()), repr(cpl)))
+            trace(TRACE_TLP, self, "Completion: %r", cpl)
             yield from self.upstream_send(cpl)
         else:
             # error
@@ -1856,7 +2071,7 @@ class Function(PMCapability, PCIECapability):
         data = b''
 
         if not self.bus_master_enable:
-            print("Bus mastering not enabled")
+            trace(TRACE_ERROR, None, "Bus mastering not enabled")
             return None
 
         while n < length:
@@ -1923,7 +2138,7 @@ class Function(PMCapability, PCIECapability):
         n = 0
 
         if not self.bus_master_enable:
-            print("Bus mastering not enabled")
+            trace(TRACE_ERROR, None, "Bus mastering not enabled")
             return
 
         while n < len(data):
@@ -1978,7 +2193,7 @@ class Function(PMCapability, PCIECapability):
         data = b''
 
         if not self.bus_master_enable:
-            print("Bus mastering not enabled")
+            trace(TRACE_ERROR, None, "Bus mastering not enabled")
             return None
 
         while n < length:
@@ -2064,7 +2279,7 @@ class Function(PMCapability, PCIECapability):
         n = 0
 
         if not self.bus_master_enable:
-            print("Bus mastering not enabled")
+            trace(TRACE_ERROR, None, "Bus mastering not enabled")
             return
 
         while n < len(data):
@@ -2259,7 +2474,7 @@ class MemoryEndpoint(Endpoint):
         m = self.match_bar(tlp.address, True)
         if len(m) == 1:
             # logging
-            print("[%s] IO read" % (highlight(self.get_desc())))
+            trace(TRACE_TLP, self, "IO read")
 
             assert tlp.length == 1
 
@@ -2295,25 +2510,25 @@ class MemoryEndpoint(Endpoint):
             cpl.length = 1
 
             # logging
-            print("[%s] Completion: %s" % (highlight(self.get_desc()), repr(cpl)))
+            trace(TRACE_TLP, self, "Completion: %r", cpl)
             yield from self.send(cpl)
 
         else:
             # logging
-            print("IO request did not match any BARs")
+            trace(TRACE_ERROR, None, "IO request did not match any BARs")
 
             # Unsupported request
             cpl = TLP()
             cpl.set_ur_completion(tlp, self.get_id())
             # logging
-            print("[%s] UR Completion: %s" % (highlight(self.get_desc()), repr(cpl)))
+            trace(TRACE_TLP, self, "UR Completion: %r", cpl)
             yield from self.send(cpl)
 
     def handle_io_write_tlp(self, tlp):
         m = self.match_bar(tlp.address, True)
         if len(m) == 1:
             # logging
-            print("[%s] IO write" % (highlight(self.get_desc())))
+            trace(TRACE_TLP, self, "IO write")
 
             assert tlp.length == 1
 
@@ -2347,24 +2562,24 @@ class MemoryEndpoint(Endpoint):
             cpl.byte_count = 4
 
             # logging
-            print("[%s] Completion: %s" % (highlight(self.get_desc()), repr(cpl)))
+            trace(TRACE_TLP, self, "Completion: %r", cpl)
             yield from self.send(cpl)
 
         else:
             # logging
-            print("IO request did not match any BARs")
+            trace(TRACE_ERROR, None, "IO request did not match any BARs")
 
             # Unsupported request
             cpl = TLP()
             cpl.set_ur_completion(tlp, self.get_id())
             # logging
-            print("[%s] UR Completion: %s" % (highlight(self.get_desc()), repr(cpl)))
+            trace(TRACE_TLP, self, "UR Completion: %r", cpl)
             yield from self.send(cpl)
 
     def handle_mem_read_tlp(self, tlp):
         m = self.match_bar(tlp.address)
         if len(m) == 1:
-            print("[%s] Memory read" % (highlight(self.get_desc())))
+            trace(TRACE_TLP, self, "Memory read")
 
             # perform operation
             region = m[0][0]
@@ -2372,7 +2587,7 @@ class MemoryEndpoint(Endpoint):
 
             # check for 4k boundary crossing
             if tlp.length*4 > 0x1000 - (addr & 0xfff):
-                print("Request crossed 4k boundary, discarding request")
+                trace(TRACE_ERROR, None, "Request crossed 4k boundary, discarding request")
                 return
 
             # perform read
@@ -2401,7 +2616,7 @@ class MemoryEndpoint(Endpoint):
                 cpl.set_data(data[m*4:(m+cpl_dw_length)*4])
 
                 # logging
-                print("[%s] Completion: %s" % (highlight(self.get_desc()), repr(cpl)))
+                trace(TRACE_TLP, self, "Completion: %r", cpl)
                 yield from self.send(cpl)
 
                 m += cpl_dw_length;
@@ -2410,20 +2625,20 @@ class MemoryEndpoint(Endpoint):
 
         else:
             # logging
-            print("Memory request did not match any BARs")
+            trace(TRACE_ERROR, None, "Memory request did not match any BARs")
 
             # Unsupported request
             cpl = TLP()
             cpl.set_ur_completion(tlp, self.get_id())
             # logging
-            print("[%s] UR Completion: %s" % (highlight(self.get_desc()), repr(cpl)))
+            trace(TRACE_TLP, self, "UR Completion: %r", cpl)
             yield from self.send(cpl)
 
     def handle_mem_write_tlp(self, tlp):
         m = self.match_bar(tlp.address)
         if len(m) == 1:
             # logging
-            print("[%s] Memory write" % (highlight(self.get_desc())))
+            trace(TRACE_TLP, self, "Memory write")
 
             # perform operation
             region = m[0][0]
@@ -2434,7 +2649,7 @@ class MemoryEndpoint(Endpoint):
 
             # check for 4k boundary crossing
             if tlp.length*4 > 0x1000 - (addr & 0xfff):
-                print("Request crossed 4k boundary, discarding request")
+                trace(TRACE_ERROR, None, "Request crossed 4k boundary, discarding request")
                 return
 
             # perform write
@@ -2480,7 +2695,7 @@ class MemoryEndpoint(Endpoint):
 
         else:
             # logging
-            print("Memory request did not match any BARs")
+            trace(TRACE_ERROR, None, "Memory request did not match any BARs")
 
 
 class Bridge(Function):
@@ -2616,7 +2831,7 @@ class Bridge(Function):
     def upstream_recv(self, tlp):
         # logging
         if trace_routing:
-            print("[%s] Routing downstream TLP: %s" % (highlight(self.get_desc()), repr(tlp)))
+            trace(TRACE_TLP, self, "Routing downstream TLP: %r", tlp)
         assert tlp.check()
         if tlp.fmt_type == TLP_CFG_READ_0 or tlp.fmt_type == TLP_CFG_WRITE_0:
             yield from self.handle_tlp(tlp)
@@ -2706,7 +2921,7 @@ class Bridge(Function):
     def downstream_recv(self, tlp):
         # logging
         if trace_routing:
-            print("[%s] Routing upstream TLP: %s" % (highlight(self.get_desc()), repr(tlp)))
+            trace(TRACE_TLP, self, "Routing upstream TLP: %r", tlp)
         assert tlp.check()
         if (tlp.fmt_type == TLP_CFG_READ_0 or tlp.fmt_type == TLP_CFG_WRITE_0 or
                 tlp.fmt_type == TLP_CFG_READ_1 or tlp.fmt_type == TLP_CFG_WRITE_1):
@@ -2868,7 +3083,7 @@ class SwitchUpstreamPort(Bridge):
             cpl = TLP()
             cpl.set_ur_completion(tlp, (self.bus_num, self.device_num, 0))
             # logging
-            print("[%s] UR Completion: %s" % (highlight(self.get_desc()), repr(cpl)))
+            trace(TRACE_TLP, self, "UR Completion: %r", cpl)
             if from_downstream:
                 yield from self.route_downstream_tlp(cpl, False)
             else:
@@ -2932,6 +3147,11 @@ class Device(object):
         self.functions = []
         self.upstream_port = Port(self, self.upstream_recv)
 
+        # routing tables, rebuilt after config space accesses
+        self.mem_bar_index = None
+        self.io_bar_index = None
+        self.function_route = None
+
         if eps:
             try:
                 for ep in eps:
@@ -2960,6 +3180,7 @@ class Device(object):
         function.upstream_tx_handler = self.upstream_send
         self.functions.append(function)
         self.functions.sort(key=lambda x: x.function_num)
+        self.function_route = None
         if len(self.functions) > 1:
             for f in self.functions:
                 f.header_type |= 0x80
@@ -2975,9 +3196,36 @@ class Device(object):
     def connect(self, port):
         self.upstream_port.connect(port)
 
+    def update_routing(self):
+        self.mem_bar_index = BarIndex(self.functions)
+        self.io_bar_index = BarIndex(self.functions, io=True)
+        self.function_route = {f.function_num: f for f in self.functions}
+
+    def match_bar(self, addr, io=False):
+        if self.function_route is None:
+            self.update_routing()
+
+        index = self.io_bar_index if io else self.mem_bar_index
+
+        if index.valid:
+            m = index.match(addr)
+            if m is not None:
+                return m[0]
+
+        # fall back on linear search (overlapping BARs, or BARs changed
+        # without a config write)
+        for f in self.functions:
+            if f.match_bar(addr, io):
+                if index.valid:
+                    # index is stale
+                    self.function_route = None
+                return f
+
+        return None
+
     def upstream_recv(self, tlp):
         # logging
-        print("[%s] Got downstream TLP: %s" % (highlight(self.get_desc()), repr(tlp)))
+        trace(TRACE_TLP, self, "Got downstream TLP: %r", tlp)
         assert tlp.check()
         if tlp.fmt_type == TLP_CFG_READ_0 or tlp.fmt_type == TLP_CFG_WRITE_0:
             # config type 0
@@ -2989,76 +3237,83 @@ class Device(object):
                 for f in self.functions:
                     f.bus_num = self.bus_num
 
+                # BARs may change
+                self.function_route = None
+
                 # pass TLP to function
                 for f in self.functions:
                     if f.function_num == tlp.dest_id.function:
                         yield from f.upstream_recv(tlp)
+                        self.function_route = None
                         return
 
                 #raise Exception("Function not found")
-                print("Function not found")
+                trace(TRACE_ERROR, None, "Function not found")
             else:
-                print("Device number mismatch")
+                trace(TRACE_ERROR, None, "Device number mismatch")
             
             # Unsupported request
             cpl = TLP()
             cpl.set_ur_completion(tlp, (self.bus_num, self.device_num, 0))
             # logging
-            print("[%s] UR Completion: %s" % (highlight(self.get_desc()), repr(cpl)))
+            trace(TRACE_TLP, self, "UR Completion: %r", cpl)
             yield from self.upstream_send(cpl)
         elif (tlp.fmt_type == TLP_CPL or tlp.fmt_type == TLP_CPL_DATA or
                 tlp.fmt_type == TLP_CPL_LOCKED or tlp.fmt_type == TLP_CPL_LOCKED_DATA):
             # Completion
 
             if tlp.requester_id.bus == self.bus_num and tlp.requester_id.device == self.device_num:
-                for f in self.functions:
-                    if f.function_num == tlp.requester_id.function:
-                        yield from f.upstream_recv(tlp)
-                        return
+                if self.function_route is None:
+                    self.update_routing()
 
-                print("Function not found")
+                f = self.function_route.get(tlp.requester_id.function)
+                if f is not None:
+                    yield from f.upstream_recv(tlp)
+                    return
+
+                trace(TRACE_ERROR, None, "Function not found")
             else:
-                print("Bus/device number mismatch")
+                trace(TRACE_ERROR, None, "Bus/device number mismatch")
         elif (tlp.fmt_type == TLP_IO_READ or tlp.fmt_type == TLP_IO_WRITE):
             # IO read/write
 
-            for f in self.functions:
-                if f.match_bar(tlp.address, True):
-                    yield from f.upstream_recv(tlp)
-                    return
+            f = self.match_bar(tlp.address, True)
+            if f is not None:
+                yield from f.upstream_recv(tlp)
+                return
 
-            print("IO request did not match any BARs")
+            trace(TRACE_ERROR, None, "IO request did not match any BARs")
 
             # Unsupported request
             cpl = TLP()
             cpl.set_ur_completion(tlp, (self.bus_num, self.device_num, 0))
             # logging
-            print("[%s] UR Completion: %s" % (highlight(self.get_desc()), repr(cpl)))
+            trace(TRACE_TLP, self, "UR Completion: %r", cpl)
             yield from self.upstream_send(cpl)
         elif (tlp.fmt_type == TLP_MEM_READ or tlp.fmt_type == TLP_MEM_READ_64 or
                 tlp.fmt_type == TLP_MEM_WRITE or tlp.fmt_type == TLP_MEM_WRITE_64):
             # Memory read/write
 
-            for f in self.functions:
-                if f.match_bar(tlp.address):
-                    yield from f.upstream_recv(tlp)
-                    return
+            f = self.match_bar(tlp.address)
+            if f is not None:
+                yield from f.upstream_recv(tlp)
+                return
 
-            print("Memory request did not match any BARs")
+            trace(TRACE_ERROR, None, "Memory request did not match any BARs")
 
             if tlp.fmt_type == TLP_MEM_READ or tlp.fmt_type == TLP_MEM_READ_64:
                 # Unsupported request
                 cpl = TLP()
                 cpl.set_ur_completion(tlp, (self.bus_num, self.device_num, 0))
                 # logging
-                print("[%s] UR Completion: %s" % (highlight(self.get_desc()), repr(cpl)))
+                trace(TRACE_TLP, self, "UR Completion: %r", cpl)
                 yield from self.upstream_send(cpl)
         else:
             raise Exception("TODO")
 
     def upstream_send(self, tlp):
         # logging
-        print("[%s] Sending upstream TLP: %s" % (highlight(self.get_desc()), repr(tlp)))
+        trace(TRACE_TLP, self, "Sending upstream TLP: %r", tlp)
         assert tlp.check()
         yield from self.upstream_port.send(tlp)
 
@@ -3220,7 +3475,8 @@ class RootComplex(Switch):
 
         self.min_dev = 1
 
-        self.current_tag = 0
+        self.tag_pool = TagPool(256)
+        self.tag_release = Signal(False)
 
         self.downstream_tag_recv_queues = {}
 
@@ -3263,6 +3519,9 @@ class RootComplex(Switch):
         self.regions = []
         self.io_regions = []
 
+        self.region_index = RegionIndex(self.regions)
+        self.io_region_index = RegionIndex(self.io_regions)
+
         self.msi_addr = None
         self.msi_msg_limit = 0
         self.msi_signals = {}
@@ -3308,16 +3567,10 @@ class RootComplex(Switch):
         return addr, mem
 
     def find_region(self, addr):
-        for region in self.regions:
-            if region[0] <= addr < region[0]+region[1]:
-                return region
-        return None
+        return self.region_index.find(addr)
 
     def find_io_region(self, addr):
-        for region in self.io_regions:
-            if region[0] <= addr < region[0]+region[1]:
-                return region
-        return None
+        return self.io_region_index.find(addr)
 
     def read_region(self, addr, length):
         region = self.find_region(addr)
@@ -3345,6 +3598,22 @@ class RootComplex(Switch):
             else:
                 region[3](offset, data)
 
+    def write_region_be(self, addr, data, first_be, last_be):
+        # write byte enable masked TLP payload, resolving the region once
+        spans = byte_enable_spans(len(data)//4, first_be, last_be)
+        if not spans:
+            return
+
+        region = self.find_region(addr)
+        if region and len(region) == 3 and addr+spans[-1][1] <= region[0]+region[1]:
+            mem = region[2]
+            offset = addr - region[0]
+            for start, end in spans:
+                mem[offset+start:offset+end] = data[start:end]
+        else:
+            for start, end in spans:
+                yield from self.write_region(addr+start, data[start:end])
+
     def read_io_region(self, addr, length):
         region = self.find_io_region(addr)
         if not region:
@@ -3373,7 +3642,7 @@ class RootComplex(Switch):
 
     def downstream_send(self, tlp):
         # logging
-        print("[%s] Sending TLP: %s" % (highlight(self.get_desc()), repr(tlp)))
+        trace(TRACE_TLP, self, "Sending TLP: %r", tlp)
         assert tlp.check()
         yield from self.upstream_bridge.upstream_recv(tlp)
 
@@ -3382,7 +3651,7 @@ class RootComplex(Switch):
 
     def downstream_recv(self, tlp):
         # logging
-        print("[%s] Got TLP: %s" % (highlight(self.get_desc()), repr(tlp)))
+        trace(TRACE_TLP, self, "Got TLP: %r", tlp)
         assert tlp.check()
         yield from self.handle_tlp(tlp)
 
@@ -3413,20 +3682,30 @@ class RootComplex(Switch):
 
         return None
 
-    def get_free_tag(self):
-        tag_count = 32
+    def alloc_tag(self):
+        tag = self.tag_pool.alloc()
 
-        for k in range(tag_count):
-            self.current_tag = (self.current_tag + 1) % tag_count
-            if not self.rx_cpl_queues[self.current_tag]:
-                return self.current_tag
+        if tag is None:
+            # out of tags
+            self.tag_pool.stall_count += 1
 
-        return None
+            while tag is None:
+                yield self.tag_release
+                tag = self.tag_pool.alloc()
+
+        # drop late completions left over from a previous owner that timed out
+        del self.rx_cpl_queues[tag][:]
+
+        return tag
+
+    def release_tag(self, tag):
+        self.tag_pool.release(tag)
+        self.tag_release.next = not self.tag_release
 
     def handle_io_read_tlp(self, tlp):
         if self.find_io_region(tlp.address):
             # logging
-            print("[%s] IO read" % (highlight(self.get_desc())))
+            trace(TRACE_TLP, self, "IO read")
 
             assert tlp.length == 1
 
@@ -3461,24 +3740,24 @@ class RootComplex(Switch):
             cpl.length = 1
 
             # logging
-            print("[%s] Completion: %s" % (highlight(self.get_desc()), repr(cpl)))
+            trace(TRACE_TLP, self, "Completion: %r", cpl)
             yield from self.send(cpl)
 
         else:
             # logging
-            print("IO request did not match any regions")
+            trace(TRACE_ERROR, None, "IO request did not match any regions")
 
             # Unsupported request
             cpl = TLP()
             cpl.set_ur_completion(tlp, PcieId(0, 0, 0))
             # logging
-            print("[%s] UR Completion: %s" % (highlight(self.get_desc()), repr(cpl)))
+            trace(TRACE_TLP, self, "UR Completion: %r", cpl)
             yield from self.send(cpl)
 
     def handle_io_write_tlp(self, tlp):
         if self.find_io_region(tlp.address):
             # logging
-            print("[%s] IO write" % (highlight(self.get_desc())))
+            trace(TRACE_TLP, self, "IO write")
 
             assert tlp.length == 1
 
@@ -3511,24 +3790,24 @@ class RootComplex(Switch):
             cpl.byte_count = 4
 
             # logging
-            print("[%s] Completion: %s" % (highlight(self.get_desc()), repr(cpl)))
+            trace(TRACE_TLP, self, "Completion: %r", cpl)
             yield from self.send(cpl)
 
         else:
             # logging
-            print("IO request did not match any regions")
+            trace(TRACE_ERROR, None, "IO request did not match any regions")
 
             # Unsupported request
             cpl = TLP()
             cpl.set_ur_completion(tlp, PcieId(0, 0, 0))
             # logging
-            print("[%s] UR Completion: %s" % (highlight(self.get_desc()), repr(cpl)))
+            trace(TRACE_TLP, self, "UR Completion: %r", cpl)
             yield from self.send(cpl)
 
     def handle_mem_read_tlp(self, tlp):
         if self.find_region(tlp.address):
             # logging
-            print("[%s] Memory read" % (highlight(self.get_desc())))
+            trace(TRACE_TLP, self, "Memory read")
 
             # perform operation
             addr = tlp.address
@@ -3536,7 +3815,7 @@ class RootComplex(Switch):
 
             # check for 4k boundary crossing
             if tlp.length*4 > 0x1000 - (addr & 0xfff):
-                print("Request crossed 4k boundary, discarding request")
+                trace(TRACE_ERROR, None, "Request crossed 4k boundary, discarding request")
                 return
 
             # perform read
@@ -3565,7 +3844,7 @@ class RootComplex(Switch):
                 cpl.set_data(data[m*4:(m+cpl_dw_length)*4])
 
                 # logging
-                print("[%s] Completion: %s" % (highlight(self.get_desc()), repr(cpl)))
+                trace(TRACE_TLP, self, "Completion: %r", cpl)
                 yield from self.send(cpl)
 
                 m += cpl_dw_length;
@@ -3574,75 +3853,36 @@ class RootComplex(Switch):
 
         else:
             # logging
-            print("Memory request did not match any regions")
+            trace(TRACE_ERROR, None, "Memory request did not match any regions")
 
             # Unsupported request
             cpl = TLP()
             cpl.set_ur_completion(tlp, PcieId(0, 0, 0))
             # logging
-            print("[%s] UR Completion: %s" % (highlight(self.get_desc()), repr(cpl)))
+            trace(TRACE_TLP, self, "UR Completion: %r", cpl)
             yield from self.send(cpl)
 
     def handle_mem_write_tlp(self, tlp):
         if self.find_region(tlp.address):
             # logging
-            print("[%s] Memory write" % (highlight(self.get_desc())))
+            trace(TRACE_TLP, self, "Memory write")
 
             # perform operation
             addr = tlp.address
-            offset = 0
-            start_offset = None
-            mask = tlp.first_be
 
             # check for 4k boundary crossing
             if tlp.length*4 > 0x1000 - (addr & 0xfff):
-                print("Request crossed 4k boundary, discarding request")
+                trace(TRACE_ERROR, None, "Request crossed 4k boundary, discarding request")
                 return
 
             # perform write
-            data = tlp.get_data()
-
-            # first dword
-            for k in range(4):
-                if mask & (1 << k):
-                    if start_offset is None:
-                        start_offset = offset
-                else:
-                    if start_offset is not None and offset != start_offset:
-                        yield from self.write_region(addr+start_offset, data[start_offset:offset])
-                    start_offset = None
-
-                offset += 1
-
-            if tlp.length > 2:
-                # middle dwords
-                if start_offset is None:
-                    start_offset = offset
-                offset += (tlp.length-2)*4
-
-            if tlp.length > 1:
-                # last dword
-                mask = tlp.last_be
-
-                for k in range(4):
-                    if mask & (1 << k):
-                        if start_offset is None:
-                            start_offset = offset
-                    else:
-                        if start_offset is not None and offset != start_offset:
-                            yield from self.write_region(addr+start_offset, data[start_offset:offset])
-                        start_offset = None
-
-                    offset += 1
-
-            if start_offset is not None and offset != start_offset:
-                yield from self.write_region(addr+start_offset, data[start_offset:offset])
+            yield from self.write_region_be(addr, tlp.get_data(), tlp.first_be, tlp.last_be)
 
             # memory writes are posted, so don't send a completion
 
         else:
             # logging
-            print("Memory request did not match any regions")
+            trace(TRACE_ERROR, None, "Memory request did not match any regions")
 
     def config_read(self, dev, addr, length, timeout=0):
         n = 0
@@ -3652,7 +3892,7 @@ class RootComplex(Switch):
             tlp = TLP()
             tlp.fmt_type = TLP_CFG_READ_1
             tlp.requester_id = PcieId(0, 0, 0)
-            tlp.tag = self.get_free_tag()
+            tlp.tag = yield from self.alloc_tag()
             tlp.dest_id = dev
 
             first_pad = addr % 4
@@ -3664,6 +3904,8 @@ class RootComplex(Switch):
             yield from self.send(tlp)
             cpl = yield from self.recv_cpl(tlp.tag, timeout)
 
+            self.release_tag(tlp.tag)
+
             if not cpl or cpl.status != CPL_STATUS_SC:
                 d = b'\xff\xff\xff\xff'
             else:
@@ -3716,7 +3958,7 @@ class RootComplex(Switch):
             tlp = TLP()
             tlp.fmt_type = TLP_CFG_WRITE_1
             tlp.requester_id = PcieId(0, 0, 0)
-            tlp.tag = self.get_free_tag()
+            tlp.tag = yield from self.alloc_tag()
             tlp.dest_id = dev
 
             first_pad = addr % 4
@@ -3728,6 +3970,8 @@ class RootComplex(Switch):
             yield from self.send(tlp)
             cpl = yield from self.recv_cpl(tlp.tag, timeout)
 
+            self.release_tag(tlp.tag)
+
             n += byte_length
             addr += byte_length
 
@@ -3854,7 +4098,7 @@ class RootComplex(Switch):
             tlp = TLP()
             tlp.fmt_type = TLP_IO_READ
             tlp.requester_id = PcieId(0, 0, 0)
-            tlp.tag = self.get_free_tag()
+            tlp.tag = yield from self.alloc_tag()
 
             first_pad = addr % 4
             byte_length = min(length-n, 4-first_pad)
@@ -3863,6 +4107,8 @@ class RootComplex(Switch):
             yield from self.send(tlp)
             cpl = yield from self.recv_cpl(tlp.tag, timeout)
 
+            self.release_tag(tlp.tag)
+
             if not cpl:
                 raise Exception("Timeout")
             if cpl.status != CPL_STATUS_SC:
@@ -3921,7 +4167,7 @@ class RootComplex(Switch):
             tlp = TLP()
             tlp.fmt_type = TLP_IO_WRITE
             tlp.requester_id = PcieId(0, 0, 0)
-            tlp.tag = self.get_free_tag()
+            tlp.tag = yield from self.alloc_tag()
 
             first_pad = addr % 4
             byte_length = min(len(data)-n, 4-first_pad)
@@ -3930,6 +4176,8 @@ class RootComplex(Switch):
             yield from self.send(tlp)
             cpl = yield from self.recv_cpl(tlp.tag, timeout)
 
+            self.release_tag(tlp.tag)
+
             if not cpl:
                 raise Exception("Timeout")
             if cpl.status != CPL_STATUS_SC:
@@ -3979,7 +4227,7 @@ class RootComplex(Switch):
             else:
                 tlp.fmt_type = TLP_MEM_READ
             tlp.requester_id = PcieId(0, 0, 0)
-            tlp.tag = self.get_free_tag()
+            tlp.tag = yield from self.alloc_tag()
             tlp.attr = attr
             tlp.tc = tc
 
@@ -3997,8 +4245,10 @@ class RootComplex(Switch):
                 cpl = yield from self.recv_cpl(tlp.tag, timeout)
 
                 if not cpl:
+                    self.release_tag(tlp.tag)
                     raise Exception("Timeout")
                 if cpl.status != CPL_STATUS_SC:
+                    self.release_tag(tlp.tag)
                     raise Exception("Unsuccessful completion")
                 else:
                     assert cpl.byte_count+3+(cpl.lower_address&3) >= cpl.length*4
@@ -4014,6 +4264,8 @@ class RootComplex(Switch):
 
                 m += len(d)-offset
 
+            self.release_tag(tlp.tag)
+
             n += byte_length
             addr += byte_length
 
@@ -4112,7 +4364,7 @@ class RootComplex(Switch):
         assert addr == 0
         assert len(data) == 4
         number = struct.unpack('<L', data)[0]
-        print("MSI interrupt: 0x%08x, 0x%04x" % (addr, number))
+        trace(TRACE_INFO, None, "MSI interrupt: 0x%08x, 0x%04x", addr, number)
         assert number in self.msi_signals
         for sig in self.msi_signals[number]:
             sig.next = not sig
@@ -4227,7 +4479,7 @@ class RootComplex(Switch):
         tree.prefetchable_mem_limit = self.prefetchable_mem_limit
 
         # logging
-        print("[%s] Enumerating bus %d" % (highlight(self.get_desc()), bus))
+        trace(TRACE_INFO, self, "Enumerating bus %d", bus)
 
         for d in range(32):
             if bus == 0 and d == 0:
@@ -4241,7 +4493,7 @@ class RootComplex(Switch):
 
             # valid vendor ID
             # logging
-            print("[%s] Found device at %02x:%02x.%x" % (highlight(self.get_desc()), bus, d, 0))
+            trace(TRACE_INFO, self, "Found device at %02x:%02x.%x", bus, d, 0)
 
             fc = 1
 
@@ -4267,7 +4519,7 @@ class RootComplex(Switch):
                 ti.vendor_id, ti.device_id = struct.unpack('<HH', val)
 
                 # logging
-                print("[%s] Found function at %02x:%02x.%x" % (highlight(self.get_desc()), bus, d, f))
+                trace(TRACE_INFO, self, "Found function at %02x:%02x.%x", bus, d, f)
 
                 # read type
                 val = yield from self.config_read_byte(PcieId(bus, d, f), 0x00e, timeout)
@@ -4279,7 +4531,7 @@ class RootComplex(Switch):
                 if bridge:
                     # found a bridge
                     # logging
-                    print("[%s] Found bridge at %02x:%02x.%x" % (highlight(self.get_desc()), bus, d, f))
+                    trace(TRACE_INFO, self, "Found bridge at %02x:%02x.%x", bus, d, f)
 
                     bar_cnt = 2
 
@@ -4296,14 +4548,14 @@ class RootComplex(Switch):
                         continue
                     
                     # logging
-                    print("[%s] Configure %02x:%02x.%x BAR%d" % (highlight(self.get_desc()), bus, d, f, bar))
+                    trace(TRACE_INFO, self, "Configure %02x:%02x.%x BAR%d", bus, d, f, bar)
 
                     if val & 1:
                         # IO BAR
                         mask = (~val & 0xffffffff) | 3
                         size = mask + 1
                         # logging
-                        print("[%s] %02x:%02x.%x IO BAR%d raw: %08x, mask: %08x, size: %d" % (highlight(self.get_desc()), bus, d, f, bar, val, mask, size))
+                        trace(TRACE_INFO, self, "%02x:%02x.%x IO BAR%d raw: %08x, mask: %08x, size: %d", bus, d, f, bar, val, mask, size)
 
                         # align
                         self.io_limit = align(self.io_limit, mask)
@@ -4314,7 +4566,7 @@ class RootComplex(Switch):
                         ti.bar_size[bar] = size
 
                         # logging
-                        print("[%s] %02x:%02x.%x IO BAR%d Allocation: %08x, size: %d" % (highlight(self.get_desc()), bus, d, f, bar, val, size))
+                        trace(TRACE_INFO, self, "%02x:%02x.%x IO BAR%d Allocation: %08x, size: %d", bus, d, f, bar, val, size)
 
                         self.io_limit += size
 
@@ -4337,7 +4589,7 @@ class RootComplex(Switch):
                             mask = (~val & 0xffffffffffffffff) | 15
                             size = mask + 1
                             # logging
-                            print("[%s] %02x:%02x.%x (64-bit) Mem BAR%d raw: %016x, mask: %016x, size: %d" % (highlight(self.get_desc()), bus, d, f, bar, val, mask, size))
+                            trace(TRACE_INFO, self, "%02x:%02x.%x (64-bit) Mem BAR%d raw: %016x, mask: %016x, size: %d", bus, d, f, bar, val, mask, size)
 
                             if val & 8:
                                 # prefetchable
@@ -4349,7 +4601,7 @@ class RootComplex(Switch):
                             else:
                                 # not-prefetchable
                                 # logging
-                                print("[%s] %02x:%02x.%x (64-bit) Mem BAR%d marked non-prefetchable, allocating from 32-bit non-prefetchable address space" % (highlight(self.get_desc()), bus, d, f, bar))
+                                trace(TRACE_INFO, self, "%02x:%02x.%x (64-bit) Mem BAR%d marked non-prefetchable, allocating from 32-bit non-prefetchable address space", bus, d, f, bar)
                                 # align and allocate
                                 self.mem_limit = align(self.mem_limit, mask)
                                 val = val & 15 | self.mem_limit
@@ -4359,7 +4611,7 @@ class RootComplex(Switch):
                             ti.bar_size[bar] = size
 
                             # logging
-                            print("[%s] %02x:%02x.%x (64-bit) Mem BAR%d Allocation: %016x, size: %d" % (highlight(self.get_desc()), bus, d, f, bar, val, size))
+                            trace(TRACE_INFO, self, "%02x:%02x.%x (64-bit) Mem BAR%d Allocation: %016x, size: %d", bus, d, f, bar, val, size)
 
                             # write BAR
                             yield from self.config_write_dword(PcieId(bus, d, f), 0x010+bar*4, val & 0xffffffff)
@@ -4371,12 +4623,12 @@ class RootComplex(Switch):
                             mask = (~val & 0xffffffff) | 15
                             size = mask + 1
                             # logging
-                            print("[%s] %02x:%02x.%x (32-bit) Mem BAR%d raw: %08x, mask: %08x, size: %d" % (highlight(self.get_desc()), bus, d, f, bar, val, mask, size))
+                            trace(TRACE_INFO, self, "%02x:%02x.%x (32-bit) Mem BAR%d raw: %08x, mask: %08x, size: %d", bus, d, f, bar, val, mask, size)
 
                             if val & 8:
                                 # prefetchable
                                 # logging
-                                print("[%s] %02x:%02x.%x (32-bit) Mem BAR%d marked prefetchable, but allocating as non-prefetchable" % (highlight(self.get_desc()), bus, d, f, bar))
+                                trace(TRACE_INFO, self, "%02x:%02x.%x (32-bit) Mem BAR%d marked prefetchable, but allocating as non-prefetchable", bus, d, f, bar)
 
                             # align and allocate
                             self.mem_limit = align(self.mem_limit, mask)
@@ -4387,7 +4639,7 @@ class RootComplex(Switch):
                             ti.bar_size[bar] = size
 
                             # logging
-                            print("[%s] %02x:%02x.%x (32-bit) Mem BAR%d Allocation: %08x, size: %d" % (highlight(self.get_desc()), bus, d, f, bar, val, size))
+                            trace(TRACE_INFO, self, "%02x:%02x.%x (32-bit) Mem BAR%d Allocation: %08x, size: %d", bus, d, f, bar, val, size)
 
                             # write BAR
                             yield from self.config_write_dword(PcieId(bus, d, f), 0x010+bar*4, val)
@@ -4395,7 +4647,7 @@ class RootComplex(Switch):
                             bar += 1
 
                 # logging
-                print("[%s] Walk capabilities of %02x:%02x.%x" % (highlight(self.get_desc()), bus, d, f))
+                trace(TRACE_INFO, self, "Walk capabilities of %02x:%02x.%x", bus, d, f)
 
                 # walk capabilities
                 ptr = yield from self.config_read_byte(PcieId(bus, d, f), 0x34)
@@ -4404,7 +4656,7 @@ class RootComplex(Switch):
                 while ptr > 0:
                     val = yield from self.config_read(PcieId(bus, d, f), ptr, 2)
                     # logging
-                    print("[%s] Found capability 0x%02x at offset 0x%02x, next ptr 0x%02x" % (highlight(self.get_desc()), val[0], ptr, val[1] & 0xfc))
+                    trace(TRACE_INFO, self, "Found capability 0x%02x at offset 0x%02x, next ptr 0x%02x", val[0], ptr, val[1] & 0xfc)
                     ti.capabilities.append((val[0], ptr))
                     ptr = val[1] & 0xfc
 
@@ -4435,7 +4687,7 @@ class RootComplex(Switch):
                 if bridge:
                     # set bridge registers for enumeration
                     # logging
-                    print("[%s] Set pri %d, sec %d, sub %d" % (highlight(self.get_desc()), bus, sec_bus, 255))
+                    trace(TRACE_INFO, self, "Set pri %d, sec %d, sub %d", bus, sec_bus, 255)
 
                     yield from self.config_write(PcieId(bus, d, f), 0x018, bytearray([bus, sec_bus, 255]))
 
@@ -4444,24 +4696,24 @@ class RootComplex(Switch):
 
                     # finalize bridge configuration
                     # logging
-                    print("[%s] Set pri %d, sec %d, sub %d" % (highlight(self.get_desc()), bus, sec_bus, sub_bus))
+                    trace(TRACE_INFO, self, "Set pri %d, sec %d, sub %d", bus, sec_bus, sub_bus)
 
                     yield from self.config_write(PcieId(bus, d, f), 0x018, bytearray([bus, sec_bus, sub_bus]))
 
                     # set base/limit registers
                     # logging
-                    print("[%s] Set IO base: %08x, limit: %08x" % (highlight(self.get_desc()), ti.io_base, ti.io_limit))
+                    trace(TRACE_INFO, self, "Set IO base: %08x, limit: %08x", ti.io_base, ti.io_limit)
 
                     yield from self.config_write(PcieId(bus, d, f), 0x01C, struct.pack('BB', (ti.io_base >> 8) & 0xf0, (ti.io_limit >> 8) & 0xf0))
                     yield from self.config_write(PcieId(bus, d, f), 0x030, struct.pack('<HH', ti.io_base >> 16, ti.io_limit >> 16))
 
                     # logging
-                    print("[%s] Set mem base: %08x, limit: %08x" % (highlight(self.get_desc()), ti.mem_base, ti.mem_limit))
+                    trace(TRACE_INFO, self, "Set mem base: %08x, limit: %08x", ti.mem_base, ti.mem_limit)
 
                     yield from self.config_write(PcieId(bus, d, f), 0x020, struct.pack('<HH', (ti.mem_base >> 16) & 0xfff0, (ti.mem_limit >> 16) & 0xfff0))
 
                     # logging
-                    print("[%s] Set prefetchable mem base: %016x, limit: %016x" % (highlight(self.get_desc()), ti.prefetchable_mem_base, ti.prefetchable_mem_limit))
+                    trace(TRACE_INFO, self, "Set prefetchable mem base: %016x, limit: %016x", ti.prefetchable_mem_base, ti.prefetchable_mem_limit)
 
                     yield from self.config_write(PcieId(bus, d, f), 0x024, struct.pack('<HH', (ti.prefetchable_mem_base >> 16) & 0xfff0, (ti.prefetchable_mem_limit >> 16) & 0xfff0))
                     yield from self.config_write(PcieId(bus, d, f), 0x028, struct.pack('<L', ti.prefetchable_mem_base >> 32))
@@ -4481,13 +4733,13 @@ class RootComplex(Switch):
         tree.prefetchable_mem_limit = self.prefetchable_mem_limit-1
 
         # logging
-        print("[%s] Enumeration of bus %d complete" % (highlight(self.get_desc()), bus))
+        trace(TRACE_INFO, self, "Enumeration of bus %d complete", bus)
 
         return sub_bus
 
     def enumerate(self, timeout=1000, enable_bus_mastering=False, configure_msi=False):
         # logging
-        print("[%s] Enumerating bus" % (highlight(self.get_desc())))
+        trace(TRACE_INFO, self, "Enumerating bus")
 
         self.io_limit = self.io_base
         self.mem_limit = self.mem_base
@@ -4504,9 +4756,9 @@ class RootComplex(Switch):
         self.upstream_bridge.prefetchable_mem_limit = self.prefetchable_mem_limit
 
         # logging
-        print("[%s] Enumeration complete" % (highlight(self.get_desc())))
+        trace(TRACE_INFO, self, "Enumeration complete")
 
         # logging
-        print("Device tree:")
-        print(self.tree.to_str().strip())
+        trace(TRACE_INFO, None, "Device tree:")
+        trace(TRACE_INFO, None, "%s", self.tree.to_str().strip())
 
@@ -36,6 +36,10 @@ from cocotbext.pcie.core.utils import PcieId
 from cocotbext.pcie.core.tlp import Tlp, TlpType, CplStatus
 from cocotbext.pcie.core.caps import MsiCapability, MsixCapability
 
+from bar_index import BarIndex
+from tag_pool import TagPool
+from model_trace import ModelTrace, TRACE_FRAME_TX, TRACE_FRAME_RX
+
 
 class BaseBus(Bus):
 
@@ -73,42 +77,41 @@ class PcieIfRxBus(BaseBus):
         "data_par", "hdr_par", "tlp_prfx_par", "bar_id", "tlp_abort"]
 
 
-def dword_parity(d):
-    d ^= d >> 4
-    d ^= d >> 2
-    d ^= d >> 1
-    p = d & 0x1
-    if d & 0x100:
-        p |= 0x2
-    if d & 0x10000:
-        p |= 0x4
-    if d & 0x1000000:
-        p |= 0x8
-    return p
+# parity lookup tables, _parity_tables[k][x] is the parity of byte x shifted left by k
+_parity_tables = [bytes((bin(x).count('1') & 1) << k for x in range(256)) for k in range(8)]
 
 
-def parity(d):
-    d ^= d >> 4
-    d ^= d >> 2
-    d ^= d >> 1
-    b = 0x1
+def byte_parity(data):
+    # per-byte parity of a buffer, packed into an integer with one bit per byte
+    data = bytes(data)
+    pad = -len(data) % 8
+    if pad:
+        data += b'\x00'*pad
+
+    # each table packs the parity of every eighth byte into the corresponding
+    # bit position; ORing the results yields the packed parity bits
     p = 0
-    while d:
-        if d & 0x1:
-            p |= b
-        d >>= 8
-        b <<= 1
+    for k in range(8):
+        p |= int.from_bytes(data[k::8].translate(_parity_tables[k]), 'little')
     return p
 
 
+def dword_parity(d):
+    return byte_parity(d.to_bytes(4, 'little'))
+
+
+def parity(d):
+    return byte_parity(d.to_bytes((d.bit_length()+7)//8, 'little'))
+
+
 class PcieIfFrame:
     def __init__(self, frame=None):
         self.tlp_prfx = 0
         self.hdr = 0
-        self.data = []
+        self.data = bytearray()
         self.tlp_prfx_par = 0
         self.hdr_par = 0
-        self.parity = []
+        self._parity = 0
         self.func_num = 0
         self.vf_num = None
         self.bar_id = 0
@@ -119,10 +122,10 @@ class PcieIfFrame:
         if isinstance(frame, PcieIfFrame):
             self.tlp_prfx = frame.tlp_prfx
             self.hdr = frame.hdr
-            self.data = list(frame.data)
+            self.data = bytearray(frame.data)
             self.tlp_prfx_par = frame.tlp_prfx_par
             self.hdr_par = frame.hdr_par
-            self.parity = list(frame.parity)
+            self._parity = frame._parity
             self.func_num = frame.func_num
             self.vf_num = frame.vf_num
             self.bar_id = frame.bar_id
@@ -145,9 +148,7 @@ class PcieIfFrame:
 
         frame.hdr = int.from_bytes(hdr.ljust(16, b'\x00'), 'big')
 
-        data = tlp.get_data()
-        for k in range(0, len(data), 4):
-            frame.data.extend(struct.unpack_from('<L', data, k))
+        frame.data = bytearray(tlp.get_data())
 
         frame.update_parity()
 
@@ -162,19 +163,32 @@ class PcieIfFrame:
 
         tlp = Tlp.unpack_header(hdr)
 
-        for dw in self.data:
-            tlp.data.extend(struct.pack('<L', dw))
+        tlp.data.extend(self.data)
 
         return tlp
 
+    @property
+    def parity(self):
+        # payload parity, one bit per payload byte, computed on demand
+        if self._parity is None:
+            self._parity = self._calc_data_parity()
+        return self._parity
+
+    @parity.setter
+    def parity(self, value):
+        self._parity = value
+
+    def _calc_data_parity(self):
+        return byte_parity(self.data) ^ ((1 << len(self.data))-1)
+
     def update_parity(self):
-        self.parity = [dword_parity(d) ^ 0xf for d in self.data]
+        self._parity = None
         self.hdr_par = parity(self.hdr)
         self.tlp_prfx_par = dword_parity(self.tlp_prfx)
 
     def check_parity(self):
         return (
-            self.parity == [dword_parity(d) ^ 0xf for d in self.data] and
+            self.parity == self._calc_data_parity() and
             self.hdr_par == parity(self.hdr) and
             self.tlp_prfx_par == dword_parity(self.tlp_prfx)
         )
@@ -200,9 +214,9 @@ class PcieIfFrame:
     def __repr__(self):
         return (
             f"{type(self).__name__}(tlp_prfx={self.tlp_prfx:#010x}, hdr={self.hdr:#034x}, "
-            f"data=[{', '.join(f'{x:#010x}' for x in self.data)}], "
+            f"data=[{', '.join(f'{x:#010x}' for x, in struct.iter_unpack('<L', self.data))}], "
             f"tlp_prfx_par={self.tlp_prfx_par:#x}, hdr_par={self.hdr_par:#06x}, "
-            f"parity=[{', '.join(hex(x) for x in self.parity)}], "
+            f"parity={self.parity:#x}, "
             f"func_num={self.func_num}, "
             f"vf_num={self.vf_num}, "
             f"bar_id={self.bar_id}, "
@@ -212,7 +226,7 @@ class PcieIfFrame:
         )
 
     def __len__(self):
-        return len(self.data)
+        return len(self.data) // 4
 
 
 class PcieIfTransaction:
@@ -249,6 +263,7 @@ class PcieIfBase:
         self.clock = clock
         self.reset = reset
         self.log = logging.getLogger(f"cocotb.{bus._entity._name}.{bus._name}")
+        self.trace = ModelTrace(self.log)
 
         super().__init__(*args, **kwargs)
 
@@ -358,6 +373,11 @@ class PcieIfBase:
             self.pause = val
             await RisingEdge(self.clock)
 
+    def _trace_frame(self, rec_type, frame):
+        self.trace.msg("%s frame: %s", "TX" if rec_type == TRACE_FRAME_TX else "RX", frame)
+        self.trace.record(rec_type, (frame.hdr.to_bytes(16, 'big'), frame.tlp_prfx,
+            frame.func_num, frame.bar_id, frame.error, frame.seq & 0xff), frame.data)
+
 
 class PcieIfSource(PcieIfBase):
 
@@ -487,7 +507,8 @@ class PcieIfSource(PcieIfBase):
         while True:
             frame = await self._get_frame()
             frame_offset = 0
-            self.log.info(f"TX frame: {frame}")
+            if self.trace.enabled:
+                self._trace_frame(TRACE_FRAME_TX, frame)
             first = True
 
             while frame is not None:
@@ -498,7 +519,8 @@ class PcieIfSource(PcieIfBase):
                         if not self.empty():
                             frame = self._get_frame_nowait()
                             frame_offset = 0
-                            self.log.info(f"TX frame: {frame}")
+                            if self.trace.enabled:
+                                self._trace_frame(TRACE_FRAME_TX, frame)
                             first = True
                         else:
                             break
@@ -524,11 +546,13 @@ class PcieIfSource(PcieIfBase):
                     if frame.data:
                         transaction.valid |= 1 << seg
 
-                        for k in range(min(self.seg_byte_lanes, len(frame.data)-frame_offset)):
-                            transaction.data |= frame.data[frame_offset] << 32*(k+seg*self.seg_byte_lanes)
-                            transaction.data_par |= frame.parity[frame_offset] << 4*(k+seg*self.seg_byte_lanes)
-                            transaction.strb |= 1 << (k+seg*self.seg_byte_lanes)
-                            frame_offset += 1
+                        seg_data = frame.data[frame_offset:frame_offset+self.seg_byte_lanes*4]
+                        seg_len = len(seg_data)
+
+                        transaction.data |= int.from_bytes(seg_data, 'little') << seg*self.seg_width
+                        transaction.data_par |= ((frame.parity >> frame_offset) & ((1 << seg_len)-1)) << seg*self.seg_par_width
+                        transaction.strb |= ((1 << seg_len//4)-1) << seg*self.seg_strb_width
+                        frame_offset += seg_len
 
                     if frame_offset >= len(frame.data):
                         transaction.eop |= 1 << seg
@@ -573,6 +597,10 @@ class PcieIfSink(PcieIfBase):
 
         self.strb_present = hasattr(self.bus, "strb")
 
+        # check parity of every Nth received frame (0 to disable)
+        self.parity_check_interval = 0
+        self.parity_check_count = 0
+
         self.bus.ready.setimmediatevalue(0)
 
         cocotb.start_soon(self._run_sink())
@@ -677,16 +705,12 @@ class PcieIfSink(PcieIfBase):
                     data = (sample.data >> (seg*self.seg_width)) & self.seg_mask
                     data_par = (sample.data_par >> (seg*self.seg_par_width)) & self.seg_par_mask
                     strb = (sample.strb >> (seg*self.seg_strb_width)) & self.seg_strb_mask
-                    for k in range(self.seg_byte_lanes):
-                        if dword_count > 0:
-                            frame.data.append((data >> 32*k) & 0xffffffff)
-                            frame.parity.append((data_par >> 4*k) & 0xf)
-                            if self.strb_present:
-                                assert (strb >> k) & 1, "incorrect strobe signal level"
-                            dword_count -= 1
-                        else:
-                            if self.strb_present:
-                                assert (strb >> k) & 1 == 0, "incorrect strobe signal level"
+                    seg_dwords = min(dword_count, self.seg_byte_lanes)
+                    if self.strb_present:
+                        assert strb == (1 << seg_dwords)-1, "incorrect strobe signal level"
+                    frame.parity |= (data_par & ((1 << seg_dwords*4)-1)) << len(frame.data)
+                    frame.data.extend(data.to_bytes(self.seg_width//8, 'little')[:seg_dwords*4])
+                    dword_count -= seg_dwords
                 else:
                     if self.strb_present:
                         strb = (sample.strb >> (seg*self.seg_strb_width)) & self.seg_strb_mask
@@ -694,7 +718,13 @@ class PcieIfSink(PcieIfBase):
 
                 if sample.eop & (1 << seg):
                     assert dword_count == 0, "framing error: incorrect length or early eop"
-                    self.log.info(f"RX frame: {frame}")
+                    if self.parity_check_interval:
+                        self.parity_check_count += 1
+                        if self.parity_check_count >= self.parity_check_interval:
+                            self.parity_check_count = 0
+                            assert frame.check_parity(), "parity error"
+                    if self.trace.enabled:
+                        self._trace_frame(TRACE_FRAME_RX, frame)
                     self._sink_frame(frame)
                     self.active = False
                     frame = None
@@ -860,6 +890,14 @@ class PcieIfDevice(Device):
         self.rd_req_tx_seq_num_queue = Queue()
         self.wr_req_tx_seq_num_queue = Queue()
 
+        self.fc_update_event = Event()
+        self.cfg_status_update_event = Event()
+
+        # routing tables, rebuilt after config space accesses
+        self.mem_bar_index = None
+        self.io_bar_index = None
+        self.cpl_route = None
+
         # signals
 
         # Clock and reset
@@ -1058,10 +1096,12 @@ class PcieIfDevice(Device):
             cocotb.start_soon(self._run_tx_cpl_logic())
         if self.tx_rd_req_tlp_sink:
             cocotb.start_soon(self._run_tx_rd_req_logic())
-            cocotb.start_soon(self._run_rd_req_tx_seq_num_logic())
+            cocotb.start_soon(self._run_tx_seq_num_logic(self.rd_req_tx_seq_num_queue,
+                self.rd_req_tx_seq_num, self.rd_req_tx_seq_num_valid))
         if self.tx_wr_req_tlp_sink:
             cocotb.start_soon(self._run_tx_wr_req_logic())
-            cocotb.start_soon(self._run_wr_req_tx_seq_num_logic())
+            cocotb.start_soon(self._run_tx_seq_num_logic(self.wr_req_tx_seq_num_queue,
+                self.wr_req_tx_seq_num, self.wr_req_tx_seq_num_valid))
         if self.tx_msi_wr_req_tlp_sink:
             cocotb.start_soon(self._run_tx_msi_wr_req_logic())
         cocotb.start_soon(self._run_cfg_status_logic())
@@ -1076,10 +1116,16 @@ class PcieIfDevice(Device):
             # capture address information
             self.bus_num = tlp.dest_id.bus
 
+            # BARs and IDs may change
+            self.cpl_route = None
+
             # pass TLP to function
             for f in self.functions:
                 if f.pcie_id == tlp.dest_id:
                     await f.upstream_recv(tlp)
+                    if tlp.fmt_type == TlpType.CFG_WRITE_0:
+                        self.cpl_route = None
+                        self.cfg_status_update_event.set()
                     return
 
             tlp.release_fc()
@@ -1094,18 +1140,17 @@ class PcieIfDevice(Device):
         elif tlp.fmt_type in {TlpType.CPL, TlpType.CPL_DATA, TlpType.CPL_LOCKED, TlpType.CPL_LOCKED_DATA}:
             # Completion
 
-            for f in self.functions:
-                if f.pcie_id == tlp.requester_id:
+            if self.route_cpl(tlp.requester_id) is not None:
 
-                    frame = PcieIfFrame.from_tlp(tlp, self.force_64bit_addr)
+                frame = PcieIfFrame.from_tlp(tlp, self.force_64bit_addr)
 
-                    frame.func_num = tlp.requester_id.function
+                frame.func_num = tlp.requester_id.function
 
-                    await self.rx_cpl_queue.put(frame)
+                await self.rx_cpl_queue.put(frame)
 
-                    tlp.release_fc()
+                tlp.release_fc()
 
-                    return
+                return
 
             tlp.release_fc()
 
@@ -1114,20 +1159,19 @@ class PcieIfDevice(Device):
         elif tlp.fmt_type in {TlpType.IO_READ, TlpType.IO_WRITE}:
             # IO read/write
 
-            for f in self.functions:
-                bar = f.match_bar(tlp.address, True)
-                if bar:
+            bar = self.match_bar(tlp.address, True)
+            if bar is not None:
 
-                    frame = PcieIfFrame.from_tlp(tlp, self.force_64bit_addr)
+                frame = PcieIfFrame.from_tlp(tlp, self.force_64bit_addr)
 
-                    frame.bar_id = bar[0]
-                    frame.func_num = tlp.requester_id.function
+                frame.bar_id = bar[1]
+                frame.func_num = tlp.requester_id.function
 
-                    await self.rx_req_queue.put(frame)
+                await self.rx_req_queue.put(frame)
 
-                    tlp.release_fc()
+                tlp.release_fc()
 
-                    return
+                return
 
             tlp.release_fc()
 
@@ -1135,20 +1179,19 @@ class PcieIfDevice(Device):
         elif tlp.fmt_type in {TlpType.MEM_READ, TlpType.MEM_READ_64, TlpType.MEM_WRITE, TlpType.MEM_WRITE_64}:
             # Memory read/write
 
-            for f in self.functions:
-                bar = f.match_bar(tlp.address)
-                if bar:
+            bar = self.match_bar(tlp.address)
+            if bar is not None:
 
-                    frame = PcieIfFrame.from_tlp(tlp, self.force_64bit_addr)
+                frame = PcieIfFrame.from_tlp(tlp, self.force_64bit_addr)
 
-                    frame.bar_id = bar[0]
-                    frame.func_num = tlp.requester_id.function
+                frame.bar_id = bar[1]
+                frame.func_num = tlp.requester_id.function
 
-                    await self.rx_req_queue.put(frame)
+                await self.rx_req_queue.put(frame)
 
-                    tlp.release_fc()
+                tlp.release_fc()
 
-                    return
+                return
 
             tlp.release_fc()
 
@@ -1165,6 +1208,54 @@ class PcieIfDevice(Device):
         self.log.debug("UR Completion: %s", repr(cpl))
         await self.upstream_send(cpl)
 
+    def update_routing(self):
+        self.mem_bar_index = BarIndex(self.functions)
+        self.io_bar_index = BarIndex(self.functions, io=True)
+        self.cpl_route = {f.pcie_id: f for f in self.functions}
+
+    def match_bar(self, addr, io=False):
+        if self.cpl_route is None:
+            self.update_routing()
+
+        index = self.io_bar_index if io else self.mem_bar_index
+
+        if index.valid:
+            m = index.match(addr)
+            if m is not None:
+                return m
+
+        # fall back on linear search (overlapping BARs, or BARs changed
+        # without a config write)
+        for f in self.functions:
+            bar = f.match_bar(addr, io)
+            if bar:
+                if index.valid:
+                    # index is stale
+                    self.cpl_route = None
+                return f, bar[0]
+
+        return None
+
+    def route_cpl(self, requester_id):
+        if self.cpl_route is None:
+            self.update_routing()
+
+        f = self.cpl_route.get(requester_id)
+        if f is not None:
+            return f
+
+        for f in self.functions:
+            if f.pcie_id == requester_id:
+                self.cpl_route = None
+                return f
+
+        return None
+
+    async def upstream_send(self, tlp):
+        await super().upstream_send(tlp)
+        # transmit credits consumed
+        self.fc_update_event.set()
+
     async def _run_rx_req_logic(self):
         while True:
             frame = await self.rx_req_queue.get()
@@ -1188,24 +1279,35 @@ class PcieIfDevice(Device):
             await self.send(tlp)
             self.rd_req_tx_seq_num_queue.put_nowait(frame.seq)
 
-    async def _run_rd_req_tx_seq_num_logic(self):
-        if self.rd_req_tx_seq_num is not None:
-            width = len(self.rd_req_tx_seq_num) // len(self.rd_req_tx_seq_num_valid)
+    async def _run_tx_seq_num_logic(self, queue, seq_num, seq_num_valid):
+        if seq_num is None:
+            while True:
+                await queue.get()
 
-        while True:
-            await RisingEdge(self.clk)
+        width = len(seq_num) // len(seq_num_valid)
+        count = len(seq_num_valid)
+        active = False
 
-            if self.rd_req_tx_seq_num is not None:
+        while True:
+            if active:
+                await RisingEdge(self.clk)
                 data = 0
                 valid = 0
-                for k in range(len(self.rd_req_tx_seq_num_valid)):
-                    if not self.rd_req_tx_seq_num_queue.empty():
-                        data |= self.rd_req_tx_seq_num_queue.get_nowait() << (width*k)
-                        valid |= 1 << k
-                self.rd_req_tx_seq_num.value = data
-                self.rd_req_tx_seq_num_valid.value = valid
-            elif not self.rd_req_tx_seq_num_queue.empty():
-                self.rd_req_tx_seq_num_queue.get_nowait()
+            else:
+                # idle; wait for a sequence number to report
+                data = await queue.get()
+                valid = 1
+                await RisingEdge(self.clk)
+
+            for k in range(valid, count):
+                if queue.empty():
+                    break
+                data |= queue.get_nowait() << (width*k)
+                valid |= 1 << k
+
+            seq_num.value = data
+            seq_num_valid.value = valid
+            active = bool(valid)
 
     async def _run_tx_wr_req_logic(self):
         while True:
@@ -1214,25 +1316,6 @@ class PcieIfDevice(Device):
             await self.send(tlp)
             self.wr_req_tx_seq_num_queue.put_nowait(frame.seq)
 
-    async def _run_wr_req_tx_seq_num_logic(self):
-        if self.wr_req_tx_seq_num is not None:
-            width = len(self.wr_req_tx_seq_num) // len(self.wr_req_tx_seq_num_valid)
-
-        while True:
-            await RisingEdge(self.clk)
-
-            if self.wr_req_tx_seq_num is not None:
-                data = 0
-                valid = 0
-                for k in range(len(self.wr_req_tx_seq_num_valid)):
-                    if not self.wr_req_tx_seq_num_queue.empty():
-                        data |= self.wr_req_tx_seq_num_queue.get_nowait() << (width*k)
-                        valid |= 1 << k
-                self.wr_req_tx_seq_num.value = data
-                self.wr_req_tx_seq_num_valid.value = valid
-            elif not self.wr_req_tx_seq_num_queue.empty():
-                self.wr_req_tx_seq_num_queue.get_nowait()
-
     async def _run_tx_msi_wr_req_logic(self):
         while True:
             frame = await self.tx_msi_wr_req_tlp_sink.recv()
@@ -1240,64 +1323,96 @@ class PcieIfDevice(Device):
             await self.send(tlp)
 
     async def _run_cfg_status_logic(self):
+        signals = [(sig, attr) for sig, attr in [
+                (self.cfg_max_payload, 'max_payload_size'),
+                (self.cfg_max_read_req, 'max_read_request_size'),
+                (self.cfg_ext_tag_enable, 'extended_tag_field_enable'),
+            ] if sig is not None]
+
+        if not signals:
+            return
+
+        values = [None]*len(signals)
+
         while True:
             await RisingEdge(self.clk)
 
-            if self.cfg_max_payload is not None:
-                self.cfg_max_payload.value = self.functions[0].pcie_cap.max_payload_size
-            if self.cfg_max_read_req is not None:
-                self.cfg_max_read_req.value = self.functions[0].pcie_cap.max_read_request_size
-            if self.cfg_ext_tag_enable is not None:
-                self.cfg_ext_tag_enable.value = self.functions[0].pcie_cap.extended_tag_field_enable
+            for k, (sig, attr) in enumerate(signals):
+                val = getattr(self.functions[0].pcie_cap, attr)
+                if val != values[k]:
+                    sig.value = val
+                    values[k] = val
+
+            # only update after config space writes
+            self.cfg_status_update_event.clear()
+            await self.cfg_status_update_event.wait()
 
     async def _run_fc_logic(self):
+        fc_state = self.upstream_port.fc_state[0]
+
+        signals = [(sig, fc, attr) for sig, fc, attr in [
+                (self.tx_fc_ph_av, fc_state.ph, 'tx_credits_available'),
+                (self.tx_fc_pd_av, fc_state.pd, 'tx_credits_available'),
+                (self.tx_fc_nph_av, fc_state.nph, 'tx_credits_available'),
+                (self.tx_fc_npd_av, fc_state.npd, 'tx_credits_available'),
+                (self.tx_fc_cplh_av, fc_state.cplh, 'tx_credits_available'),
+                (self.tx_fc_cpld_av, fc_state.cpld, 'tx_credits_available'),
+
+                (self.tx_fc_ph_lim, fc_state.ph, 'tx_credit_limit'),
+                (self.tx_fc_pd_lim, fc_state.pd, 'tx_credit_limit'),
+                (self.tx_fc_nph_lim, fc_state.nph, 'tx_credit_limit'),
+                (self.tx_fc_npd_lim, fc_state.npd, 'tx_credit_limit'),
+                (self.tx_fc_cplh_lim, fc_state.cplh, 'tx_credit_limit'),
+                (self.tx_fc_cpld_lim, fc_state.cpld, 'tx_credit_limit'),
+
+                (self.tx_fc_ph_cons, fc_state.ph, 'tx_credits_consumed'),
+                (self.tx_fc_pd_cons, fc_state.pd, 'tx_credits_consumed'),
+                (self.tx_fc_nph_cons, fc_state.nph, 'tx_credits_consumed'),
+                (self.tx_fc_npd_cons, fc_state.npd, 'tx_credits_consumed'),
+                (self.tx_fc_cplh_cons, fc_state.cplh, 'tx_credits_consumed'),
+                (self.tx_fc_cpld_cons, fc_state.cpld, 'tx_credits_consumed'),
+            ] if sig is not None]
+
+        if not signals:
+            return
+
+        values = [None]*len(signals)
+
         while True:
             await RisingEdge(self.clk)
 
-            if self.tx_fc_ph_av is not None:
-                self.tx_fc_ph_av.value = self.upstream_port.fc_state[0].ph.tx_credits_available
-            if self.tx_fc_pd_av is not None:
-                self.tx_fc_pd_av.value = self.upstream_port.fc_state[0].pd.tx_credits_available
-            if self.tx_fc_nph_av is not None:
-                self.tx_fc_nph_av.value = self.upstream_port.fc_state[0].nph.tx_credits_available
-            if self.tx_fc_npd_av is not None:
-                self.tx_fc_npd_av.value = self.upstream_port.fc_state[0].npd.tx_credits_available
-            if self.tx_fc_cplh_av is not None:
-                self.tx_fc_cplh_av.value = self.upstream_port.fc_state[0].cplh.tx_credits_available
-            if self.tx_fc_cpld_av is not None:
-                self.tx_fc_cpld_av.value = self.upstream_port.fc_state[0].cpld.tx_credits_available
-
-            if self.tx_fc_ph_lim is not None:
-                self.tx_fc_ph_lim.value = self.upstream_port.fc_state[0].ph.tx_credit_limit
-            if self.tx_fc_pd_lim is not None:
-                self.tx_fc_pd_lim.value = self.upstream_port.fc_state[0].pd.tx_credit_limit
-            if self.tx_fc_nph_lim is not None:
-                self.tx_fc_nph_lim.value = self.upstream_port.fc_state[0].nph.tx_credit_limit
-            if self.tx_fc_npd_lim is not None:
-                self.tx_fc_npd_lim.value = self.upstream_port.fc_state[0].npd.tx_credit_limit
-            if self.tx_fc_cplh_lim is not None:
-                self.tx_fc_cplh_lim.value = self.upstream_port.fc_state[0].cplh.tx_credit_limit
-            if self.tx_fc_cpld_lim is not None:
-                self.tx_fc_cpld_lim.value = self.upstream_port.fc_state[0].cpld.tx_credit_limit
-
-            if self.tx_fc_ph_cons is not None:
-                self.tx_fc_ph_cons.value = self.upstream_port.fc_state[0].ph.tx_credits_consumed
-            if self.tx_fc_pd_cons is not None:
-                self.tx_fc_pd_cons.value = self.upstream_port.fc_state[0].pd.tx_credits_consumed
-            if self.tx_fc_nph_cons is not None:
-                self.tx_fc_nph_cons.value = self.upstream_port.fc_state[0].nph.tx_credits_consumed
-            if self.tx_fc_npd_cons is not None:
-                self.tx_fc_npd_cons.value = self.upstream_port.fc_state[0].npd.tx_credits_consumed
-            if self.tx_fc_cplh_cons is not None:
-                self.tx_fc_cplh_cons.value = self.upstream_port.fc_state[0].cplh.tx_credits_consumed
-            if self.tx_fc_cpld_cons is not None:
-                self.tx_fc_cpld_cons.value = self.upstream_port.fc_state[0].cpld.tx_credits_consumed
+            for k, (sig, fc, attr) in enumerate(signals):
+                val = getattr(fc, attr)
+                if val != values[k]:
+                    sig.value = val
+                    values[k] = val
+
+            # credit state only changes on FC initialization, on receipt of
+            # UpdateFC DLLPs, and when TLPs are sent
+            self.fc_update_event.clear()
+            fc_state.fc_p_update.clear()
+            fc_state.fc_np_update.clear()
+            fc_state.fc_cpl_update.clear()
+
+            triggers = [
+                self.fc_update_event.wait(),
+                fc_state.fc_p_update.wait(),
+                fc_state.fc_np_update.wait(),
+                fc_state.fc_cpl_update.wait(),
+            ]
+
+            if not fc_state.initialized.is_set():
+                triggers.append(fc_state.initialized.wait())
+
+            await First(*triggers)
 
 
 class PcieIfTestDevice:
     def __init__(self,
             # configuration options
             force_64bit_addr=False,
+            tag_count=32,
+            tag_bits=8,
 
             # signals
             # Clock and reset
@@ -1337,13 +1452,11 @@ class PcieIfTestDevice:
         self.bar_ptr = 0
         self.regions = [None]*6
 
-        self.current_tag = 0
-        self.tag_count = 32
-        self.tag_active = [False]*256
+        self.tag_pool = TagPool(tag_count, tag_bits)
         self.tag_release = Event()
 
-        self.rx_cpl_queues = [Queue() for k in range(256)]
-        self.rx_cpl_sync = [Event() for k in range(256)]
+        self.rx_cpl_queues = [Queue() for k in range(1 << tag_bits)]
+        self.rx_cpl_sync = [Event() for k in range(1 << tag_bits)]
 
         self.dev_max_payload = 0
         self.dev_max_read_req = 0
@@ -1465,24 +1578,36 @@ class PcieIfTestDevice:
 
         return None
 
+    @property
+    def tag_count(self):
+        return self.tag_pool.count
+
+    @tag_count.setter
+    def tag_count(self, value):
+        self.tag_pool.resize(value)
+        self.tag_release.set()
+
     async def alloc_tag(self):
-        tag_count = min(256, self.tag_count)
+        tag = self.tag_pool.alloc()
 
-        while True:
-            tag = self.current_tag
-            for k in range(tag_count):
-                tag = (tag + 1) % tag_count
-                if not self.tag_active[tag]:
-                    self.tag_active[tag] = True
-                    self.current_tag = tag
-                    return tag
+        if tag is None:
+            # out of tags
+            self.tag_pool.stall_count += 1
 
-            self.tag_release.clear()
-            await self.tag_release.wait()
+            while tag is None:
+                self.tag_release.clear()
+                await self.tag_release.wait()
+                tag = self.tag_pool.alloc()
+
+        # drop late completions left over from a previous owner that timed out
+        queue = self.rx_cpl_queues[tag]
+        while not queue.empty():
+            queue.get_nowait()
+
+        return tag
 
     def release_tag(self, tag):
-        assert self.tag_active[tag]
-        self.tag_active[tag] = False
+        self.tag_pool.release(tag)
         self.tag_release.set()
 
     async def dma_io_write(self, addr, data, timeout=0, timeout_unit='ns'):
@@ -1606,14 +1731,17 @@ class PcieIfTestDevice:
                 break
 
     async def dma_mem_read(self, addr, length, timeout=0, timeout_unit='ns'):
-        data = b''
         n = 0
 
         zero_len = length <= 0
         if zero_len:
             length = 1
 
-        while True:
+        data = bytearray(length)
+        ops = []
+        errors = []
+
+        while not errors:
             tlp = Tlp()
             if addr > 0xffffffff:
                 tlp.fmt_type = TlpType.MEM_READ_64
@@ -1632,14 +1760,39 @@ class PcieIfTestDevice:
             if zero_len:
                 tlp.first_be = 0
 
+            # tag allocation limits the number of reads in flight
             tlp.tag = await self.alloc_tag()
 
             await self.tx_rd_req_tlp_source.send(PcieIfFrame.from_tlp(tlp, self.force_64bit_addr))
 
-            m = 0
+            ops.append(cocotb.start_soon(self._recv_read_cpls(tlp.tag, data, n, byte_length, errors, timeout, timeout_unit)))
 
+            n += byte_length
+            addr += byte_length
+
+            if n >= length:
+                break
+
+        # wait for all outstanding reads before reporting errors so
+        # that no completion handlers are left running; no further
+        # requests are issued once a read has failed
+        for op in ops:
+            await op
+
+        if errors:
+            raise errors[0]
+
+        if zero_len:
+            return b''
+
+        return bytes(data)
+
+    async def _recv_read_cpls(self, tag, data, offset, byte_length, errors, timeout=0, timeout_unit='ns'):
+        m = 0
+
+        try:
             while True:
-                cpl = await self.recv_cpl(tlp.tag, timeout, timeout_unit)
+                cpl = await self.recv_cpl(tag, timeout, timeout_unit)
 
                 if not cpl:
                     raise Exception("Timeout")
@@ -1652,26 +1805,20 @@ class PcieIfTestDevice:
 
                     d = cpl.get_data()
 
-                    offset = cpl.lower_address & 3
-                    data += d[offset:offset+cpl.byte_count]
+                    lower = cpl.lower_address & 3
+                    seg = d[lower:lower+min(cpl.byte_count, byte_length-m)]
+                    data[offset+m:offset+m+len(seg)] = seg
 
-                m += len(d)-offset
+                m += len(d)-lower
 
                 if m >= byte_length:
                     break
-
-            self.release_tag(tlp.tag)
-
-            n += byte_length
-            addr += byte_length
-
-            if n >= length:
-                break
-
-        if zero_len:
-            return b''
-
-        return data[:length]
+        except Exception as ex:
+            errors.append(ex)
+        finally:
+            # late completions for a timed out tag are discarded when
+            # the tag is next allocated
+            self.release_tag(tag)
 
     async def issue_msi_interrupt(self, addr, data):
         data = data.to_bytes(4, 'little')
@@ -26,6 +26,7 @@ import math
 import struct
 from myhdl import *
 
+from frame_queue import FrameQueue, data_size
 from pcie import *
 
 
@@ -55,6 +56,48 @@ RC_ERROR_INVALID_TAG        = 0b0110
 RC_ERROR_TIMEOUT            = 0b1001
 RC_ERROR_FLR                = 0b1000
 
+# request type for TLP types carried on the CQ interface
+cq_req_type = {
+    TLP_MEM_READ:     REQ_MEM_READ,
+    TLP_MEM_READ_64:  REQ_MEM_READ,
+    TLP_MEM_WRITE:    REQ_MEM_WRITE,
+    TLP_MEM_WRITE_64: REQ_MEM_WRITE,
+    TLP_IO_READ:      REQ_IO_READ,
+    TLP_IO_WRITE:     REQ_IO_WRITE,
+}
+
+# request type for TLP types carried on the RQ interface
+rq_req_type = dict(cq_req_type)
+rq_req_type.update({
+    TLP_CFG_READ_0:   REQ_CFG_READ_0,
+    TLP_CFG_READ_1:   REQ_CFG_READ_1,
+    TLP_CFG_WRITE_0:  REQ_CFG_WRITE_0,
+    TLP_CFG_WRITE_1:  REQ_CFG_WRITE_1,
+})
+
+# TLP type for request types accepted on the CQ interface
+cq_fmt_type = {
+    REQ_MEM_READ:        TLP_MEM_READ,
+    REQ_MEM_WRITE:       TLP_MEM_WRITE,
+    REQ_IO_READ:         TLP_IO_READ,
+    REQ_IO_WRITE:        TLP_IO_WRITE,
+    REQ_MEM_FETCH_ADD:   TLP_FETCH_ADD,
+    REQ_MEM_SWAP:        TLP_SWAP,
+    REQ_MEM_CAS:         TLP_CAS,
+    REQ_MEM_READ_LOCKED: TLP_MEM_READ_LOCKED,
+}
+
+# TLP type for request types accepted on the RQ interface
+rq_fmt_type = dict(cq_fmt_type)
+rq_fmt_type.update({
+    REQ_CFG_READ_0:      TLP_CFG_READ_0,
+    REQ_CFG_READ_1:      TLP_CFG_READ_1,
+    REQ_CFG_WRITE_0:     TLP_CFG_WRITE_0,
+    REQ_CFG_WRITE_1:     TLP_CFG_WRITE_1,
+})
+
+cpl_fmt_types = frozenset((TLP_CPL, TLP_CPL_DATA, TLP_CPL_LOCKED, TLP_CPL_LOCKED_DATA))
+
 
 def dword_parity(d):
     d ^= d >> 4
@@ -67,6 +110,33 @@ def dword_parity(d):
     return p
 
 
+def pack_nibbles(values, offset, count):
+    # lane values (4 bits each) to int, first lane in LSBs
+    if count <= 0:
+        return 0
+    return int(bytes(values[offset:offset+count][::-1]).hex()[1::2], 16)
+
+
+def pack_parity(values, offset, count, lanes):
+    # unused lanes carry parity of zero data
+    return pack_nibbles(values, offset, count) | ((1 << lanes*4)-1) >> count*4 << count*4
+
+
+def unpack_dwords(d, offset, count):
+    return list(struct.unpack('<%dL' % count, ((d >> offset*32) & ((1 << count*32)-1)).to_bytes(count*4, 'little')))
+
+
+def unpack_nibbles(v, offset, count):
+    v = (v >> offset*4) & ((1 << count*4)-1)
+    return [int(c, 16) for c in reversed('%0*x' % (count, v))]
+
+
+def keep_lanes(keep):
+    # first lane and lane count for contiguous tkeep
+    lo = (keep & -keep).bit_length()-1
+    return lo, keep.bit_length()-lo
+
+
 class USPcieFrame(object):
     def __init__(self, frame=None):
         self.data = []
@@ -140,41 +210,23 @@ class TLP_us(TLP):
     def pack_us_cq(self):
         pkt = USPcieFrame()
 
-        if (self.fmt_type == TLP_IO_READ or self.fmt_type == TLP_IO_WRITE or
-                self.fmt_type == TLP_MEM_READ or self.fmt_type == TLP_MEM_READ_64 or
-                self.fmt_type == TLP_MEM_WRITE or self.fmt_type == TLP_MEM_WRITE_64):
+        req_type = cq_req_type.get(self.fmt_type)
+
+        if req_type is not None:
             # Completer Request descriptor
-            l = self.at & 0x3
-            l |= self.address & 0xfffffffc
-            pkt.data.append(l)
-            l = (self.address & 0xffffffff00000000) >> 32
-            pkt.data.append(l)
-            l = self.length & 0x7ff
-            if self.fmt_type == TLP_MEM_READ or self.fmt_type == TLP_MEM_READ_64:
-                l |= REQ_MEM_READ << 11
-            elif self.fmt_type == TLP_MEM_WRITE or self.fmt_type == TLP_MEM_WRITE_64:
-                l |= REQ_MEM_WRITE << 11
-            elif self.fmt_type == TLP_IO_READ:
-                l |= REQ_IO_READ << 11
-            elif self.fmt_type == TLP_IO_WRITE:
-                l |= REQ_IO_WRITE << 11
-            elif self.fmt_type == TLP_FETCH_ADD or self.fmt_type == TLP_FETCH_ADD_64:
-                l |= REQ_MEM_FETCH_ADD << 11
-            elif self.fmt_type == TLP_SWAP or self.fmt_type == TLP_SWAP_64:
-                l |= REQ_MEM_SWAP << 11
-            elif self.fmt_type == TLP_CAS or self.fmt_type == TLP_CAS_64:
-                l |= REQ_MEM_CAS << 11
-            elif self.fmt_type == TLP_MEM_READ_LOCKED or self.fmt_type == TLP_MEM_READ_LOCKED_64:
-                l |= REQ_MEM_READ_LOCKED << 11
-            l |= int(self.requester_id) << 16
-            pkt.data.append(l)
-            l = (self.tag & 0xff)
-            l |= (self.completer_id.function & 0xff) << 8
-            l |= (self.bar_id & 0x7) << 16
-            l |= (self.bar_aperture & 0x3f) << 19
-            l |= (self.tc & 0x7) << 25
-            l |= (self.attr & 0x7) << 28
-            pkt.data.append(l)
+            l0 = self.at & 0x3
+            l0 |= self.address & 0xfffffffc
+            l1 = (self.address & 0xffffffff00000000) >> 32
+            l2 = self.length & 0x7ff
+            l2 |= req_type << 11
+            l2 |= int(self.requester_id) << 16
+            l3 = (self.tag & 0xff)
+            l3 |= (self.completer_id.function & 0xff) << 8
+            l3 |= (self.bar_id & 0x7) << 16
+            l3 |= (self.bar_aperture & 0x3f) << 19
+            l3 |= (self.tc & 0x7) << 25
+            l3 |= (self.attr & 0x7) << 28
+            pkt.data = [l0, l1, l2, l3]
 
             pkt.first_be = self.first_be
             pkt.last_be = self.last_be
@@ -204,25 +256,13 @@ class TLP_us(TLP):
     def unpack_us_cq(self, pkt, check_parity=False):
         req_type = (pkt.data[2] >> 11) & 0xf
 
-        if req_type == REQ_MEM_READ:
-            self.fmt_type = TLP_MEM_READ
-        elif req_type == REQ_MEM_WRITE:
-            self.fmt_type = TLP_MEM_WRITE
-        elif req_type == REQ_IO_READ:
-            self.fmt_type = TLP_IO_READ
-        elif req_type == REQ_IO_WRITE:
-            self.fmt_type = TLP_IO_WRITE
-        elif req_type == REQ_MEM_FETCH_ADD:
-            self.fmt_type = TLP_FETCH_ADD
-        elif req_type == REQ_MEM_SWAP:
-            self.fmt_type = TLP_SWAP
-        elif req_type == REQ_MEM_CAS:
-            self.fmt_type = TLP_CAS
-        elif req_type == REQ_MEM_READ_LOCKED:
-            self.fmt_type = TLP_MEM_READ_LOCKED
-        else:
+        fmt_type = cq_fmt_type.get(req_type)
+
+        if fmt_type is None:
             raise Exception("Invalid packet type")
 
+        self.fmt_type = fmt_type
+
         self.length = pkt.data[2] & 0x7ff
         self.requester_id = PcieId.from_int(pkt.data[2] >> 16)
         self.tag = pkt.data[3] & 0xff
@@ -271,8 +311,7 @@ class TLP_us(TLP):
     def pack_us_cc(self):
         pkt = USPcieFrame()
 
-        if (self.fmt_type == TLP_CPL or self.fmt_type == TLP_CPL_DATA or
-                self.fmt_type == TLP_CPL_LOCKED or self.fmt_type == TLP_CPL_LOCKED_DATA):
+        if self.fmt_type in cpl_fmt_types:
             # Requester Completion descriptor
             l = self.lower_address & 0x7f
             l |= (self.at & 3) << 8
@@ -340,50 +379,22 @@ class TLP_us(TLP):
     def pack_us_rq(self):
         pkt = USPcieFrame()
 
-        if (self.fmt_type == TLP_IO_READ or self.fmt_type == TLP_IO_WRITE or
-                self.fmt_type == TLP_MEM_READ or self.fmt_type == TLP_MEM_READ_64 or
-                self.fmt_type == TLP_MEM_WRITE or self.fmt_type == TLP_MEM_WRITE_64 or
-                self.fmt_type == TLP_CFG_READ_0 or self.fmt_type == TLP_CFG_READ_1 or
-                self.fmt_type == TLP_CFG_WRITE_0 or self.fmt_type == TLP_CFG_WRITE_1):
+        req_type = rq_req_type.get(self.fmt_type)
+
+        if req_type is not None:
             # Completer Request descriptor
-            if (self.fmt_type == TLP_IO_READ or self.fmt_type == TLP_IO_WRITE or
-                    self.fmt_type == TLP_MEM_READ or self.fmt_type == TLP_MEM_READ_64 or
-                    self.fmt_type == TLP_MEM_WRITE or self.fmt_type == TLP_MEM_WRITE_64):
+            if req_type & 8 == 0:
                 l = self.at & 0x3
                 l |= self.address & 0xfffffffc
                 pkt.data.append(l)
                 l = (self.address & 0xffffffff00000000) >> 32
                 pkt.data.append(l)
-            elif (self.fmt_type == TLP_CFG_READ_0 or self.fmt_type == TLP_CFG_READ_1 or
-                    self.fmt_type == TLP_CFG_WRITE_0 or self.fmt_type == TLP_CFG_WRITE_1):
+            else:
                 l = (self.register_number & 0x3ff) << 2
                 pkt.data.append(l)
                 pkt.data.append(0)
             l = self.length & 0x7ff
-            if self.fmt_type == TLP_MEM_READ or self.fmt_type == TLP_MEM_READ_64:
-                l |= REQ_MEM_READ << 11
-            elif self.fmt_type == TLP_MEM_WRITE or self.fmt_type == TLP_MEM_WRITE_64:
-                l |= REQ_MEM_WRITE << 11
-            elif self.fmt_type == TLP_IO_READ:
-                l |= REQ_IO_READ << 11
-            elif self.fmt_type == TLP_IO_WRITE:
-                l |= REQ_IO_WRITE << 11
-            elif self.fmt_type == TLP_FETCH_ADD or self.fmt_type == TLP_FETCH_ADD_64:
-                l |= REQ_MEM_FETCH_ADD << 11
-            elif self.fmt_type == TLP_SWAP or self.fmt_type == TLP_SWAP_64:
-                l |= REQ_MEM_SWAP << 11
-            elif self.fmt_type == TLP_CAS or self.fmt_type == TLP_CAS_64:
-                l |= REQ_MEM_CAS << 11
-            elif self.fmt_type == TLP_MEM_READ_LOCKED or self.fmt_type == TLP_MEM_READ_LOCKED_64:
-                l |= REQ_MEM_READ_LOCKED << 11
-            elif self.fmt_type == TLP_CFG_READ_0:
-                l |= REQ_CFG_READ_0 << 11
-            elif self.fmt_type == TLP_CFG_READ_1:
-                l |= REQ_CFG_READ_1 << 11
-            elif self.fmt_type == TLP_CFG_WRITE_0:
-                l |= REQ_CFG_WRITE_0 << 11
-            elif self.fmt_type == TLP_CFG_WRITE_1:
-                l |= REQ_CFG_WRITE_1 << 11
+            l |= req_type << 11
             # TODO poisoned
             l |= int(self.requester_id) << 16
             pkt.data.append(l)
@@ -415,33 +426,13 @@ class TLP_us(TLP):
     def unpack_us_rq(self, pkt, check_parity=False):
         req_type = (pkt.data[2] >> 11) & 0xf
 
-        if req_type == REQ_MEM_READ:
-            self.fmt_type = TLP_MEM_READ
-        elif req_type == REQ_MEM_WRITE:
-            self.fmt_type = TLP_MEM_WRITE
-        elif req_type == REQ_IO_READ:
-            self.fmt_type = TLP_IO_READ
-        elif req_type == REQ_IO_WRITE:
-            self.fmt_type = TLP_IO_WRITE
-        elif req_type == REQ_MEM_FETCH_ADD:
-            self.fmt_type = TLP_FETCH_ADD
-        elif req_type == REQ_MEM_SWAP:
-            self.fmt_type = TLP_SWAP
-        elif req_type == REQ_MEM_CAS:
-            self.fmt_type = TLP_CAS
-        elif req_type == REQ_MEM_READ_LOCKED:
-            self.fmt_type = TLP_MEM_READ_LOCKED
-        elif req_type == REQ_CFG_READ_0:
-            self.fmt_type = TLP_CFG_READ_0
-        elif req_type == REQ_CFG_READ_1:
-            self.fmt_type = TLP_CFG_READ_1
-        elif req_type == REQ_CFG_WRITE_0:
-            self.fmt_type = TLP_CFG_WRITE_0
-        elif req_type == REQ_CFG_WRITE_1:
-            self.fmt_type = TLP_CFG_WRITE_1
-        else:
+        fmt_type = rq_fmt_type.get(req_type)
+
+        if fmt_type is None:
             raise Exception("Invalid packet type")
 
+        self.fmt_type = fmt_type
+
         self.length = pkt.data[2] & 0x7ff
         # TODO poisoned
         self.requester_id = PcieId.from_int(pkt.data[2] >> 16)
@@ -484,8 +475,7 @@ class TLP_us(TLP):
     def pack_us_rc(self):
         pkt = USPcieFrame()
 
-        if (self.fmt_type == TLP_CPL or self.fmt_type == TLP_CPL_DATA or
-                self.fmt_type == TLP_CPL_LOCKED or self.fmt_type == TLP_CPL_LOCKED_DATA):
+        if self.fmt_type in cpl_fmt_types:
             # Requester Completion descriptor
             l = self.lower_address & 0xfff
             l |= (self.error_code & 0xf) << 12
@@ -590,6 +580,18 @@ class TLP_us(TLP):
 
         return self
 
+    @staticmethod
+    def pack_us_many(tlps, interface):
+        """Pack TLPs for the given interface ('cq', 'cc', 'rq', or 'rc')"""
+        pack = getattr(TLP_us, 'pack_us_'+interface)
+        return [pack(tlp) for tlp in tlps]
+
+    @classmethod
+    def unpack_us_many(cls, pkts, interface, check_parity=False):
+        """Unpack TLPs from frames on the given interface ('cq', 'cc', 'rq', or 'rc')"""
+        unpack = getattr(cls, 'unpack_us_'+interface)
+        return [unpack(cls(), pkt, check_parity) for pkt in pkts]
+
     def __eq__(self, other):
         if isinstance(other, TLP_us):
             return (
@@ -644,11 +646,248 @@ class TLP_us(TLP):
             )
 
 
+class StraddleLayout(object):
+    """tuser field offsets for 512-bit interfaces with straddling enabled"""
+    def __init__(self, sop_lanes, is_sop, is_sop_ptr, is_eop, is_eop_ptr, discontinue, parity,
+            byte_en=None, first_be=None, last_be=None, seq_num=None, tuser_width=None):
+        self.sop_lanes = sop_lanes
+        self.max_tlps = len(sop_lanes)
+        self.is_sop = is_sop
+        self.is_sop_ptr = is_sop_ptr
+        self.is_eop = is_eop
+        self.is_eop_ptr = is_eop_ptr
+        self.discontinue = discontinue
+        self.parity = parity
+        self.byte_en = byte_en
+        self.first_be = first_be
+        self.last_be = last_be
+        self.seq_num = seq_num
+        self.tuser_width = tuser_width
+
+
+# two TLPs per beat, starting on lane 0 or 8
+CQ_STRADDLE = StraddleLayout((0, 8), is_sop=80, is_sop_ptr=82, is_eop=86, is_eop_ptr=88,
+    discontinue=96, parity=119, byte_en=16, first_be=0, last_be=8, tuser_width=183)
+CC_STRADDLE = StraddleLayout((0, 8), is_sop=0, is_sop_ptr=2, is_eop=6, is_eop_ptr=8,
+    discontinue=16, parity=17, tuser_width=81)
+RQ_STRADDLE = StraddleLayout((0, 8), is_sop=20, is_sop_ptr=22, is_eop=26, is_eop_ptr=28,
+    discontinue=36, parity=73, first_be=0, last_be=8, seq_num=61, tuser_width=137)
+RC_STRADDLE = StraddleLayout((0, 8), is_sop=64, is_sop_ptr=68, is_eop=76, is_eop_ptr=80,
+    discontinue=96, parity=97, byte_en=0, tuser_width=161)
+# four completions per beat, starting on lane 0, 4, 8, or 12
+RC_4TLP_STRADDLE = StraddleLayout((0, 4, 8, 12), is_sop=64, is_sop_ptr=68, is_eop=76, is_eop_ptr=80,
+    discontinue=96, parity=97, byte_en=0, tuser_width=161)
+
+
+def straddle_source_logic(source, layout, clk, rst, tdata, tkeep, tvalid, tready, tlast, tuser, pause, name):
+    assert len(tdata) == 512
+    assert len(tuser) == layout.tuser_width
+
+    lanes = len(tkeep)
+
+    @instance
+    def logic():
+        frame = None
+        data = b''
+        offset = 0
+        remaining = 0
+        source.active = False
+
+        while True:
+            yield clk.posedge, rst.posedge
+
+            if rst:
+                frame = None
+                remaining = 0
+                source.active = False
+                tdata.next = 0
+                tkeep.next = 0
+                tuser.next = 0
+                tvalid.next = False
+                tlast.next = False
+            else:
+                tvalid.next = source.active and (tvalid or not pause)
+                if tready and tvalid:
+                    tvalid.next = False
+                    source.active = False
+                if (remaining or source.queue) and not source.active:
+                    d = 0
+                    k = 0
+                    u = 0
+                    par = 0
+                    sop_cnt = 0
+                    eop_cnt = 0
+                    lane = 0
+
+                    # pack greedily, new TLPs start on the next permitted lane
+                    while lane < lanes:
+                        if not remaining:
+                            if not source.queue or sop_cnt >= layout.max_tlps:
+                                break
+                            for start in layout.sop_lanes:
+                                if start >= lane:
+                                    break
+                            else:
+                                break
+                            lane = start
+
+                            frame = source.queue.popleft()
+                            data = struct.pack('<%dL' % len(frame.data), *frame.data)
+                            offset = 0
+                            remaining = len(frame.data)
+                            if name is not None:
+                                trace(TRACE_TLP, name, "Sending frame %r", frame)
+
+                            u |= 1 << layout.is_sop+sop_cnt
+                            u |= (lane//4) << layout.is_sop_ptr+sop_cnt*2
+                            if layout.first_be is not None:
+                                u |= (frame.first_be & 0xf) << layout.first_be+sop_cnt*4
+                                u |= (frame.last_be & 0xf) << layout.last_be+sop_cnt*4
+                            if layout.seq_num is not None:
+                                u |= (frame.seq_num & 0x3f) << layout.seq_num+sop_cnt*6
+                            sop_cnt += 1
+
+                        if frame.discontinue:
+                            u |= 1 << layout.discontinue
+
+                        n = min(lanes-lane, remaining)
+                        d |= int.from_bytes(data[offset*4:(offset+n)*4], 'little') << lane*32
+                        k |= ((1 << n)-1) << lane
+                        if layout.byte_en is not None:
+                            u |= pack_nibbles(frame.byte_en, offset, n) << lane*4+layout.byte_en
+                        par |= pack_nibbles(frame.parity, offset, n) << lane*4
+                        offset += n
+                        remaining -= n
+                        lane += n
+
+                        if not remaining:
+                            u |= 1 << layout.is_eop+eop_cnt
+                            u |= (lane-1) << layout.is_eop_ptr+eop_cnt*4
+                            eop_cnt += 1
+
+                    # unused lanes carry parity of zero data
+                    for i in range(lanes):
+                        if not k & (1 << i):
+                            par |= 0xf << i*4
+                    u |= par << layout.parity
+
+                    tdata.next = d
+                    tkeep.next = k
+                    tuser.next = u
+                    tvalid.next = not pause
+                    tlast.next = remaining == 0
+                    source.active = True
+
+    return instances()
+
+
+def straddle_sink_logic(sink, layout, clk, rst, tdata, tkeep, tvalid, tready, tlast, tuser, pause, name):
+    assert len(tdata) == 512
+    assert len(tuser) == layout.tuser_width
+
+    lanes = len(tkeep)
+
+    tready_int = Signal(bool(False))
+    tvalid_int = Signal(bool(False))
+
+    @always_comb
+    def pause_logic():
+        tready.next = tready_int and not pause
+        tvalid_int.next = tvalid and not pause
+
+    @instance
+    def logic():
+        frame = None
+
+        while True:
+            yield clk.posedge, rst.posedge
+
+            if rst:
+                tready_int.next = False
+                frame = None
+            else:
+                tready_int.next = True
+
+                if tvalid_int:
+                    d = int(tdata)
+                    u = int(tuser)
+
+                    sop_cnt = 0
+                    while sop_cnt < layout.max_tlps and u & (1 << layout.is_sop+sop_cnt):
+                        sop_cnt += 1
+                    eop_cnt = 0
+                    while eop_cnt < layout.max_tlps and u & (1 << layout.is_eop+eop_cnt):
+                        eop_cnt += 1
+
+                    sop_ptrs = [((u >> layout.is_sop_ptr+i*2) & 3)*4 for i in range(sop_cnt)]
+                    eop_ptrs = [(u >> layout.is_eop_ptr+i*4) & 0xf for i in range(eop_cnt)]
+
+                    # segments of (frame, first lane, last lane, ends in this beat)
+                    segments = []
+                    eop_index = 0
+                    lane = 0
+
+                    if frame is not None:
+                        if eop_cnt:
+                            segments.append((frame, 0, eop_ptrs[0], True))
+                            lane = eop_ptrs[0]+1
+                            eop_index = 1
+                        else:
+                            assert sop_cnt == 0, "TLP started before previous TLP ended"
+                            segments.append((frame, 0, lanes-1, False))
+
+                    for i in range(sop_cnt):
+                        start = sop_ptrs[i]
+                        assert start >= lane, "TLP start overlaps previous TLP"
+                        assert start in layout.sop_lanes
+
+                        frame = USPcieFrame()
+                        if layout.first_be is not None:
+                            frame.first_be = (u >> layout.first_be+i*4) & 0xf
+                            frame.last_be = (u >> layout.last_be+i*4) & 0xf
+                        if layout.seq_num is not None:
+                            frame.seq_num = (u >> layout.seq_num+i*6) & 0x3f
+
+                        if eop_index < eop_cnt:
+                            assert eop_ptrs[eop_index] >= start
+                            segments.append((frame, start, eop_ptrs[eop_index], True))
+                            lane = eop_ptrs[eop_index]+1
+                            eop_index += 1
+                        else:
+                            assert i == sop_cnt-1, "TLP started before previous TLP ended"
+                            segments.append((frame, start, lanes-1, False))
+                            lane = lanes
+
+                    assert eop_index == eop_cnt, "is_eop without matching TLP"
+
+                    if u & (1 << layout.discontinue) and segments:
+                        segments[-1][0].discontinue = True
+
+                    frame = None
+
+                    for f, start, end, last in segments:
+                        n = end+1-start
+                        f.data.extend(unpack_dwords(d, start, n))
+                        if layout.byte_en is not None:
+                            f.byte_en.extend(unpack_nibbles(u >> layout.byte_en, start, n))
+                        f.parity.extend(unpack_nibbles(u >> layout.parity, start, n))
+
+                        if last:
+                            sink.queue.append(f)
+                            sink.sync.next = not sink.sync
+                            if name is not None:
+                                trace(TRACE_TLP, name, "Got frame %r", f)
+                        else:
+                            frame = f
+
+    return instances()
+
+
 class CQSource(object):
     def __init__(self):
         self.active = False
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue(data_size)
 
     def send(self, frame):
         self.queue.append(USPcieFrame(frame))
@@ -669,7 +908,8 @@ class CQSource(object):
                 tlast=Signal(bool(False)),
                 tuser=Signal(intbv(0)),
                 pause=0,
-                name=None
+                name=None,
+                straddle=False
             ):
 
         assert len(tdata) in [64, 128, 256, 512]
@@ -685,12 +925,15 @@ class CQSource(object):
 
         self.has_logic = True
 
+        if straddle:
+            return straddle_source_logic(self, CQ_STRADDLE, clk, rst, tdata, tkeep, tvalid, tready, tlast, tuser, pause, name)
+
         @instance
         def logic():
             frame = USPcieFrame()
-            data = []
-            byte_en = []
-            parity = []
+            data = b''
+            offset = 0
+            remaining = 0
             self.active = False
             first = True
 
@@ -698,9 +941,7 @@ class CQSource(object):
                 yield clk.posedge, rst.posedge
 
                 if rst:
-                    data = []
-                    byte_en = []
-                    parity = []
+                    remaining = 0
                     self.active = False
                     tdata.next = 0
                     tkeep.next = 0
@@ -713,17 +954,15 @@ class CQSource(object):
                     if tready and tvalid:
                         tvalid.next = False
                         self.active = False
-                    if not data and self.queue:
-                        frame = self.queue.pop(0)
-                        data = list(frame.data)
-                        byte_en = list(frame.byte_en)
-                        parity = list(frame.parity)
+                    if not remaining and self.queue:
+                        frame = self.queue.popleft()
+                        data = struct.pack('<%dL' % len(frame.data), *frame.data)
+                        offset = 0
+                        remaining = len(frame.data)
                         if name is not None:
-                            print("[%s] Sending frame %s" % (name, repr(frame)))
+                            trace(TRACE_TLP, name, "Sending frame %r", frame)
                         first = True
-                    if data and not self.active:
-                        d = 0
-                        k = 0
+                    if remaining and not self.active:
                         u = 0
 
                         if len(tdata) == 512:
@@ -736,19 +975,16 @@ class CQSource(object):
                             if frame.discontinue:
                                 u |= 1 << 96 # discontinue
 
-                            last_lane = 0
-
-                            for i in range(len(tkeep)):
-                                if data:
-                                    d |= data.pop(0) << i*32
-                                    k |= 1 << i
-                                    u |= byte_en.pop(0) << i*4+16
-                                    u |= parity.pop(0) << i*4+119
-                                    last_lane = i
-                                else:
-                                    u |= 0xf << i*4+119
+                            n = min(len(tkeep), remaining)
+                            d = int.from_bytes(data[offset*4:(offset+n)*4], 'little')
+                            k = (1 << n)-1
+                            u |= pack_nibbles(frame.byte_en, offset, n) << 16
+                            u |= pack_parity(frame.parity, offset, n, len(tkeep)) << 119
+                            last_lane = n-1
+                            offset += n
+                            remaining -= n
 
-                            if not data:
+                            if not remaining:
                                 u |= 0b01 << 86 # is_eop
                                 u |= (last_lane & 0xf) << 88 # is_eop0_ptr
                         else:
@@ -760,20 +996,19 @@ class CQSource(object):
                             if frame.discontinue:
                                 u |= 1 << 41 # discontinue
 
-                            for i in range(len(tkeep)):
-                                if data:
-                                    d |= data.pop(0) << i*32
-                                    k |= 1 << i
-                                    u |= byte_en.pop(0) << i*4+8
-                                    u |= parity.pop(0) << i*4+53
-                                else:
-                                    u |= 0xf << i*4+53
+                            n = min(len(tkeep), remaining)
+                            d = int.from_bytes(data[offset*4:(offset+n)*4], 'little')
+                            k = (1 << n)-1
+                            u |= pack_nibbles(frame.byte_en, offset, n) << 8
+                            u |= pack_parity(frame.parity, offset, n, len(tkeep)) << 53
+                            offset += n
+                            remaining -= n
 
                         tdata.next = d
                         tkeep.next = k
                         tuser.next = u
                         tvalid.next = not pause
-                        tlast.next = len(data) == 0
+                        tlast.next = remaining == 0
                         self.active = True
                         first = False
 
@@ -783,13 +1018,13 @@ class CQSource(object):
 class CQSink(object):
     def __init__(self):
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue(data_size)
         self.read_queue = []
         self.sync = Signal(intbv(0))
 
     def recv(self):
         if self.queue:
-            return self.queue.pop(0)
+            return self.queue.popleft()
         return None
 
     def count(self):
@@ -816,7 +1051,8 @@ class CQSink(object):
                 tlast=Signal(bool(True)),
                 tuser=Signal(intbv(0)),
                 pause=0,
-                name=None
+                name=None,
+                straddle=False
             ):
 
         assert len(tdata) in [64, 128, 256, 512]
@@ -832,6 +1068,9 @@ class CQSink(object):
 
         self.has_logic = True
 
+        if straddle:
+            return straddle_sink_logic(self, CQ_STRADDLE, clk, rst, tdata, tkeep, tvalid, tready, tlast, tuser, pause, name)
+
         tready_int = Signal(bool(False))
         tvalid_int = Signal(bool(False))
 
@@ -885,14 +1124,10 @@ class CQSink(object):
                             if tuser & (1 << 96):
                                 frame.discontinue = True
 
-                            last_lane = 0
-
-                            for i in range(len(tkeep)):
-                                if tkeep & (1 << i):
-                                    frame.data.append((d >> (i*32)) & 0xffffffff)
-                                    frame.byte_en.append((u >> (i*4+16)) & 0xf)
-                                    frame.parity.append((u >> (i*4+119)) & 0xf)
-                                    last_lane = i
+                            lo, n = keep_lanes(int(tkeep))
+                            frame.data.extend(unpack_dwords(d, lo, n))
+                            frame.byte_en.extend(unpack_nibbles(u >> 16, lo, n))
+                            frame.parity.extend(unpack_nibbles(u >> 119, lo, n))
                         else:
                             if first:
                                 frame.first_be = u & 0xf
@@ -901,18 +1136,17 @@ class CQSink(object):
                             if tuser & (1 << 41):
                                 frame.discontinue = True
 
-                            for i in range(len(tkeep)):
-                                if tkeep & (1 << i):
-                                    frame.data.append((d >> (i*32)) & 0xffffffff)
-                                    frame.byte_en.append((u >> (i*4+8)) & 0xf)
-                                    frame.parity.append((u >> (i*4+53)) & 0xf)
+                            lo, n = keep_lanes(int(tkeep))
+                            frame.data.extend(unpack_dwords(d, lo, n))
+                            frame.byte_en.extend(unpack_nibbles(u >> 8, lo, n))
+                            frame.parity.extend(unpack_nibbles(u >> 53, lo, n))
 
                         first = False
                         if tlast:
                             self.queue.append(frame)
                             self.sync.next = not self.sync
                             if name is not None:
-                                print("[%s] Got frame %s" % (name, repr(frame)))
+                                trace(TRACE_TLP, name, "Got frame %r", frame)
                             frame = USPcieFrame()
                             first = True
 
@@ -923,7 +1157,7 @@ class CCSource(object):
     def __init__(self):
         self.active = False
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue(data_size)
 
     def send(self, frame):
         self.queue.append(USPcieFrame(frame))
@@ -944,7 +1178,8 @@ class CCSource(object):
                 tlast=Signal(bool(False)),
                 tuser=Signal(intbv(0)),
                 pause=0,
-                name=None
+                name=None,
+                straddle=False
             ):
 
         assert len(tdata) in [64, 128, 256, 512]
@@ -960,11 +1195,15 @@ class CCSource(object):
 
         self.has_logic = True
 
+        if straddle:
+            return straddle_source_logic(self, CC_STRADDLE, clk, rst, tdata, tkeep, tvalid, tready, tlast, tuser, pause, name)
+
         @instance
         def logic():
             frame = USPcieFrame()
-            data = []
-            parity = []
+            data = b''
+            offset = 0
+            remaining = 0
             self.active = False
             first = True
 
@@ -972,8 +1211,7 @@ class CCSource(object):
                 yield clk.posedge, rst.posedge
 
                 if rst:
-                    data = []
-                    parity = []
+                    remaining = 0
                     self.active = False
                     tdata.next = 0
                     tkeep.next = 0
@@ -986,16 +1224,15 @@ class CCSource(object):
                     if tready and tvalid:
                         tvalid.next = False
                         self.active = False
-                    if not data and self.queue:
-                        frame = self.queue.pop(0)
-                        data = list(frame.data)
-                        parity = list(frame.parity)
+                    if not remaining and self.queue:
+                        frame = self.queue.popleft()
+                        data = struct.pack('<%dL' % len(frame.data), *frame.data)
+                        offset = 0
+                        remaining = len(frame.data)
                         if name is not None:
-                            print("[%s] Sending frame %s" % (name, repr(frame)))
+                            trace(TRACE_TLP, name, "Sending frame %r", frame)
                         first = True
-                    if data and not self.active:
-                        d = 0
-                        k = 0
+                    if remaining and not self.active:
                         u = 0
 
                         if len(tdata) == 512:
@@ -1006,37 +1243,33 @@ class CCSource(object):
                             if frame.discontinue:
                                 u |= 1 << 16 # discontinue
 
-                            last_lane = 0
-
-                            for i in range(len(tkeep)):
-                                if data:
-                                    d |= data.pop(0) << i*32
-                                    k |= 1 << i
-                                    u |= parity.pop(0) << i*4+17
-                                    last_lane = i
-                                else:
-                                    u |= 0xf << i*4+17
+                            n = min(len(tkeep), remaining)
+                            d = int.from_bytes(data[offset*4:(offset+n)*4], 'little')
+                            k = (1 << n)-1
+                            u |= pack_parity(frame.parity, offset, n, len(tkeep)) << 17
+                            last_lane = n-1
+                            offset += n
+                            remaining -= n
 
-                            if not data:
+                            if not remaining:
                                 u |= 0b01 << 6 # is_eop
                                 u |= (last_lane & 0xf) << 8 # is_eop0_ptr
                         else:
                             if frame.discontinue:
                                 u |= 1 # discontinue
 
-                            for i in range(len(tkeep)):
-                                if data:
-                                    d |= data.pop(0) << i*32
-                                    k |= 1 << i
-                                    u |= parity.pop(0) << i*4+1
-                                else:
-                                    u |= 0xf << i*4+1
+                            n = min(len(tkeep), remaining)
+                            d = int.from_bytes(data[offset*4:(offset+n)*4], 'little')
+                            k = (1 << n)-1
+                            u |= pack_parity(frame.parity, offset, n, len(tkeep)) << 1
+                            offset += n
+                            remaining -= n
 
                         tdata.next = d
                         tkeep.next = k
                         tuser.next = u
                         tvalid.next = not pause
-                        tlast.next = len(data) == 0
+                        tlast.next = remaining == 0
                         self.active = True
                         first = False
 
@@ -1046,13 +1279,13 @@ class CCSource(object):
 class CCSink(object):
     def __init__(self):
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue(data_size)
         self.read_queue = []
         self.sync = Signal(intbv(0))
 
     def recv(self):
         if self.queue:
-            return self.queue.pop(0)
+            return self.queue.popleft()
         return None
 
     def count(self):
@@ -1079,7 +1312,8 @@ class CCSink(object):
                 tlast=Signal(bool(True)),
                 tuser=Signal(intbv(0)),
                 pause=0,
-                name=None
+                name=None,
+                straddle=False
             ):
 
         assert len(tdata) in [64, 128, 256, 512]
@@ -1095,6 +1329,9 @@ class CCSink(object):
 
         self.has_logic = True
 
+        if straddle:
+            return straddle_sink_logic(self, CC_STRADDLE, clk, rst, tdata, tkeep, tvalid, tready, tlast, tuser, pause, name)
+
         tready_int = Signal(bool(False))
         tvalid_int = Signal(bool(False))
 
@@ -1144,28 +1381,23 @@ class CCSink(object):
                             if u & (1 << 16):
                                 frame.discontinue = True
 
-                            last_lane = 0
-
-                            for i in range(len(tkeep)):
-                                if tkeep & (1 << i):
-                                    frame.data.append((d >> (i*32)) & 0xffffffff)
-                                    frame.parity.append((u >> (i*4+17)) & 0xf)
-                                    last_lane = i
+                            lo, n = keep_lanes(int(tkeep))
+                            frame.data.extend(unpack_dwords(d, lo, n))
+                            frame.parity.extend(unpack_nibbles(u >> 17, lo, n))
                         else:
                             if u & 1:
                                 frame.discontinue = True
 
-                            for i in range(len(tkeep)):
-                                if tkeep & (1 << i):
-                                    frame.data.append((d >> (i*32)) & 0xffffffff)
-                                    frame.parity.append((u >> (i*4+1)) & 0xf)
+                            lo, n = keep_lanes(int(tkeep))
+                            frame.data.extend(unpack_dwords(d, lo, n))
+                            frame.parity.extend(unpack_nibbles(u >> 1, lo, n))
 
                         first = False
                         if tlast:
                             self.queue.append(frame)
                             self.sync.next = not self.sync
                             if name is not None:
-                                print("[%s] Got frame %s" % (name, repr(frame)))
+                                trace(TRACE_TLP, name, "Got frame %r", frame)
                             frame = USPcieFrame()
                             first = True
 
@@ -1176,7 +1408,7 @@ class RQSource(object):
     def __init__(self):
         self.active = False
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue(data_size)
 
     def send(self, frame):
         self.queue.append(USPcieFrame(frame))
@@ -1197,7 +1429,8 @@ class RQSource(object):
                 tlast=Signal(bool(False)),
                 tuser=Signal(intbv(0)),
                 pause=0,
-                name=None
+                name=None,
+                straddle=False
             ):
 
         assert len(tdata) in [64, 128, 256, 512]
@@ -1213,11 +1446,15 @@ class RQSource(object):
 
         self.has_logic = True
 
+        if straddle:
+            return straddle_source_logic(self, RQ_STRADDLE, clk, rst, tdata, tkeep, tvalid, tready, tlast, tuser, pause, name)
+
         @instance
         def logic():
             frame = USPcieFrame()
-            data = []
-            parity = []
+            data = b''
+            offset = 0
+            remaining = 0
             self.active = False
             first = True
 
@@ -1225,8 +1462,7 @@ class RQSource(object):
                 yield clk.posedge, rst.posedge
 
                 if rst:
-                    data = []
-                    parity = []
+                    remaining = 0
                     self.active = False
                     tdata.next = 0
                     tkeep.next = 0
@@ -1239,16 +1475,15 @@ class RQSource(object):
                     if tready and tvalid:
                         tvalid.next = False
                         self.active = False
-                    if not data and self.queue:
-                        frame = self.queue.pop(0)
-                        data = list(frame.data)
-                        parity = list(frame.parity)
+                    if not remaining and self.queue:
+                        frame = self.queue.popleft()
+                        data = struct.pack('<%dL' % len(frame.data), *frame.data)
+                        offset = 0
+                        remaining = len(frame.data)
                         if name is not None:
-                            print("[%s] Sending frame %s" % (name, repr(frame)))
+                            trace(TRACE_TLP, name, "Sending frame %r", frame)
                         first = True
-                    if data and not self.active:
-                        d = 0
-                        k = 0
+                    if remaining and not self.active:
                         u = 0
 
                         if len(tdata) == 512:
@@ -1263,18 +1498,15 @@ class RQSource(object):
 
                             u |= (frame.seq_num & 0x3f) << 61
 
-                            last_lane = 0
-
-                            for i in range(len(tkeep)):
-                                if data:
-                                    d |= data.pop(0) << i*32
-                                    k |= 1 << i
-                                    u |= parity.pop(0) << i*4+73
-                                    last_lane = i
-                                else:
-                                    u |= 0xf << i*4+73
+                            n = min(len(tkeep), remaining)
+                            d = int.from_bytes(data[offset*4:(offset+n)*4], 'little')
+                            k = (1 << n)-1
+                            u |= pack_parity(frame.parity, offset, n, len(tkeep)) << 73
+                            last_lane = n-1
+                            offset += n
+                            remaining -= n
 
-                            if not data:
+                            if not remaining:
                                 u |= 0b01 << 26 # is_eop
                                 u |= (last_lane & 0xf) << 28 # is_eop0_ptr
                         else:
@@ -1290,13 +1522,12 @@ class RQSource(object):
                             if len(tuser) == 62:
                                 u |= ((frame.seq_num >> 4) & 0x3) << 60
 
-                            for i in range(len(tkeep)):
-                                if data:
-                                    d |= data.pop(0) << i*32
-                                    k |= 1 << i
-                                    u |= parity.pop(0) << i*4+28
-                                else:
-                                    u |= 0xf << i*4+28
+                            n = min(len(tkeep), remaining)
+                            d = int.from_bytes(data[offset*4:(offset+n)*4], 'little')
+                            k = (1 << n)-1
+                            u |= pack_parity(frame.parity, offset, n, len(tkeep)) << 28
+                            offset += n
+                            remaining -= n
 
                             # TODO seq_num
                             # TODO tph
@@ -1305,7 +1536,7 @@ class RQSource(object):
                         tkeep.next = k
                         tuser.next = u
                         tvalid.next = not pause
-                        tlast.next = len(data) == 0
+                        tlast.next = remaining == 0
                         self.active = True
                         first = False
 
@@ -1315,13 +1546,13 @@ class RQSource(object):
 class RQSink(object):
     def __init__(self):
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue(data_size)
         self.read_queue = []
         self.sync = Signal(intbv(0))
 
     def recv(self):
         if self.queue:
-            return self.queue.pop(0)
+            return self.queue.popleft()
         return None
 
     def count(self):
@@ -1348,7 +1579,8 @@ class RQSink(object):
                 tlast=Signal(bool(True)),
                 tuser=Signal(intbv(0)),
                 pause=0,
-                name=None
+                name=None,
+                straddle=False
             ):
 
         assert len(tdata) in [64, 128, 256, 512]
@@ -1364,6 +1596,9 @@ class RQSink(object):
 
         self.has_logic = True
 
+        if straddle:
+            return straddle_sink_logic(self, RQ_STRADDLE, clk, rst, tdata, tkeep, tvalid, tready, tlast, tuser, pause, name)
+
         tready_int = Signal(bool(False))
         tvalid_int = Signal(bool(False))
 
@@ -1419,13 +1654,9 @@ class RQSink(object):
 
                             frame.seq_num = (u >> 61) & 0x3f
 
-                            last_lane = 0
-
-                            for i in range(len(tkeep)):
-                                if tkeep & (1 << i):
-                                    frame.data.append((d >> (i*32)) & 0xffffffff)
-                                    frame.parity.append((u >> (i*4+73)) & 0xf)
-                                    last_lane = i
+                            lo, n = keep_lanes(int(tkeep))
+                            frame.data.extend(unpack_dwords(d, lo, n))
+                            frame.parity.extend(unpack_nibbles(u >> 73, lo, n))
                         else:
                             if first:
                                 frame.first_be = u & 0xf
@@ -1439,17 +1670,16 @@ class RQSink(object):
                             if len(tuser) == 62:
                                 frame.seq_num |= ((u >> 60) & 0x3) << 4
 
-                            for i in range(len(tkeep)):
-                                if tkeep & (1 << i):
-                                    frame.data.append((d >> (i*32)) & 0xffffffff)
-                                    frame.parity.append((u >> (i*4+28)) & 0xf)
+                            lo, n = keep_lanes(int(tkeep))
+                            frame.data.extend(unpack_dwords(d, lo, n))
+                            frame.parity.extend(unpack_nibbles(u >> 28, lo, n))
 
                         first = False
                         if tlast:
                             self.queue.append(frame)
                             self.sync.next = not self.sync
                             if name is not None:
-                                print("[%s] Got frame %s" % (name, repr(frame)))
+                                trace(TRACE_TLP, name, "Got frame %r", frame)
                             frame = USPcieFrame()
                             first = True
 
@@ -1460,7 +1690,7 @@ class RCSource(object):
     def __init__(self):
         self.active = False
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue(data_size)
 
     def send(self, frame):
         self.queue.append(USPcieFrame(frame))
@@ -1481,7 +1711,9 @@ class RCSource(object):
                 tlast=Signal(bool(False)),
                 tuser=Signal(intbv(0)),
                 pause=0,
-                name=None
+                name=None,
+                straddle=False,
+                straddle_4tlp=False
             ):
 
         assert len(tdata) in [64, 128, 256, 512]
@@ -1497,12 +1729,17 @@ class RCSource(object):
 
         self.has_logic = True
 
+        if straddle_4tlp:
+            return straddle_source_logic(self, RC_4TLP_STRADDLE, clk, rst, tdata, tkeep, tvalid, tready, tlast, tuser, pause, name)
+        if straddle:
+            return straddle_source_logic(self, RC_STRADDLE, clk, rst, tdata, tkeep, tvalid, tready, tlast, tuser, pause, name)
+
         @instance
         def logic():
             frame = USPcieFrame()
-            data = []
-            byte_en = []
-            parity = []
+            data = b''
+            offset = 0
+            remaining = 0
             self.active = False
             first = True
 
@@ -1510,9 +1747,7 @@ class RCSource(object):
                 yield clk.posedge, rst.posedge
 
                 if rst:
-                    data = []
-                    byte_en = []
-                    parity = []
+                    remaining = 0
                     self.active = False
                     tdata.next = 0
                     tkeep.next = 0
@@ -1525,17 +1760,15 @@ class RCSource(object):
                     if tready and tvalid:
                         tvalid.next = False
                         self.active = False
-                    if not data and self.queue:
-                        frame = self.queue.pop(0)
-                        data = list(frame.data)
-                        byte_en = list(frame.byte_en)
-                        parity = list(frame.parity)
+                    if not remaining and self.queue:
+                        frame = self.queue.popleft()
+                        data = struct.pack('<%dL' % len(frame.data), *frame.data)
+                        offset = 0
+                        remaining = len(frame.data)
                         if name is not None:
-                            print("[%s] Sending frame %s" % (name, repr(frame)))
+                            trace(TRACE_TLP, name, "Sending frame %r", frame)
                         first = True
-                    if data and not self.active:
-                        d = 0
-                        k = 0
+                    if remaining and not self.active:
                         u = 0
 
                         if len(tdata) == 512:
@@ -1546,19 +1779,16 @@ class RCSource(object):
                             if frame.discontinue:
                                 u |= 1 << 96 # discontinue
 
-                            last_lane = 0
-
-                            for i in range(len(tkeep)):
-                                if data:
-                                    d |= data.pop(0) << i*32
-                                    k |= 1 << i
-                                    u |= byte_en.pop(0) << i*4
-                                    u |= parity.pop(0) << i*4+97
-                                    last_lane = i
-                                else:
-                                    u |= 0xf << i*4+97
+                            n = min(len(tkeep), remaining)
+                            d = int.from_bytes(data[offset*4:(offset+n)*4], 'little')
+                            k = (1 << n)-1
+                            u |= pack_nibbles(frame.byte_en, offset, n)
+                            u |= pack_parity(frame.parity, offset, n, len(tkeep)) << 97
+                            last_lane = n-1
+                            offset += n
+                            remaining -= n
 
-                            if not data:
+                            if not remaining:
                                 u |= 0b0001 << 76 # is_eop
                                 u |= last_lane << 80 # is_eop0_ptr
                         else:
@@ -1568,26 +1798,23 @@ class RCSource(object):
                             if frame.discontinue:
                                 u |= 1 << 42 # discontinue
 
-                            last_lane = 0
+                            n = min(len(tkeep), remaining)
+                            d = int.from_bytes(data[offset*4:(offset+n)*4], 'little')
+                            k = (1 << n)-1
+                            u |= pack_nibbles(frame.byte_en, offset, n)
+                            u |= pack_parity(frame.parity, offset, n, len(tkeep)) << 43
+                            last_lane = n-1
+                            offset += n
+                            remaining -= n
 
-                            for i in range(len(tkeep)):
-                                if data:
-                                    d |= data.pop(0) << i*32
-                                    k |= 1 << i
-                                    u |= byte_en.pop(0) << i*4
-                                    u |= parity.pop(0) << i*4+43
-                                    last_lane = i
-                                else:
-                                    u |= 0xf << i*4+43
-
-                            if not data:
+                            if not remaining:
                                 u |= (1 | last_lane << 1) << 34 # is_eof_0
 
                         tdata.next = d
                         tkeep.next = k
                         tuser.next = u
                         tvalid.next = not pause
-                        tlast.next = len(data) == 0
+                        tlast.next = remaining == 0
                         self.active = True
                         first = False
 
@@ -1597,13 +1824,13 @@ class RCSource(object):
 class RCSink(object):
     def __init__(self):
         self.has_logic = False
-        self.queue = []
+        self.queue = FrameQueue(data_size)
         self.read_queue = []
         self.sync = Signal(intbv(0))
 
     def recv(self):
         if self.queue:
-            return self.queue.pop(0)
+            return self.queue.popleft()
         return None
 
     def count(self):
@@ -1630,7 +1857,9 @@ class RCSink(object):
                 tlast=Signal(bool(True)),
                 tuser=Signal(intbv(0)),
                 pause=0,
-                name=None
+                name=None,
+                straddle=False,
+                straddle_4tlp=False
             ):
 
         assert len(tdata) in [64, 128, 256, 512]
@@ -1646,6 +1875,11 @@ class RCSink(object):
 
         self.has_logic = True
 
+        if straddle_4tlp:
+            return straddle_sink_logic(self, RC_4TLP_STRADDLE, clk, rst, tdata, tkeep, tvalid, tready, tlast, tuser, pause, name)
+        if straddle:
+            return straddle_sink_logic(self, RC_STRADDLE, clk, rst, tdata, tkeep, tvalid, tready, tlast, tuser, pause, name)
+
         tready_int = Signal(bool(False))
         tvalid_int = Signal(bool(False))
 
@@ -1695,33 +1929,25 @@ class RCSink(object):
                             if u & (1 << 96):
                                 frame.discontinue = True
 
-                            last_lane = 0
-
-                            for i in range(len(tkeep)):
-                                if tkeep & (1 << i):
-                                    frame.data.append((d >> (i*32)) & 0xffffffff)
-                                    frame.byte_en.append((u >> (i*4)) & 0xf)
-                                    frame.parity.append((u >> (i*4+97)) & 0xf)
-                                    last_lane = i
+                            lo, n = keep_lanes(int(tkeep))
+                            frame.data.extend(unpack_dwords(d, lo, n))
+                            frame.byte_en.extend(unpack_nibbles(u, lo, n))
+                            frame.parity.extend(unpack_nibbles(u >> 97, lo, n))
                         else:
                             if u & (1 << 42):
                                 frame.discontinue = True
 
-                            last_lane = 0
-
-                            for i in range(len(tkeep)):
-                                if tkeep & (1 << i):
-                                    frame.data.append((d >> (i*32)) & 0xffffffff)
-                                    frame.byte_en.append((u >> (i*4)) & 0xf)
-                                    frame.parity.append((u >> (i*4+43)) & 0xf)
-                                    last_lane = i
+                            lo, n = keep_lanes(int(tkeep))
+                            frame.data.extend(unpack_dwords(d, lo, n))
+                            frame.byte_en.extend(unpack_nibbles(u, lo, n))
+                            frame.parity.extend(unpack_nibbles(u >> 43, lo, n))
 
                         first = False
                         if tlast:
                             self.queue.append(frame)
                             self.sync.next = not self.sync
                             if name is not None:
-                                print("[%s] Got frame %s" % (name, repr(frame)))
+                                trace(TRACE_TLP, name, "Got frame %r", frame)
                             frame = USPcieFrame()
                             first = True
 
@@ -1768,11 +1994,11 @@ class UltrascalePCIe(Device):
         self.enable_pf0_msi = False
         self.enable_pf1_msi = False
 
-        self.cq_queue = []
-        self.cq_np_queue = []
+        self.cq_queue = FrameQueue()
+        self.cq_np_queue = FrameQueue()
         self.cq_np_req_count = 0
-        self.rc_queue = []
-        self.msg_queue = []
+        self.rc_queue = FrameQueue()
+        self.msg_queue = FrameQueue()
 
         self.config_space_enable = False
 
@@ -1781,24 +2007,24 @@ class UltrascalePCIe(Device):
         self.rq_sink = RQSink()
         self.rc_source = RCSource()
 
-        self.rq_seq_num = []
+        self.rq_seq_num = FrameQueue()
 
         self.make_function()
 
 
     def upstream_recv(self, tlp):
         # logging
-        print("[%s] Got downstream TLP: %s" % (highlight(self.get_desc()), repr(tlp)))
+        trace(TRACE_TLP, self, "Got downstream TLP: %r", tlp)
         if tlp.fmt_type == TLP_CFG_READ_0 or tlp.fmt_type == TLP_CFG_WRITE_0:
             # config type 0
 
             if not self.config_space_enable:
-                print("Configuraion space disabled")
+                trace(TRACE_ERROR, None, "Configuraion space disabled")
 
                 cpl = TLP()
                 cpl.set_crs_completion(tlp, (self.bus_num, self.device_num, 0))
                 # logging
-                print("[%s] CRS Completion: %s" % (highlight(self.get_desc()), repr(cpl)))
+                trace(TRACE_TLP, self, "CRS Completion: %r", cpl)
                 yield from self.upstream_send(cpl)
                 return
             elif tlp.dest_id.device == self.device_num:
@@ -1815,15 +2041,15 @@ class UltrascalePCIe(Device):
                         return
 
                 #raise Exception("Function not found")
-                print("Function not found")
+                trace(TRACE_ERROR, None, "Function not found")
             else:
-                print("Device number mismatch")
+                trace(TRACE_ERROR, None, "Device number mismatch")
             
             # Unsupported request
             cpl = TLP()
             cpl.set_ur_completion(tlp, (self.bus_num, self.device_num, 0))
             # logging
-            print("[%s] UR Completion: %s" % (highlight(self.get_desc()), repr(cpl)))
+            trace(TRACE_TLP, self, "UR Completion: %r", cpl)
             yield from self.upstream_send(cpl)
         elif (tlp.fmt_type == TLP_CPL or tlp.fmt_type == TLP_CPL_DATA or
                 tlp.fmt_type == TLP_CPL_LOCKED or tlp.fmt_type == TLP_CPL_LOCKED_DATA):
@@ -1844,9 +2070,9 @@ class UltrascalePCIe(Device):
 
                         return
 
-                print("Function not found")
+                trace(TRACE_ERROR, None, "Function not found")
             else:
-                print("Bus/device number mismatch")
+                trace(TRACE_ERROR, None, "Bus/device number mismatch")
         elif (tlp.fmt_type == TLP_IO_READ or tlp.fmt_type == TLP_IO_WRITE):
             # IO read/write
 
@@ -1862,13 +2088,13 @@ class UltrascalePCIe(Device):
 
                     return
 
-            print("IO request did not match any BARs")
+            trace(TRACE_ERROR, None, "IO request did not match any BARs")
 
             # Unsupported request
             cpl = TLP()
             cpl.set_ur_completion(tlp, (self.bus_num, self.device_num, 0))
             # logging
-            print("[%s] UR Completion: %s" % (highlight(self.get_desc()), repr(cpl)))
+            trace(TRACE_TLP, self, "UR Completion: %r", cpl)
             yield from self.upstream_send(cpl)
         elif (tlp.fmt_type == TLP_MEM_READ or tlp.fmt_type == TLP_MEM_READ_64 or
                 tlp.fmt_type == TLP_MEM_WRITE or tlp.fmt_type == TLP_MEM_WRITE_64):
@@ -1889,14 +2115,14 @@ class UltrascalePCIe(Device):
 
                     return
 
-            print("Memory request did not match any BARs")
+            trace(TRACE_ERROR, None, "Memory request did not match any BARs")
 
             if tlp.fmt_type == TLP_MEM_READ or tlp.fmt_type == TLP_MEM_READ_64:
                 # Unsupported request
                 cpl = TLP()
                 cpl.set_ur_completion(tlp, PcieId(self.bus_num, self.device_num, 0))
                 # logging
-                print("[%s] UR Completion: %s" % (highlight(self.get_desc()), repr(cpl)))
+                trace(TRACE_TLP, self, "UR Completion: %r", cpl)
                 yield from self.upstream_send(cpl)
         else:
             raise Exception("TODO")
@@ -2439,13 +2665,13 @@ class UltrascalePCIe(Device):
                 # handle completer requests
                 # send any queued non-posted requests first
                 while self.cq_np_queue and self.cq_np_req_count > 0:
-                    tlp = self.cq_np_queue.pop(0)
+                    tlp = self.cq_np_queue.popleft()
                     self.cq_np_req_count -= 1
                     self.cq_source.send(tlp.pack_us_cq())
 
                 # handle new requests
                 while self.cq_queue:
-                    tlp = self.cq_queue.pop(0)
+                    tlp = self.cq_queue.popleft()
 
                     if (tlp.fmt_type == TLP_IO_READ or tlp.fmt_type == TLP_IO_WRITE or
                             tlp.fmt_type == TLP_MEM_READ or tlp.fmt_type == TLP_MEM_READ_64):
@@ -2489,21 +2715,21 @@ class UltrascalePCIe(Device):
                             self.rq_seq_num.append(tlp.seq_num)
                             yield from self.send(TLP(tlp))
                         else:
-                            print("Bus mastering disabled")
+                            trace(TRACE_ERROR, None, "Bus mastering disabled")
 
                             # TODO: internal response
 
                 # transmit sequence number
                 pcie_rq_seq_num_vld.next = 0
                 if self.rq_seq_num:
-                    pcie_rq_seq_num.next = self.rq_seq_num.pop(0)
+                    pcie_rq_seq_num.next = self.rq_seq_num.popleft()
                     pcie_rq_seq_num_vld.next = 1
 
                 # TODO pcie_rq_tag
 
                 # handle requester completions
                 while self.rc_queue:
-                    tlp = self.rc_queue.pop(0)
+                    tlp = self.rc_queue.popleft()
                     self.rc_source.send(tlp.pack_us_rc())
 
                 # transmit flow control
@@ -0,0 +1 @@
+../tag_pool.py
\ No newline at end of file
@@ -27,6 +27,7 @@ import struct
 from myhdl import *
 
 import axis_ep
+from frame_queue import FrameQueue
 from pcie_us import *
 
 
@@ -72,11 +73,11 @@ class UltrascalePlusPCIe(Device):
         self.enable_pf0_msi = False
         self.enable_pf1_msi = False
 
-        self.cq_queue = []
-        self.cq_np_queue = []
+        self.cq_queue = FrameQueue()
+        self.cq_np_queue = FrameQueue()
         self.cq_np_req_count = 0
-        self.rc_queue = []
-        self.msg_queue = []
+        self.rc_queue = FrameQueue()
+        self.msg_queue = FrameQueue()
 
         self.config_space_enable = False
 
@@ -85,24 +86,24 @@ class UltrascalePlusPCIe(Device):
         self.rq_sink = RQSink()
         self.rc_source = RCSource()
 
-        self.rq_seq_num = []
+        self.rq_seq_num = FrameQueue()
 
         self.make_function()
 
 
     def upstream_recv(self, tlp):
         # logging
-        print("[%s] Got downstream TLP: %s" % (highlight(self.get_desc()), repr(tlp)))
+        trace(TRACE_TLP, self, "Got downstream TLP: %r", tlp)
         if tlp.fmt_type == TLP_CFG_READ_0 or tlp.fmt_type == TLP_CFG_WRITE_0:
             # config type 0
 
             if not self.config_space_enable:
-                print("Configuraion space disabled")
+                trace(TRACE_ERROR, None, "Configuraion space disabled")
 
                 cpl = TLP()
                 cpl.set_crs_completion(tlp, (self.bus_num, self.device_num, 0))
                 # logging
-                print("[%s] CRS Completion: %s" % (highlight(self.get_desc()), repr(cpl)))
+                trace(TRACE_TLP, self, "CRS Completion: %r", cpl)
                 yield from self.upstream_send(cpl)
                 return
             elif tlp.dest_id.device == self.device_num:
@@ -119,15 +120,15 @@ class UltrascalePlusPCIe(Device):
                         return
 
                 #raise Exception("Function not found")
-                print("Function not found")
+                trace(TRACE_ERROR, None, "Function not found")
             else:
-                print("Device number mismatch")
+                trace(TRACE_ERROR, None, "Device number mismatch")
             
             # Unsupported request
             cpl = TLP()
             cpl.set_ur_completion(tlp, (self.bus_num, self.device_num, 0))
             # logging
-            print("[%s] UR Completion: %s" % (highlight(self.get_desc()), repr(cpl)))
+            trace(TRACE_TLP, self, "UR Completion: %r", cpl)
             yield from self.upstream_send(cpl)
         elif (tlp.fmt_type == TLP_CPL or tlp.fmt_type == TLP_CPL_DATA or
                 tlp.fmt_type == TLP_CPL_LOCKED or tlp.fmt_type == TLP_CPL_LOCKED_DATA):
@@ -148,9 +149,9 @@ class UltrascalePlusPCIe(Device):
 
                         return
 
-                print("Function not found")
+                trace(TRACE_ERROR, None, "Function not found")
             else:
-                print("Bus/device number mismatch")
+                trace(TRACE_ERROR, None, "Bus/device number mismatch")
         elif (tlp.fmt_type == TLP_IO_READ or tlp.fmt_type == TLP_IO_WRITE):
             # IO read/write
 
@@ -166,13 +167,13 @@ class UltrascalePlusPCIe(Device):
 
                     return
 
-            print("IO request did not match any BARs")
+            trace(TRACE_ERROR, None, "IO request did not match any BARs")
 
             # Unsupported request
             cpl = TLP()
             cpl.set_ur_completion(tlp, (self.bus_num, self.device_num, 0))
             # logging
-            print("[%s] UR Completion: %s" % (highlight(self.get_desc()), repr(cpl)))
+            trace(TRACE_TLP, self, "UR Completion: %r", cpl)
             yield from self.upstream_send(cpl)
         elif (tlp.fmt_type == TLP_MEM_READ or tlp.fmt_type == TLP_MEM_READ_64 or
                 tlp.fmt_type == TLP_MEM_WRITE or tlp.fmt_type == TLP_MEM_WRITE_64):
@@ -193,14 +194,14 @@ class UltrascalePlusPCIe(Device):
 
                     return
 
-            print("Memory request did not match any BARs")
+            trace(TRACE_ERROR, None, "Memory request did not match any BARs")
 
             if tlp.fmt_type == TLP_MEM_READ or tlp.fmt_type == TLP_MEM_READ_64:
                 # Unsupported request
                 cpl = TLP()
                 cpl.set_ur_completion(tlp, PcieId(self.bus_num, self.device_num, 0))
                 # logging
-                print("[%s] UR Completion: %s" % (highlight(self.get_desc()), repr(cpl)))
+                trace(TRACE_TLP, self, "UR Completion: %r", cpl)
                 yield from self.upstream_send(cpl)
         else:
             raise Exception("TODO")
@@ -413,9 +414,10 @@ class UltrascalePlusPCIe(Device):
 
         # TODO change this when support added
         assert self.alignment == 'dword'
-        assert not self.cq_cc_straddle
-        assert not self.rq_rc_straddle
-        assert not self.rc_4tlp_straddle
+        if self.dw != 512:
+            # straddle only modeled for 512-bit interface
+            assert not self.cq_cc_straddle
+            assert not self.rq_rc_straddle
 
         if self.pcie_generation == 1:
             if self.pcie_link_width in [1, 2]:
@@ -680,7 +682,8 @@ class UltrascalePlusPCIe(Device):
             tvalid=m_axis_cq_tvalid,
             tready=m_axis_cq_tready,
             name='cq_source',
-            pause=cq_pause
+            pause=cq_pause,
+            straddle=self.cq_cc_straddle
         )
 
         cc_sink_logic = self.cc_sink.create_logic(
@@ -693,7 +696,8 @@ class UltrascalePlusPCIe(Device):
             tvalid=s_axis_cc_tvalid,
             tready=s_axis_cc_tready,
             name='cc_sink',
-            pause=cc_pause
+            pause=cc_pause,
+            straddle=self.cq_cc_straddle
         )
 
         rq_sink_logic = self.rq_sink.create_logic(
@@ -706,7 +710,8 @@ class UltrascalePlusPCIe(Device):
             tvalid=s_axis_rq_tvalid,
             tready=s_axis_rq_tready,
             name='rq_sink',
-            pause=rq_pause
+            pause=rq_pause,
+            straddle=self.rq_rc_straddle
         )
 
         rc_source_logic = self.rc_source.create_logic(
@@ -719,7 +724,9 @@ class UltrascalePlusPCIe(Device):
             tvalid=m_axis_rc_tvalid,
             tready=m_axis_rc_tready,
             name='rc_source',
-            pause=rc_pause
+            pause=rc_pause,
+            straddle=self.rq_rc_straddle,
+            straddle_4tlp=self.rc_4tlp_straddle
         )
 
         if self.user_clk_frequency == 62.5e6:
@@ -760,13 +767,13 @@ class UltrascalePlusPCIe(Device):
                 # handle completer requests
                 # send any queued non-posted requests first
                 while self.cq_np_queue and self.cq_np_req_count > 0:
-                    tlp = self.cq_np_queue.pop(0)
+                    tlp = self.cq_np_queue.popleft()
                     self.cq_np_req_count -= 1
                     self.cq_source.send(tlp.pack_us_cq())
 
                 # handle new requests
                 while self.cq_queue:
-                    tlp = self.cq_queue.pop(0)
+                    tlp = self.cq_queue.popleft()
 
                     if (tlp.fmt_type == TLP_IO_READ or tlp.fmt_type == TLP_IO_WRITE or
                             tlp.fmt_type == TLP_MEM_READ or tlp.fmt_type == TLP_MEM_READ_64):
@@ -810,26 +817,26 @@ class UltrascalePlusPCIe(Device):
                             self.rq_seq_num.append(tlp.seq_num)
                             yield from self.send(TLP(tlp))
                         else:
-                            print("Bus mastering disabled")
+                            trace(TRACE_ERROR, None, "Bus mastering disabled")
 
                             # TODO: internal response
 
                 # transmit sequence number
                 pcie_rq_seq_num_vld0.next = 0
                 if self.rq_seq_num:
-                    pcie_rq_seq_num0.next = self.rq_seq_num.pop(0)
+                    pcie_rq_seq_num0.next = self.rq_seq_num.popleft()
                     pcie_rq_seq_num_vld0.next = 1
 
                 pcie_rq_seq_num_vld1.next = 0
                 if self.rq_seq_num:
-                    pcie_rq_seq_num1.next = self.rq_seq_num.pop(0)
+                    pcie_rq_seq_num1.next = self.rq_seq_num.popleft()
                     pcie_rq_seq_num_vld1.next = 1
 
                 # TODO pcie_rq_tag
 
                 # handle requester completions
                 while self.rc_queue:
-                    tlp = self.rc_queue.pop(0)
+                    tlp = self.rc_queue.popleft()
                     self.rc_source.send(tlp.pack_us_rc())
 
                 # transmit flow control
@@ -0,0 +1,79 @@
+"""
+
+Copyright (c) 2021 Alex Forencich
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+
+from collections import deque
+
+
+class TagPool:
+    """Transaction tag allocator with a free list
+
+    8-bit tags are allocated from 0-255, 10-bit tags from 256-1023 (tag
+    values with the two upper bits clear are not used with 10-bit tags)"""
+    def __init__(self, count=32, tag_bits=8):
+        if tag_bits not in (8, 10):
+            raise ValueError("Tag width must be 8 or 10 bits")
+
+        self.tag_bits = tag_bits
+        self.first_tag = 256 if tag_bits == 10 else 0
+        self.max_count = (1 << tag_bits) - self.first_tag
+
+        self.count = 0
+        self.free = deque()
+        self.active = [False]*(1 << tag_bits)
+        self.active_count = 0
+
+        # statistics
+        self.alloc_count = 0
+        self.stall_count = 0
+        self.max_active = 0
+
+        self.resize(count)
+
+    def resize(self, count):
+        self.count = max(1, min(count, self.max_count))
+        self.free = deque(tag for tag in range(self.first_tag, self.first_tag+self.count) if not self.active[tag])
+
+    def alloc(self):
+        # returns None when all tags are in use
+        if not self.free:
+            return None
+
+        tag = self.free.popleft()
+        self.active[tag] = True
+        self.active_count += 1
+        self.alloc_count += 1
+        if self.active_count > self.max_active:
+            self.max_active = self.active_count
+        return tag
+
+    def release(self, tag):
+        assert self.active[tag]
+        self.active[tag] = False
+        self.active_count -= 1
+        if tag < self.first_tag+self.count:
+            self.free.append(tag)
+
+    def empty(self):
+        return not self.free
@@ -84,6 +84,17 @@ def bench():
     def clkgen():
         clk.next = not clk
 
+    alloc_start = Signal(bool(0))
+    alloc_tags = []
+
+    @instance
+    def tag_alloc():
+        while True:
+            yield alloc_start
+            if alloc_start:
+                tag = yield from rc.alloc_tag()
+                alloc_tags.append(tag)
+
     @instance
     def check():
         yield delay(100)
@@ -245,6 +256,102 @@ def bench():
 
         yield delay(100)
 
+        yield clk.posedge
+        print("test 8: tag exhaustion and reuse")
+        current_test.next = 8
+
+        rc.tag_pool.resize(4)
+
+        tags = []
+        for k in range(4):
+            tag = yield from rc.alloc_tag()
+            tags.append(tag)
+
+        assert sorted(tags) == [0, 1, 2, 3]
+        assert rc.tag_pool.empty()
+
+        stall_count = rc.tag_pool.stall_count
+
+        # allocation blocks until a tag is released
+        alloc_start.next = 1
+        yield delay(100)
+        assert not alloc_tags
+        assert rc.tag_pool.stall_count == stall_count+1
+
+        rc.release_tag(tags[2])
+        yield delay(100)
+        assert alloc_tags == [tags[2]]
+        alloc_start.next = 0
+
+        for tag in tags:
+            rc.release_tag(tag)
+
+        assert rc.tag_pool.active_count == 0
+
+        # late completion after a timeout must not be seen by the next owner of the tag
+        rc.tag_pool.resize(1)
+
+        yield from rc.mem_write(0x80000000, bytearray(range(16)), 1000)
+        yield delay(1000)
+
+        try:
+            yield from rc.mem_read(0x80000000, 16, 1)
+        except Exception as ex:
+            assert str(ex) == "Timeout"
+        else:
+            assert False, "read did not time out"
+
+        yield delay(1000)
+        assert rc.rx_cpl_queues[0]
+
+        yield from rc.mem_write(0x80000000, bytearray(range(16, 32)), 1000)
+        yield delay(1000)
+
+        val = yield from rc.mem_read(0x80000000, 16, 1000)
+        assert val == bytearray(range(16, 32))
+
+        rc.tag_pool.resize(256)
+
+        yield delay(100)
+
+        yield clk.posedge
+        print("test 9: flow control credits")
+        current_test.next = 9
+
+        # limit posted and non-posted credits at the endpoint and completion
+        # credits at the root port, 128 byte TLPs use 8 data credits
+        rp_port = dev.upstream_port.other
+
+        dev.upstream_port.set_fc_limits(ph=2, pd=16, nph=1, update_latency=200)
+        rp_port.set_fc_limits(cplh=2, cpld=16, update_latency=200)
+
+        rp_stall_count = rp_port.fc_stall_count
+        ep_stall_count = dev.upstream_port.fc_stall_count
+
+        test_data = bytearray(range(256))*16
+
+        yield from rc.mem_write(0x8000000000000000, test_data, 1000)
+        yield delay(10000)
+        assert ep.read_region(1, 0, len(test_data)) == test_data
+
+        val = yield from rc.mem_read(0x8000000000000000, len(test_data), 10000)
+        assert val == test_data
+
+        yield delay(1000)
+
+        # requests stalled on endpoint credits, completions on root port credits
+        assert rp_port.fc_stall_count > rp_stall_count
+        assert dev.upstream_port.fc_stall_count > ep_stall_count
+
+        # all credits returned
+        assert rp_port.fc_hdr_consumed == [0]*3 and rp_port.fc_data_consumed == [0]*3
+        assert dev.upstream_port.fc_hdr_consumed == [0]*3 and dev.upstream_port.fc_data_consumed == [0]*3
+
+        dev.upstream_port.set_fc_limits()
+        rp_port.set_fc_limits()
+
+        yield delay(100)
+
         raise StopSimulation
 
     return instances()
@@ -24,6 +24,7 @@ THE SOFTWARE.
 """
 
 from myhdl import *
+import random
 import struct
 import os
 
@@ -913,12 +914,161 @@ def bench():
 
     return instances()
 
+def straddle_bench():
+
+    # Parameters
+    dw = 512
+
+    # Inputs
+    clk = Signal(bool(0))
+    rst = Signal(bool(0))
+    current_test = Signal(intbv(0)[8:])
+
+    # source, sink, straddle layout, byte enables, extra create_logic arguments
+    interfaces = [
+        ('cq', pcie_usp.CQSource(), pcie_usp.CQSink(), pcie_usp.CQ_STRADDLE, True, {'straddle': True}),
+        ('cc', pcie_usp.CCSource(), pcie_usp.CCSink(), pcie_usp.CC_STRADDLE, False, {'straddle': True}),
+        ('rq', pcie_usp.RQSource(), pcie_usp.RQSink(), pcie_usp.RQ_STRADDLE, False, {'straddle': True}),
+        ('rc', pcie_usp.RCSource(), pcie_usp.RCSink(), pcie_usp.RC_STRADDLE, True, {'straddle': True}),
+        ('rc_4tlp', pcie_usp.RCSource(), pcie_usp.RCSink(), pcie_usp.RC_4TLP_STRADDLE, True, {'straddle': True, 'straddle_4tlp': True}),
+    ]
+
+    # most TLPs started in a single beat, per interface
+    max_sop = {}
+
+    source_pause = Signal(bool(0))
+    sink_pause = Signal(bool(0))
+
+    def monitor(name, layout, tuser, tvalid, tready):
+        max_sop[name] = 0
+
+        @instance
+        def logic():
+            while True:
+                yield clk.posedge
+
+                if tvalid and tready:
+                    sop = bin((int(tuser) >> layout.is_sop) & ((1 << layout.max_tlps)-1)).count('1')
+                    max_sop[name] = max(max_sop[name], sop)
+
+        return logic
+
+    logic = []
+
+    for name, source, sink, layout, byte_en, kwargs in interfaces:
+        tdata = Signal(intbv(0)[dw:])
+        tuser = Signal(intbv(0)[layout.tuser_width:])
+        tlast = Signal(bool(0))
+        tkeep = Signal(intbv(0)[int(dw/32):])
+        tvalid = Signal(bool(0))
+        tready = Signal(bool(0))
+
+        logic.append(source.create_logic(
+            clk,
+            rst,
+            tdata=tdata,
+            tuser=tuser,
+            tlast=tlast,
+            tkeep=tkeep,
+            tvalid=tvalid,
+            tready=tready,
+            pause=source_pause,
+            **kwargs
+        ))
+
+        logic.append(sink.create_logic(
+            clk,
+            rst,
+            tdata=tdata,
+            tuser=tuser,
+            tlast=tlast,
+            tkeep=tkeep,
+            tvalid=tvalid,
+            tready=tready,
+            pause=sink_pause,
+            **kwargs
+        ))
+
+        logic.append(monitor(name, layout, tuser, tvalid, tready))
+
+    @always(delay(5))
+    def clkgen():
+        clk.next = not clk
+
+    @instance
+    def check():
+        yield delay(100)
+        yield clk.posedge
+        rst.next = 1
+        yield clk.posedge
+        rst.next = 0
+        yield clk.posedge
+        yield delay(100)
+        yield clk.posedge
+
+        rng = random.Random(1)
+
+        for name, source, sink, layout, byte_en, kwargs in interfaces:
+            yield clk.posedge
+            print("test: %s straddle" % name)
+            current_test.next += 1
+
+            # single dword TLPs fill every straddle slot, followed by a mix
+            # of TLPs sharing a beat and TLPs spanning several beats
+            test_frames = []
+
+            for k in range(72):
+                frame = pcie_usp.USPcieFrame()
+                length = 1 if k < 8 else rng.choice([1, 2, 3, 4, 5, 8, 9, 12, 16, 17, 33])
+                frame.data = [rng.getrandbits(32) for i in range(length)]
+                if byte_en:
+                    frame.byte_en = [rng.getrandbits(4) for i in range(length)]
+                frame.first_be = rng.getrandbits(4)
+                frame.last_be = rng.getrandbits(4)
+                frame.update_parity()
+                test_frames.append(frame)
+                source.send(frame)
+
+            for test_frame in test_frames:
+                while sink.empty():
+                    yield clk.posedge
+                    source_pause.next = rng.random() < 0.2
+                    sink_pause.next = rng.random() < 0.2
+
+                rx_frame = sink.recv()
+
+                assert rx_frame.data == test_frame.data
+                assert rx_frame.parity == test_frame.parity
+                if byte_en:
+                    assert rx_frame.byte_en == test_frame.byte_en
+                if name in ('cq', 'rq'):
+                    assert rx_frame.first_be == test_frame.first_be
+                    assert rx_frame.last_be == test_frame.last_be
+
+            source_pause.next = 0
+            sink_pause.next = 0
+
+            yield delay(100)
+
+            assert sink.empty()
+            assert max_sop[name] == (4 if kwargs.get('straddle_4tlp') else 2)
+
+        raise StopSimulation
+
+    return instances()
+
 def test_bench():
     os.chdir(os.path.dirname(os.path.abspath(__file__)))
     sim = Simulation(bench())
     sim.run()
 
+def test_straddle():
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sim = Simulation(straddle_bench())
+    sim.run()
+
 if __name__ == '__main__':
     print("Running test...")
     test_bench()
+    test_straddle()
 